@@ -0,0 +1,16 @@
+""" Banc de mesure des fonctions de données et de rendu du dashboard.
+
+    Les scénarios (benchmarks.scenarios) rejouent des réponses enregistrées des
+    API du Grand Lyon (benchmarks/fixtures/, sans réseau) et chronomètrent
+    séparément chaque étape : téléchargement et décodage, nettoyage, agrégation,
+    rendu. Chaque étape est aussi exécutée une fois sous tracemalloc pour mesurer
+    son pic de mémoire. Les données peuvent être démultipliées (--echelle 10 :
+    dix fois plus de stations, d'arrêts, de tracés) et l'historique allongé
+    (--jours 365).
+
+    Les résultats sont enregistrés par commit dans benchmarks/resultats/ et
+    comparés au dernier commit ancêtre mesuré avec les mêmes paramètres.
+
+    Enregistrement des réponses :   python -m benchmarks enregistrer
+    Mesure :                        python -m benchmarks [--echelle 10] [--jours 365] [scénarios...]
+    Comparaison :                   python -m benchmarks comparer [référence] [commit]"""
@@ -0,0 +1,102 @@
+""" python -m benchmarks [scénarios...] [--echelle N] [--jours N] [--repetitions N]
+    python -m benchmarks enregistrer [jeux de données...]
+    python -m benchmarks comparer [référence] [commit]"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks import fixtures, mesure, scenarios
+
+
+def run(args):
+    parametres = {'echelle': args.echelle, 'jours': args.jours}
+    textes = fixtures.get_textes(args.echelle, args.fixtures)
+    app = scenarios.load_app()
+    resultats = {}
+    repertoire = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='benchmarks-') as travail, fixtures.replay(textes):
+        os.chdir(travail)
+        try:
+            for scenario in scenarios.get_scenarios(app, args.jours, args.echelle):
+                if args.scenarios and scenario.nom not in args.scenarios:
+                    continue
+                manquants = [name for name in scenario.requis if name not in textes]
+                if manquants:
+                    print(f"{scenario.nom} : ignoré, réponses non enregistrées : {', '.join(manquants)}")
+                    continue
+                scenarios.clean_workdir()
+                base = {}
+                if scenario.installer is not None:
+                    scenario.installer(base)
+                resultats[scenario.nom] = mesure.run(scenario.etapes, lambda: dict(base), args.repetitions)
+        finally:
+            os.chdir(repertoire)
+
+    if not resultats:
+        print("Aucun scénario mesuré (python -m benchmarks enregistrer)")
+        return 1
+    reference = mesure.find_reference(parametres)
+    lignes = mesure.compare(reference, resultats)
+    if reference is not None:
+        print(f"référence : {reference['commit']} ({reference['date']})")
+    print(mesure.format_lignes(lignes, resultats))
+    if not args.sans_enregistrement:
+        print(mesure.save(resultats, parametres))
+    return 2 if any(ligne[-1] for ligne in lignes) else 0
+
+
+def record(args):
+    for name, octets in fixtures.record(args.noms or None, args.fixtures).items():
+        print(f'{name:18} {octets / 1e3:10.0f} ko')
+    return 0
+
+
+def compare(args):
+    parametres = {'echelle': args.echelle, 'jours': args.jours}
+    commit = args.commit or mesure.get_commit()
+    cible = mesure.read(mesure.get_filename(commit, parametres))
+    if cible is None:
+        print(f"Pas de résultats pour {commit} (--echelle {args.echelle} --jours {args.jours})")
+        return 1
+    if args.reference:
+        reference = mesure.read(mesure.get_filename(args.reference, parametres))
+    else:
+        reference = mesure.find_reference(parametres, commit.replace('-dirty', ''))
+    if reference is None:
+        print("Pas de résultats de référence")
+        return 1
+    print(f"{reference['commit']} -> {cible['commit']}")
+    lignes = mesure.compare(reference, cible['resultats'])
+    print(mesure.format_lignes(lignes, cible['resultats']))
+    return 2 if any(ligne[-1] for ligne in lignes) else 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    commun = argparse.ArgumentParser(add_help=False)
+    commun.add_argument('--echelle', type=int, default=1, help="facteur de démultiplication des stations, arrêts, tracés")
+    commun.add_argument('--jours', type=int, default=7, help="jours d'historique")
+    commun.add_argument('--fixtures', default=fixtures.FIXTURES_DIR, help="dossier des réponses enregistrées")
+
+    if argv[:1] == ['enregistrer']:
+        parser = argparse.ArgumentParser(prog='python -m benchmarks enregistrer', parents=[commun])
+        parser.add_argument('noms', nargs='*', help=f"jeux de données ({', '.join(fixtures.URLS)})")
+        return record(parser.parse_args(argv[1:]))
+    if argv[:1] == ['comparer']:
+        parser = argparse.ArgumentParser(prog='python -m benchmarks comparer', parents=[commun])
+        parser.add_argument('reference', nargs='?', help="commit de référence (défaut : dernier ancêtre mesuré)")
+        parser.add_argument('commit', nargs='?', help="commit comparé (défaut : commit courant)")
+        return compare(parser.parse_args(argv[1:]))
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', parents=[commun],
+                                     description="Mesure des fonctions de données et de rendu du dashboard")
+    parser.add_argument('scenarios', nargs='*', help="scénarios à mesurer (défaut : tous)")
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--sans-enregistrement', action='store_true', help="n'enregistre pas les résultats")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
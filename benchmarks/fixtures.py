@@ -0,0 +1,262 @@
+""" Réponses enregistrées des API du Grand Lyon, rejouées sans réseau, et démultipliées
+    pour les mesures à grande échelle.
+
+    Une réponse par jeu de données (clé de api.WS_DATASETS, ou wfs.<couche>) :
+    benchmarks/fixtures/<clé>.json.gz, le JSON tel que renvoyé par l'API."""
+
+import contextlib
+import gzip
+import json
+import os
+import tomllib
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from grand_lyon import api, historique, rejeu
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(REPO_DIR, 'benchmarks', 'fixtures')
+SECRETS = os.path.join(REPO_DIR, '.streamlit', 'secrets.toml')
+PARCS_CSV = os.path.join(REPO_DIR, historique.PARCS_CSV)
+
+# jeux de données enregistrés : clé -> URL
+URLS = {**{name: api.ws_url(name) for name in api.WS_DATASETS},
+        **{f'wfs.{layer}': api.wfs_url(layer) for layer in api.WFS_LAYERS}}
+# jeux de données dont l'accès demande une authentification
+AUTH = ['passages_tram']
+
+# décalage (degrés) entre deux copies d'une station, d'un arrêt ou d'un tracé
+DECALAGE = 0.05
+
+
+def get_path(name, root=FIXTURES_DIR):
+    return os.path.join(root, f'{name}.json.gz')
+
+
+def get_auth():
+    """ Authentification de l'API (secrets Streamlit, sinon variables d'environnement)"""
+
+    secrets = {}
+    if os.path.exists(SECRETS):
+        with open(SECRETS, 'rb') as f:
+            secrets = tomllib.load(f)
+    return api.get_auth(secrets.get('USERNAME'), secrets.get('PASSWORD'))
+
+
+def record(names=None, root=FIXTURES_DIR):
+    """ Télécharge et enregistre les réponses des jeux de données `names` (tous par défaut)
+        Retourne {clé: octets enregistrés}"""
+
+    os.makedirs(root, exist_ok=True)
+    tailles = {}
+    for name in names or URLS:
+        data = api.get_json(URLS[name], auth=get_auth() if name in AUTH else None)
+        tmp = get_path(name, root) + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, get_path(name, root))
+        tailles[name] = os.path.getsize(get_path(name, root))
+    return tailles
+
+
+def available(root=FIXTURES_DIR):
+    """ Clés des réponses enregistrées"""
+
+    return [name for name in URLS if os.path.exists(get_path(name, root))]
+
+
+def load_text(name, root=FIXTURES_DIR):
+    with gzip.open(get_path(name, root), 'rt', encoding='utf-8') as f:
+        return f.read()
+
+
+def get_name(url):
+    """ Clé du jeu de données demandé par `url`"""
+
+    parsed = urlparse(url)
+    typename = parse_qs(parsed.query).get('typename')
+    for name, dataset in api.WS_DATASETS.items():
+        if f'/{dataset}/' in parsed.path:
+            return name
+    for layer, dataset in api.WFS_LAYERS.items():
+        if typename and typename[0] == dataset:
+            return f'wfs.{layer}'
+    raise KeyError(url)
+
+
+@contextlib.contextmanager
+def replay(textes):
+    """ Remplace api.get_json et api.get_chunks : les réponses sont décodées à chaque appel
+        depuis `textes` {clé: JSON (str)}, comme si elles venaient du réseau. Les requêtes WFS
+        projetées, filtrées ou paginées sont appliquées à la couche comme par le serveur
+        (rejeu.query_wfs)."""
+
+    couches = {}
+
+    def get_texte(url):
+        name = get_name(url)
+        query = {k.lower(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+        if not rejeu.is_query_wfs(name, query):
+            return textes[name]
+        if name not in couches:
+            couches[name] = json.loads(textes[name])
+        return json.dumps(rejeu.query_wfs(couches[name], query), ensure_ascii=False)
+
+    def get_chunks(url, auth=None):
+        texte = get_texte(url)
+        return (texte[i:i + api.CHUNK_SIZE] for i in range(0, len(texte), api.CHUNK_SIZE))
+
+    get_json, get_chunks_reseau = api.get_json, api.get_chunks
+    api.get_json = lambda url, auth=None: json.loads(get_texte(url))
+    api.get_chunks = get_chunks
+    try:
+        yield
+    finally:
+        api.get_json, api.get_chunks = get_json, get_chunks_reseau
+
+
+# --- démultiplication -------------------------------------------------------
+
+def get_copies(echelle):
+    """ Décalages (lat, lon) des copies : grille autour de l'original"""
+
+    cote = int(np.ceil(np.sqrt(echelle)))
+    return [((k // cote) * DECALAGE, (k % cote) * DECALAGE) for k in range(echelle)]
+
+
+def scale_values(data, echelle, copier):
+    """ {'values': [...]} -> échelle copies de chaque valeur, copier(valeur, k, (dlat, dlon))"""
+
+    if echelle == 1:
+        return data
+    values = [copier(dict(v), k, d) for k, d in enumerate(get_copies(echelle)) for v in data['values']]
+    return dict(data, values=values)
+
+
+def copy_velov(v, k, d):
+    if k:
+        v['number'] = int(v['number']) + 100_000 * k
+        v['name'] = f"{v.get('name') or ''} ({k})"
+        v['lat'] = float(v['lat']) + d[0]
+        v['lng'] = float(v['lng']) + d[1]
+    return v
+
+
+def copy_parc(v, k, d):
+    if k:
+        v['id'] = f"{v['id']}-{k}"
+        v['nom'] = f"{v['nom']} ({k})"
+    return v
+
+
+def copy_passage(v, k, d):
+    if k:
+        v['id'] = int(v['id']) + 1_000_000 * k
+    return v
+
+
+def move(coords, d):
+    """ Décale des coordonnées GeoJSON (listes imbriquées de [lon, lat])"""
+
+    if coords and isinstance(coords[0], (int, float)):
+        return [coords[0] + d[1], coords[1] + d[0]] + list(coords[2:])
+    return [move(c, d) for c in coords]
+
+
+def scale_features(data, echelle, ids=('id',), codes=('code_ligne', 'ligne')):
+    """ Collection GeoJSON -> échelle copies décalées de chaque feature"""
+
+    if echelle == 1:
+        return data
+    features = []
+    for k, d in enumerate(get_copies(echelle)):
+        for feature in data['features']:
+            props = dict(feature['properties'])
+            if k:
+                for key in ids:
+                    if key in props:
+                        props[key] = int(props[key]) + 1_000_000 * k
+                for key in codes:
+                    if key in props:
+                        props[key] = f'{props[key]}-{k}'
+            geometry = dict(feature['geometry'], coordinates=move(feature['geometry']['coordinates'], d))
+            features.append(dict(feature, properties=props, geometry=geometry))
+    return dict(data, features=features)
+
+
+COPIES = {'velov_tr': lambda data, e: scale_values(data, e, copy_velov),
+          'parcs_relais_tr': lambda data, e: scale_values(data, e, copy_parc),
+          'passages_tram': lambda data, e: scale_values(data, e, copy_passage),
+          'wfs.arrets': scale_features,
+          # tracés : lignes copiées sous un autre code (les lignes de tram gardent leur nom)
+          'wfs.tram': lambda data, e: scale_features(data, e, ids=(), codes=('code_ligne',)),
+          'wfs.bus': lambda data, e: scale_features(data, e, ids=()),
+          'wfs.metro': lambda data, e: scale_features(data, e, ids=())}
+
+
+def get_textes(echelle=1, root=FIXTURES_DIR):
+    """ Réponses enregistrées, démultipliées `echelle` fois
+        Retourne {clé: JSON (str)}"""
+
+    textes = {}
+    for name in available(root):
+        texte = load_text(name, root)
+        if echelle > 1:
+            texte = json.dumps(COPIES[name](json.loads(texte), echelle), ensure_ascii=False)
+        textes[name] = texte
+    return textes
+
+
+# --- historiques ------------------------------------------------------------
+
+def get_historique_parcs(jours, echelle=1, csv=PARCS_CSV, seed=0):
+    """ Historique brut des parcs relais sur `jours` jours : la semaine de janvier 2022
+        répétée (avec un bruit de quelques places) et démultipliée `echelle` fois
+        Retourne un DataFrame (colonnes du csv)"""
+
+    rng = np.random.default_rng(seed)
+    semaine = pd.read_csv(csv, index_col=[0]).reset_index(drop=True)
+    dates = pd.to_datetime(semaine['timestamp'], utc=True)
+    parts = []
+    for w in range(int(np.ceil(jours / 7))):
+        decale = dates + pd.Timedelta(days=7 * w)
+        garder = ((decale - dates.min()) < pd.Timedelta(days=jours)).to_numpy()
+        part = semaine[garder].copy()
+        part['timestamp'] = decale[garder].dt.tz_convert('Europe/Paris').astype(str).to_numpy()
+        if w:
+            bruit = rng.integers(-5, 6, len(part))
+            part['nb_tot_place_dispo'] = (part['nb_tot_place_dispo'] + bruit).clip(0, part['capacite'])
+        parts.append(part)
+    df = pd.concat(parts, ignore_index=True)
+    if echelle > 1:
+        df = pd.concat([df] + [df.assign(nom=df['nom'] + f' ({k})', id=df['id'].astype(str) + f'-{k}')
+                               for k in range(1, echelle)], ignore_index=True)
+    return df
+
+
+def get_historique_velov(velov_tr, jours, pas='30min', seed=0):
+    """ Historique brut des Vélo'v sur `jours` jours, un relevé toutes les `pas`, pour les
+        stations du relevé temps réel `velov_tr` (DataFrame, temps_reel.get_df_velov_tr) :
+        remplissage journalier propre à chaque station, plus un bruit
+        Retourne un DataFrame (colonnes du csv velov_concat)"""
+
+    rng = np.random.default_rng(seed)
+    stations = velov_tr[['number', 'name', 'commune', 'bike_stands']].reset_index(drop=True)
+    bornes = pd.to_numeric(stations['bike_stands'], errors='coerce').fillna(20).to_numpy()
+    phase = rng.uniform(0, 2 * np.pi, len(stations))
+    instants = pd.date_range('2022-01-17', periods=int(pd.Timedelta(days=jours) / pd.Timedelta(pas)), freq=pas,
+                             tz='Europe/Paris')
+    heures = (instants.hour + instants.minute / 60).to_numpy()
+    taux = 0.5 + 0.3 * np.sin(2 * np.pi * heures[:, None] / 24 + phase[None]) + rng.normal(0, 0.1, (len(instants), len(stations)))
+    places = np.round(np.clip(taux, 0, 1) * bornes[None]).astype('int64')
+    n = len(instants)
+    return pd.DataFrame({'timestamp': np.repeat(instants.astype(str), len(stations)),
+                         'number': np.tile(stations['number'].to_numpy(), n),
+                         'name': np.tile(stations['name'].to_numpy(), n),
+                         'commune': np.tile(stations['commune'].to_numpy(), n),
+                         'bike_stands': np.tile(bornes, n),
+                         'available_bike_stands': places.ravel(),
+                         'available_bikes': (bornes[None] - places).ravel()})
@@ -0,0 +1,149 @@
+""" Chronométrage des étapes, pic de mémoire, enregistrement et comparaison des résultats."""
+
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTATS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'resultats')
+# une étape est signalée si sa médiane dépasse celle de la référence de plus de SEUIL
+# (et d'au moins SEUIL_MS millisecondes)
+SEUIL = 0.2
+SEUIL_MS = 1.0
+
+
+class Etape:
+    """ Étape d'un scénario : fonction(contexte) dont le résultat est gardé dans contexte[nom]"""
+
+    def __init__(self, nom, fonction, froid=None):
+        self.nom = nom
+        self.fonction = fonction
+        # remise à zéro des caches avant l'étape (mesure à froid)
+        self.froid = froid
+
+
+def run_etape(etape, contexte):
+    if etape.froid is not None:
+        etape.froid()
+    debut = time.perf_counter()
+    contexte[etape.nom] = etape.fonction(contexte)
+    return (time.perf_counter() - debut) * 1e3
+
+
+def run(scenario, preparer, repetitions=5):
+    """ Exécute `repetitions` fois les étapes du scénario (préparées par preparer() -> contexte),
+        puis une fois sous tracemalloc
+        Retourne {étape: {'median_ms', 'min_ms', 'pic_mo'}}"""
+
+    durees = {etape.nom: [] for etape in scenario}
+    for _ in range(repetitions):
+        contexte = preparer()
+        for etape in scenario:
+            durees[etape.nom].append(run_etape(etape, contexte))
+
+    # mémoire : pic de chaque étape, au-dessus de ce qui est déjà alloué
+    pics = {}
+    contexte = preparer()
+    tracemalloc.start()
+    try:
+        for etape in scenario:
+            tracemalloc.reset_peak()
+            avant = tracemalloc.get_traced_memory()[0]
+            run_etape(etape, contexte)
+            pics[etape.nom] = (tracemalloc.get_traced_memory()[1] - avant) / 1e6
+    finally:
+        tracemalloc.stop()
+
+    return {nom: {'median_ms': round(statistics.median(d), 3), 'min_ms': round(min(d), 3),
+                  'pic_mo': round(pics[nom], 2)}
+            for nom, d in durees.items()}
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True, cwd=REPO_DIR).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def get_commit():
+    """ Commit courant (abrégé), suivi de -dirty si l'arbre de travail est modifié"""
+
+    commit = git('rev-parse', '--short=10', 'HEAD') or 'inconnu'
+    return commit + '-dirty' if git('status', '--porcelain', '--untracked-files=no') else commit
+
+
+def get_filename(commit, parametres, root=RESULTATS_DIR):
+    return os.path.join(root, f"{commit}-x{parametres['echelle']}-j{parametres['jours']}.json")
+
+
+def save(resultats, parametres, root=RESULTATS_DIR):
+    """ Enregistre les résultats du commit courant, retourne le nom du fichier"""
+
+    os.makedirs(root, exist_ok=True)
+    commit = get_commit()
+    filename = get_filename(commit, parametres, root)
+    precedents = read(filename) or {'resultats': {}}
+    data = {'commit': commit,
+            'date': dt.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.platform(),
+            'parametres': parametres,
+            # les scénarios non relancés gardent leur dernière mesure
+            'resultats': {**precedents['resultats'], **resultats}}
+    tmp = filename + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, ensure_ascii=False)
+    os.replace(tmp, filename)
+    return filename
+
+
+def read(filename):
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def find_reference(parametres, commit='HEAD', root=RESULTATS_DIR):
+    """ Résultats du dernier commit ancêtre de `commit` (exclu) mesuré avec les mêmes paramètres, ou None"""
+
+    for ancetre in git('rev-list', '--abbrev-commit', '--abbrev=10', commit).split()[1:]:
+        data = read(get_filename(ancetre, parametres, root))
+        if data is not None:
+            return data
+    return None
+
+
+def compare(reference, resultats):
+    """ Lignes de comparaison (scénario, étape, référence, mesure, rapport, régression)"""
+
+    lignes = []
+    for scenario, etapes in resultats.items():
+        for etape, mesure in etapes.items():
+            ref = reference['resultats'].get(scenario, {}).get(etape) if reference else None
+            if ref is None:
+                lignes.append((scenario, etape, None, mesure['median_ms'], None, False))
+                continue
+            rapport = mesure['median_ms'] / ref['median_ms'] if ref['median_ms'] else None
+            regression = (mesure['median_ms'] > ref['median_ms'] * (1 + SEUIL)
+                          and mesure['median_ms'] - ref['median_ms'] > SEUIL_MS)
+            lignes.append((scenario, etape, ref['median_ms'], mesure['median_ms'], rapport, regression))
+    return lignes
+
+
+def format_lignes(lignes, resultats):
+    sortie = [f"{'scénario':16} {'étape':28} {'réf. ms':>10} {'ms':>10} {'rapport':>8} {'pic Mo':>8}"]
+    for scenario, etape, ref, ms, rapport, regression in lignes:
+        pic = resultats[scenario][etape]['pic_mo']
+        sortie.append(f"{scenario:16} {etape:28} {'' if ref is None else f'{ref:10.2f}':>10} {ms:10.2f} "
+                      f"{'' if rapport is None else f'{rapport:7.2f}x':>8} {pic:8.1f}"
+                      + ('   RÉGRESSION' if regression else ''))
+    return '\n'.join(sortie)
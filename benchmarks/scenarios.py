@@ -0,0 +1,196 @@
+""" Scénarios mesurés : une suite d'étapes par page du dashboard.
+
+    Les fonctions du dashboard sont chargées depuis streamlit_app.py sans exécuter
+    les pages (load_app). Chaque scénario est exécuté dans un dossier de travail
+    temporaire : les fichiers dérivés (Parquet, table des arrêts, modèles de
+    prévision, tuiles) y sont recréés, jamais ceux du dépôt."""
+
+import ast
+import os
+import shutil
+import types
+
+import pandas as pd
+
+from benchmarks import fixtures
+from benchmarks.mesure import Etape
+from grand_lyon import (api, arrets, carte_live, cubes, historique, prevision, proximite, temps_reel, traces,
+                        tuiles, wfs)
+from grand_lyon.cache import fetch_cache
+from grand_lyon.rendu import render_cache, to_html
+from grand_lyon.tram import clean_passages, read_passages
+
+
+APP = os.path.join(fixtures.REPO_DIR, 'streamlit_app.py')
+# position des requêtes "près de moi" (Guillotière)
+POSITION = (45.75540611072912, 4.842535168843551)
+CENTRE_VELOV = [45.7548790164649, 4.84367508189202]
+# jour des graphiques, s'il est dans l'historique généré
+JOUR = 'Lundi'
+
+
+def load_app(path=APP):
+    """ Module des fonctions du dashboard : imports, fonctions et affectations qui ne
+        dépendent pas de Streamlit (les pages et les secrets ne sont pas exécutés)"""
+
+    tree = ast.parse(open(path, encoding='utf-8').read())
+    garder = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+            garder.append(node)
+        elif isinstance(node, ast.Assign) and not any(isinstance(n, ast.Name) and n.id == 'st'
+                                                      for n in ast.walk(node.value)):
+            garder.append(node)
+    app = types.ModuleType('streamlit_app')
+    app.USERNAME, app.PASSWORD = None, None
+    exec(compile(ast.Module(garder, type_ignores=[]), path, 'exec'), app.__dict__)
+    return app
+
+
+class Scenario:
+    """ Étapes d'une page, jeux de données enregistrés nécessaires,
+        installation faite une fois avant les mesures : installer(contexte)"""
+
+    def __init__(self, nom, etapes, requis=(), installer=None):
+        self.nom = nom
+        self.etapes = etapes
+        self.requis = list(requis)
+        self.installer = installer
+
+
+def reset_arrets():
+    arrets._arrets, arrets._meta, arrets._checked_at = None, {}, 0
+    for filename in [arrets.ARRETS_FILE, arrets.META_FILE]:
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def reset_caches():
+    fetch_cache.invalidate()
+    render_cache.clear()
+
+
+def write_csv(df, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    df.to_csv(filename)
+
+
+def train(name, releves, key):
+    """ Entraîne et enregistre le modèle de prévision du flux `name` dans le dossier de travail"""
+
+    os.makedirs(prevision.DATA_DIR, exist_ok=True)
+    modele = prevision.train(prevision.get_series(releves.astype({key: str}), key))
+    modele.save(prevision.get_filename(name))
+    return modele
+
+
+def get_jour(cube):
+    """ JOUR, ou le premier jour présent dans le cube (historique de moins d'une semaine)"""
+
+    jours = cube.entities('jour')
+    return JOUR if JOUR in jours else jours[0]
+
+
+def get_scenarios(app, jours=7, echelle=1):
+    """ Scénarios de mesure, pour un historique de `jours` jours"""
+
+    def installer_velov(c):
+        velov = temps_reel.get_df_velov_tr()
+        historique_velov = historique.clean_velov(fixtures.get_historique_velov(velov, min(jours, 14)))
+        train('velov', historique_velov[['dateTime', 'number', 'taux_remplissage']], 'number')
+
+    def installer_velov_historique(c):
+        write_csv(fixtures.get_historique_velov(temps_reel.get_df_velov_tr(), jours), historique.VELOV_CSV)
+
+    def installer_parcs(c):
+        write_csv(fixtures.get_historique_parcs(jours, echelle), historique.PARCS_CSV)
+
+    def installer_parcs_tr(c):
+        parcs = historique.clean_parcs_relais(fixtures.get_historique_parcs(min(jours, 14), echelle))
+        train('parcs_relais', parcs[['dateTime', 'nom', 'taux_remplissage']], 'nom')
+
+    def installer_tram(c):
+        c['passages'] = app.get_passages_tram()
+        premier = c['passages'].iloc[0]
+        c['ligne'], c['terminus'] = premier['ligne'], premier['direction']
+
+    def etat_tram(c):
+        p = app.get_passages_ligne(c['passages'], c['ligne'], c['terminus'])
+        static = carte_live.get_static_tram(p, None, c['ligne'], c['terminus'], app.centre_lignes[c['ligne']], set())
+        return static, carte_live.get_etat_tram(p)
+
+    def lines_dict(c):
+        return traces.get_lines_dict(c['fetch-parse'])
+
+    velov_tr = Scenario('velov_tr', [
+        Etape('fetch-parse', lambda c: temps_reel.get_df_velov_tr()),
+        Etape('prévision', lambda c: prevision.prevoir_velov(c['fetch-parse'])),
+        Etape('état carte live', lambda c: (carte_live.get_static_velov(c['fetch-parse'], CENTRE_VELOV),
+                                            carte_live.get_etat_velov(c['fetch-parse'], c['prévision']))),
+        Etape('près de moi', lambda c: app.get_velov_proches(c['fetch-parse'], *POSITION),
+              froid=proximite._indexes.clear),
+    ], requis=['velov_tr'], installer=installer_velov)
+
+    passages_tram = Scenario('passages_tram', [
+        Etape('arrêts fetch-parse', lambda c: arrets.get_arrets(), froid=reset_arrets),
+        Etape('fetch-parse', lambda c: pd.json_normalize(api.get_json(api.ws_url('passages_tram')),
+                                                         record_path='values')),
+        Etape('nettoyage', lambda c: clean_passages(c['fetch-parse'])),
+        Etape('lecture en flux', lambda c: read_passages(api.get_chunks(api.ws_url('passages_tram')))),
+        Etape('nettoyage sous-ensemble', lambda c: clean_passages(c['lecture en flux'])),
+        Etape('get_passages_tram', lambda c: app.get_passages_tram()),
+        Etape('tracés tram', lambda c: app.get_json_tram(), froid=reset_caches),
+        Etape('état carte live', etat_tram),
+        Etape('arrêts proches', lambda c: app.get_arrets_proches(c['passages'], *POSITION),
+              froid=proximite._indexes.clear),
+    ], requis=['passages_tram', 'wfs.arrets', 'wfs.tram'], installer=installer_tram)
+
+    parcs_relais = Scenario('parcs_relais', [
+        Etape('nettoyage', lambda c: historique.ingest(historique.PARCS_CSV, historique.PARCS_PARQUET,
+                                                       historique.clean_parcs_relais, index_col=[0])),
+        Etape('lecture', lambda c: app.get_df_parcs_relais()),
+        Etape('agrégation', lambda c: cubes.Cube.build(c['lecture'], cubes.CLES_PARCS)),
+        Etape('prévision entraînement', lambda c: train(
+            'parcs_relais', historique.load_parcs_relais(['dateTime', 'nom', 'taux_remplissage']), 'nom')),
+        Etape('graphique tous', lambda c: app.get_graph_pr_tous(c['agrégation'], get_jour(c['agrégation']))),
+        Etape('graphique un parc', lambda c: app.get_graph_pr(c['agrégation'], c['agrégation'].entities('nom')[0],
+                                                              get_jour(c['agrégation']))),
+    ], installer=installer_parcs)
+
+    parcs_relais_tr = Scenario('parcs_relais_tr', [
+        Etape('fetch-parse', lambda c: temps_reel.get_df_parcs_relais_tr()),
+        Etape('prévision', lambda c: prevision.prevoir_parcs_relais(c['fetch-parse'])),
+    ], requis=['parcs_relais_tr'], installer=installer_parcs_tr)
+
+    velov_historique = Scenario('velov_historique', [
+        Etape('nettoyage', lambda c: historique.ingest(historique.VELOV_CSV, historique.VELOV_PARQUET,
+                                                       historique.clean_velov)),
+        Etape('lecture', lambda c: app.get_df_velov()),
+        Etape('agrégation', lambda c: cubes.Cube.build(c['lecture'], cubes.CLES_VELOV)),
+        Etape('graphique communes', lambda c: app.get_graph_velov_communes(c['agrégation'], get_jour(c['agrégation']))),
+        Etape('graphique une commune', lambda c: app.get_graph_velov_unecommune(
+            c['agrégation'], get_jour(c['agrégation']), c['agrégation'].entities('commune')[0])),
+        Etape('graphique une station', lambda c: app.get_graph_velov_unestation(
+            c['agrégation'], get_jour(c['agrégation']), *c['agrégation'].data[['commune', 'name']].iloc[0])),
+    ], requis=['velov_tr'], installer=installer_velov_historique)
+
+    reseau = Scenario('traces', [
+        Etape('fetch-parse', lambda c: wfs.get_layers(['tram', 'bus', 'metro']), froid=reset_caches),
+        Etape('topologies', lambda c: traces.get_topologies(lines_dict(c))),
+        Etape('tuiles', lambda c: tuiles.build(traces.get_geometries(lines_dict(c)), 'mesure')),
+        Etape('rendu carte tuiles', lambda c: to_html(traces.build_map(lines_dict(c), version_tuiles='mesure'))),
+        Etape('rendu carte brute', lambda c: to_html(traces.build_map(lines_dict(c)))),
+    ], requis=['wfs.tram', 'wfs.bus', 'wfs.metro'], installer=lambda c: os.makedirs(tuiles.TUILES_DIR, exist_ok=True))
+
+    return [velov_tr, passages_tram, parcs_relais, parcs_relais_tr, velov_historique, reseau]
+
+
+def clean_workdir():
+    """ Vide le dossier de travail (fichiers dérivés du scénario précédent)"""
+
+    for folder in [historique.DATA_DIR, tuiles.STATIC_DIR]:
+        shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(historique.DATA_DIR)
+    reset_arrets()
+    reset_caches()
+    proximite._indexes.clear()
@@ -0,0 +1,5 @@
+""" Back end partagé du dashboard des transports du Grand Lyon.
+
+    Les modules de ce paquet sont importés une seule fois par processus :
+    contrairement à streamlit_app.py, qui est ré-exécuté à chaque interaction,
+    leur état (caches, sessions HTTP...) est commun à toutes les sessions."""
@@ -0,0 +1,176 @@
+""" Accès aux API du Grand Lyon : session HTTP partagée et téléchargements en parallèle.
+
+    Toutes les requêtes passent par une même `requests.Session` (connexions
+    keep-alive réutilisées). Les couches WFS sont demandées par grand_lyon.wfs
+    (propriétés utiles seulement, pages en parallèle) et mises en cache. Quasi
+    statiques, leurs réponses sont aussi gardées sur disque et revalidées par
+    requêtes conditionnelles (grand_lyon.cache_http).
+
+    L'adresse des API se règle par la variable d'environnement GRAND_LYON_URL,
+    par exemple pour utiliser le serveur de rejeu local (grand_lyon.rejeu) :
+        GRAND_LYON_URL=http://127.0.0.1:8765 streamlit run streamlit_app.py"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import json
+import os
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from grand_lyon.cache_http import cache_http
+from grand_lyon.metriques import etape, metriques
+
+
+BASE_URL = os.environ.get('GRAND_LYON_URL', "https://download.data.grandlyon.com").rstrip('/')
+TIMEOUT = 30
+# taille des morceaux des réponses lues en flux (octets)
+CHUNK_SIZE = 1 << 16
+# géocodage des adresses (Base Adresse Nationale)
+GEOCODAGE_URL = "https://api-adresse.data.gouv.fr/search/"
+CENTRE_LYON = (45.75540611072912, 4.842535168843551)
+
+# couches WFS utilisées par le dashboard
+WFS_LAYERS = {'tram': 'tcl_sytral.tcllignetram_2_0_0',
+              'bus': 'tcl_sytral.tcllignebus_2_0_0',
+              'metro': 'tcl_sytral.tcllignemf_2_0_0',
+              'arrets': 'tcl_sytral.tclarret'}
+
+# jeux de données temps réel (ws/rdata)
+WS_DATASETS = {'velov_tr': 'jcd_jcdecaux.jcdvelov',
+               'passages_tram': 'tcl_sytral.tclpassagearret',
+               'parcs_relais_tr': 'tcl_sytral.tclparcrelaisst'}
+
+# jeux de données gardés par le cache HTTP sur disque (quasi statiques)
+CACHE_HTTP = {f'wfs.{layer}' for layer in WFS_LAYERS}
+
+_session = None
+_session_lock = threading.Lock()
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='grand_lyon_api')
+
+
+def wfs_url(layer):
+    """ URL GeoJSON de la couche WFS `layer` (clé de WFS_LAYERS)"""
+
+    return (f"{BASE_URL}/wfs/rdata?SERVICE=WFS&VERSION=2.0.0&request=GetFeature"
+            f"&typename={WFS_LAYERS[layer]}&outputFormat=application/json; subtype=geojson"
+            "&SRSNAME=EPSG:4171&startIndex=0")
+
+
+def ws_url(dataset):
+    """ URL JSON complète du jeu de données temps réel `dataset` (clé de WS_DATASETS)"""
+
+    return f"{BASE_URL}/ws/rdata/{WS_DATASETS[dataset]}/all.json?maxfeatures=-1&start=1"
+
+
+def get_name(url):
+    """ Clé du jeu de données demandé par `url` (WS_DATASETS, ou wfs.<couche>), ou None"""
+
+    parsed = urlparse(url)
+    if parsed.path.startswith('/ws/rdata/'):
+        for name, dataset in WS_DATASETS.items():
+            if parsed.path.startswith(f'/ws/rdata/{dataset}/'):
+                return name
+    if parsed.path.rstrip('/') == '/wfs/rdata':
+        query = {k.lower(): v for k, v in parse_qs(parsed.query).items()}
+        typename = (query.get('typename') or query.get('typenames') or [None])[0]
+        for layer, dataset in WFS_LAYERS.items():
+            if typename == dataset:
+                return f'wfs.{layer}'
+    return None
+
+
+def get_session():
+    """ Session HTTP unique du processus, avec un pool de connexions keep-alive"""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+def get_auth(username=None, password=None):
+    """ Authentification des jeux de données protégés (passages) : identifiants donnés, sinon
+        variables d'environnement GRAND_LYON_USERNAME / GRAND_LYON_PASSWORD
+        Retourne None sans identifiants (le serveur de rejeu n'en demande pas)"""
+
+    username = username or os.environ.get('GRAND_LYON_USERNAME')
+    password = password or os.environ.get('GRAND_LYON_PASSWORD')
+    return HTTPBasicAuth(username, password) if username and password else None
+
+
+def read_cache_http(url, auth, name, fonction):
+    """ Contenu de la réponse à `url` (bytes), lu dans le cache HTTP sur disque ou revalidé"""
+
+    with etape('cache_http', fonction) as mesure:
+        contenu = cache_http.get(url, lambda entetes: get_session().get(url, auth=auth, headers=entetes,
+                                                                      timeout=TIMEOUT), name)
+        mesure.octets = len(contenu)
+    return contenu
+
+
+def get_json(url, auth=None):
+    """ Télécharge `url` via la session partagée (ou la lit dans le cache HTTP sur disque),
+        retourne le JSON décodé"""
+
+    name = get_name(url)
+    fonction = f'api.get_json[{name or urlparse(url).path}]'
+    if name in CACHE_HTTP and cache_http.actif:
+        contenu = read_cache_http(url, auth, name, fonction)
+        with etape('json.loads', fonction):
+            return json.loads(contenu)
+    with etape('requests.get', fonction) as mesure:
+        r = get_session().get(url, auth=auth, timeout=TIMEOUT)
+        r.raise_for_status()
+        mesure.octets = len(r.content)
+    with etape('r.json()', fonction):
+        return r.json()
+
+
+def get_chunks(url, auth=None):
+    """ Télécharge `url` en flux via la session partagée (ou la lit dans le cache HTTP sur disque)
+        Retourne un itérateur des morceaux de la réponse (bytes), au fil de leur réception"""
+
+    name = get_name(url)
+    fonction = f'api.get_json[{name or urlparse(url).path}]'
+    if name in CACHE_HTTP and cache_http.actif:
+        # réponse entière, déjà sur disque : découpée en morceaux pour le décodage en flux
+        contenu = read_cache_http(url, auth, name, fonction)
+        for i in range(0, len(contenu), CHUNK_SIZE):
+            yield contenu[i:i + CHUNK_SIZE]
+        return
+    with etape('requests.get', fonction):
+        r = get_session().get(url, auth=auth, timeout=TIMEOUT, stream=True)
+        r.raise_for_status()
+    debut = time.perf_counter()
+    octets = 0
+    with r:
+        for chunk in r.iter_content(CHUNK_SIZE):
+            octets += len(chunk)
+            yield chunk
+    # lecture entrecoupée du décodage des morceaux : pas d'étape ouverte pendant les yield
+    metriques.add(fonction, 'lecture en flux', time.perf_counter() - debut, octets=octets)
+
+
+@lru_cache(maxsize=256)
+def geocode(adresse):
+    """ Coordonnées de l'adresse la plus probable, en privilégiant la métropole de Lyon
+        Retourne (lat, lon, libellé) ou None"""
+
+    params = {'q': adresse, 'limit': 1, 'lat': CENTRE_LYON[0], 'lon': CENTRE_LYON[1]}
+    r = get_session().get(GEOCODAGE_URL, params=params, timeout=TIMEOUT)
+    r.raise_for_status()
+    features = r.json().get('features')
+    if not features:
+        return None
+    lon, lat = features[0]['geometry']['coordinates']
+    return lat, lon, features[0]['properties'].get('label', adresse)
@@ -0,0 +1,122 @@
+""" Table de référence locale des points d'arrêt TCL (couche tcl_sytral.tclarret).
+
+    Les arrêts ne changent presque jamais : la table (nom, coordonnées, lignes
+    desservies) est enregistrée dans data_grand_lyon/arrets.csv, indexée par id
+    d'arrêt. Elle est rafraîchie au plus une fois par REFRESH_INTERVAL, en ne
+    demandant au WFS que les arrêts dont `last_update` est plus récent que le
+    dernier connu ; un téléchargement complet (qui détecte aussi les arrêts
+    supprimés) a lieu une fois par FULL_REFRESH_INTERVAL. Si le WFS est
+    injoignable, la table connue reste servie jusqu'à l'essai suivant."""
+
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+import requests
+
+from grand_lyon import wfs
+
+
+DATA_DIR = 'data_grand_lyon'
+ARRETS_FILE = os.path.join(DATA_DIR, 'arrets.csv')
+META_FILE = os.path.join(DATA_DIR, 'arrets.json')
+REFRESH_INTERVAL = 3600
+FULL_REFRESH_INTERVAL = 7 * 24 * 3600
+
+COLONNES = ['nom', 'lon', 'lat', 'desserte', 'last_update']
+
+_lock = threading.Lock()
+_arrets = None
+_meta = {}
+_checked_at = 0
+
+logger = logging.getLogger(__name__)
+
+
+def get_df_arrets(features):
+    """ Input = features GeoJSON de tclarret
+        Retourne un DataFrame indexé par id d'arrêt"""
+
+    if not features:
+        return pd.DataFrame(columns=COLONNES, index=pd.Index([], name='id', dtype='int64'))
+
+    df = pd.json_normalize(features)
+    arrets = pd.DataFrame({'id': df['properties.id'].astype('int64'),
+                           'nom': df['properties.nom'].str.replace('St', 'Saint', regex=False),
+                           'lon': df['geometry.coordinates'].str[0].astype('float64'),
+                           'lat': df['geometry.coordinates'].str[1].astype('float64'),
+                           'desserte': df.get('properties.desserte'),
+                           'last_update': df.get('properties.last_update')})
+    arrets = arrets.set_index('id')
+    return arrets[~arrets.index.duplicated(keep='last')]
+
+
+def read_arrets():
+    """ Retourne la table enregistrée et ses métadonnées, ou (None, {})"""
+
+    try:
+        arrets = pd.read_csv(ARRETS_FILE, index_col='id')
+        with open(META_FILE, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None, {}
+    return arrets, meta
+
+
+def write_arrets(arrets, meta):
+    tmp = ARRETS_FILE + '.tmp'
+    arrets.to_csv(tmp)
+    os.replace(tmp, ARRETS_FILE)
+    tmp = META_FILE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp, META_FILE)
+
+
+def refresh(arrets, meta, full=False):
+    """ Met à jour la table : complète si `full` ou si la table est absente,
+        incrémentale (arrêts modifiés depuis le dernier last_update) sinon"""
+
+    if not full and arrets is not None and len(arrets):
+        last_update = arrets['last_update'].dropna().max()
+        try:
+            # arrêts modifiés depuis le dernier last_update connu
+            nouveaux = get_df_arrets(wfs.read_features('arrets', filtre=('>', 'last_update', last_update)))
+        except (requests.RequestException, ValueError, KeyError):
+            # filtre refusé par le serveur : téléchargement complet
+            return refresh(arrets, meta, full=True)
+        arrets = pd.concat([arrets.drop(nouveaux.index, errors='ignore'), nouveaux])
+        return arrets.sort_index(), meta
+
+    arrets = get_df_arrets(wfs.read_features('arrets'))
+    meta = dict(meta, full_refresh_at=time.time())
+    return arrets.sort_index(), meta
+
+
+def get_arrets():
+    """ Retourne la table des arrêts (DataFrame indexé par id), rafraîchie si nécessaire.
+        La table est partagée : ne pas la modifier en place."""
+
+    global _arrets, _meta, _checked_at
+    with _lock:
+        if _arrets is not None and time.time() - _checked_at < REFRESH_INTERVAL:
+            return _arrets
+
+        arrets, meta = (_arrets, _meta) if _arrets is not None else read_arrets()
+        full = time.time() - meta.get('full_refresh_at', 0) >= FULL_REFRESH_INTERVAL
+        try:
+            arrets, meta = refresh(arrets, meta, full=full)
+        except (requests.RequestException, ValueError) as e:
+            if arrets is None:
+                raise
+            # WFS injoignable : table connue servie, nouvel essai dans REFRESH_INTERVAL
+            logger.warning("rafraîchissement des arrêts impossible (%s) : table connue conservée", e)
+        else:
+            write_arrets(arrets, meta)
+        _arrets, _meta = arrets, meta
+        _checked_at = time.time()
+        return _arrets
+
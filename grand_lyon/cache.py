@@ -0,0 +1,135 @@
+""" Cache des appels aux API temps réel, partagé par toutes les sessions Streamlit.
+
+    Chaque jeu de données a sa propre durée de fraîcheur (TTL). Passé ce délai,
+    la valeur périmée reste servie pendant `stale_ttl` secondes, le temps qu'un
+    thread d'arrière-plan la rafraîchisse (stale-while-revalidate).
+    Un seul téléchargement est lancé à la fois par jeu de données (single-flight) :
+    les sessions concurrentes attendent et partagent son résultat."""
+
+import threading
+import time
+
+
+# durées de fraîcheur par défaut (secondes)
+DEFAULT_TTLS = {'velov_tr': 60,
+                'parcs_relais_tr': 60,
+                'passages_tram': 30,
+                # couches WFS (tracés, arrêts) : quasi statiques
+                'wfs.tram': 3600,
+                'wfs.bus': 3600,
+                'wfs.metro': 3600,
+                'wfs.arrets': 3600}
+DEFAULT_TTL = 60
+STALE_TTL = 300
+
+
+class _Entry:
+    """ Valeur en cache et date de son téléchargement"""
+
+    def __init__(self, value, fetched_at):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class _Flight:
+    """ Téléchargement en cours, attendu par les sessions concurrentes"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class FetchCache:
+    """ Cache TTL + stale-while-revalidate + single-flight.
+        Les valeurs retournées sont partagées entre sessions : ne pas les modifier en place."""
+
+    def __init__(self, ttls=None, default_ttl=DEFAULT_TTL, stale_ttl=STALE_TTL, clock=time.monotonic):
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._flights = {}
+        self._stats = {}
+
+    def ttl(self, key):
+        return self.ttls.get(key, self.default_ttl)
+
+    def get(self, key, fetch):
+        """ Retourne la valeur en cache pour `key`,
+            en appelant `fetch()` si elle est absente ou trop ancienne"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            now = self._clock()
+            if entry is not None:
+                age = now - entry.fetched_at
+                if age < self.ttl(key):
+                    self._count(key, 'hits')
+                    return entry.value
+                if age < self.ttl(key) + self.stale_ttl:
+                    # valeur périmée servie immédiatement, rafraîchie en arrière-plan
+                    self._count(key, 'stale')
+                    if key not in self._flights:
+                        flight = self._flights[key] = _Flight()
+                        threading.Thread(target=self._run, args=(key, fetch, flight), daemon=True).start()
+                    return entry.value
+
+            self._count(key, 'misses')
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._count(key, 'coalesced')
+
+        if leader:
+            self._run(key, fetch, flight)
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _run(self, key, fetch, flight):
+        """ Exécute le téléchargement et publie son résultat"""
+
+        try:
+            flight.value = fetch()
+        except Exception as e:
+            flight.error = e
+        with self._lock:
+            if flight.error is None:
+                self._entries[key] = _Entry(flight.value, self._clock())
+                self._count(key, 'fetches')
+            else:
+                self._count(key, 'errors')
+            del self._flights[key]
+        flight.done.set()
+
+    def _count(self, key, name):
+        counters = self._stats.setdefault(key, {'hits': 0, 'stale': 0, 'misses': 0,
+                                                'coalesced': 0, 'fetches': 0, 'errors': 0})
+        counters[name] += 1
+
+    def invalidate(self, key=None):
+        """ Oublie la valeur de `key` (ou de tous les jeux de données)"""
+
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """ Compteurs par jeu de données, pour dimensionner les TTL"""
+
+        with self._lock:
+            return {key: dict(counters, ttl=self.ttl(key)) for key, counters in self._stats.items()}
+
+
+# instance unique du processus
+fetch_cache = FetchCache()
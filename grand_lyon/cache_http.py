@@ -0,0 +1,230 @@
+""" Cache HTTP sur disque des couches quasi statiques (tracés des lignes, arrêts).
+
+    Chaque réponse est enregistrée compressée (gzip) dans data_grand_lyon/http/,
+    avec ses validateurs (ETag, Last-Modified) : le cache survit aux
+    redémarrages du serveur Streamlit. Selon l'âge de sa dernière validation,
+    une réponse enregistrée est :
+    - servie sans requête pendant `fraicheur` secondes ;
+    - puis servie tout de suite et revalidée en arrière-plan pendant `perime`
+      secondes (stale-while-revalidate, une seule revalidation à la fois par URL) ;
+    - au-delà (ou après invalidate()), revalidée avant d'être servie ; si la
+      revalidation échoue (serveur injoignable), elle est servie telle quelle.
+    La revalidation est une requête conditionnelle (If-None-Match /
+    If-Modified-Since) : si rien n'a changé, elle ne coûte qu'un aller-retour
+    (304). Une réponse modifiée remplace l'entrée et appelle on_change(nom),
+    qui oublie la couche du fetch_cache : la prochaine demande la relit.
+
+    Les pages d'une même couche sont revalidées une à une : pendant une
+    revalidation, des pages anciennes et nouvelles peuvent être mêlées, jusqu'à
+    la revalidation suivante. Désactivé par GRAND_LYON_CACHE_HTTP=0."""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from grand_lyon.cache import fetch_cache
+from grand_lyon.metriques import metriques
+
+
+DATA_DIR = 'data_grand_lyon'
+CACHE_DIR = os.path.join(DATA_DIR, 'http')
+# secondes après une validation : réponse servie sans requête
+FRAICHEUR = 3600
+# secondes suivantes : réponse servie, revalidée en arrière-plan
+PERIME = 7 * 24 * 3600
+# entrées non validées depuis PURGE secondes : supprimées
+PURGE = 30 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class CacheHttp:
+    """ Réponses HTTP enregistrées sur disque, revalidées par requêtes conditionnelles"""
+
+    def __init__(self, root=CACHE_DIR, fraicheur=FRAICHEUR, perime=PERIME, on_change=None, actif=True,
+                 clock=time.time):
+        self.root = root
+        self.fraicheur = fraicheur
+        self.perime = perime
+        self.on_change = on_change
+        self.actif = actif
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flights = set()
+        self._stats = {}
+        self._purge_faite = False
+
+    def get_path(self, url):
+        """ Fichiers (réponse compressée, métadonnées) de l'entrée de `url`"""
+
+        cle = hashlib.sha1(url.encode('utf-8')).hexdigest()[:24]
+        return os.path.join(self.root, f'{cle}.json.gz'), os.path.join(self.root, f'{cle}.meta.json')
+
+    def get(self, url, fetch, nom=None):
+        """ Contenu de la réponse à `url` (bytes), depuis le disque si possible
+            fetch(entetes) -> requests.Response : requête (conditionnelle si `entetes`)
+            nom : jeu de données (compteurs, on_change)"""
+
+        nom = nom or url
+        meta, contenu = self.read(url)
+        if meta is not None:
+            age = self._clock() - meta['valide_le']
+            if age < self.fraicheur:
+                self._count(nom, 'hits')
+                return contenu
+            if age < self.fraicheur + self.perime:
+                self._count(nom, 'stale')
+                with self._lock:
+                    lancer = url not in self._flights
+                    self._flights.add(url)
+                if lancer:
+                    threading.Thread(target=self._revalidate, args=(url, fetch, nom, meta), daemon=True).start()
+                return contenu
+        self._count(nom, 'misses')
+        try:
+            nouveau = self.revalidate(url, fetch, nom, meta)
+        except Exception as e:
+            if meta is None:
+                raise
+            # serveur injoignable : la réponse enregistrée reste servie, revalidée à la prochaine demande
+            logger.warning("revalidation de %s impossible (%s) : réponse enregistrée servie", nom, e)
+            return contenu
+        return contenu if nouveau is None else nouveau
+
+    def revalidate(self, url, fetch, nom, meta=None):
+        """ Requête conditionnelle si `meta` est donné, sinon complète
+            Retourne le nouveau contenu, ou None si la réponse enregistrée est toujours valide"""
+
+        entetes = {}
+        if meta is not None and meta.get('etag'):
+            entetes['If-None-Match'] = meta['etag']
+        if meta is not None and meta.get('last_modified'):
+            entetes['If-Modified-Since'] = meta['last_modified']
+        debut = time.perf_counter()
+        try:
+            r = fetch(entetes)
+            if r.status_code == 304 and meta is not None:
+                metriques.add('cache_http', '304', time.perf_counter() - debut)
+                self._count(nom, 'not_modified')
+                self.write_meta(url, dict(meta, valide_le=self._clock(),
+                                          etag=r.headers.get('ETag') or meta.get('etag')))
+                return None
+            r.raise_for_status()
+        except Exception:
+            metriques.add('cache_http', 'erreur', time.perf_counter() - debut, erreur=True)
+            self._count(nom, 'errors')
+            raise
+        metriques.add('cache_http', '200', time.perf_counter() - debut, octets=len(r.content))
+        self._count(nom, 'fetches')
+        self.write(url, r, nom)
+        return r.content
+
+    def _revalidate(self, url, fetch, nom, meta):
+        """ Revalidation d'arrière-plan : l'erreur est journalisée, la réponse enregistrée reste servie"""
+
+        try:
+            if self.revalidate(url, fetch, nom, meta) is not None and self.on_change is not None:
+                self.on_change(nom)
+        except Exception as e:
+            logger.warning("revalidation de %s impossible : %s", nom, e)
+        finally:
+            with self._lock:
+                self._flights.discard(url)
+
+    def read(self, url):
+        """ Retourne (métadonnées, contenu) de l'entrée de `url`, ou (None, None)"""
+
+        if not self.actif:
+            return None, None
+        donnees, metadonnees = self.get_path(url)
+        try:
+            with open(metadonnees, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(donnees, 'rb') as f:
+                return meta, gzip.decompress(f.read())
+        except (OSError, ValueError, EOFError):
+            return None, None
+
+    def write(self, url, r, nom=None):
+        """ Enregistre la réponse `r` à `url`, compressée, avec ses validateurs"""
+
+        if not self.actif:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        donnees, _ = self.get_path(url)
+        tmp = f'{donnees}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(gzip.compress(r.content, compresslevel=6))
+        os.replace(tmp, donnees)
+        self.write_meta(url, {'url': url, 'nom': nom, 'etag': r.headers.get('ETag'),
+                              'last_modified': r.headers.get('Last-Modified'),
+                              'valide_le': self._clock(), 'octets': len(r.content)})
+        if not self._purge_faite:
+            self._purge_faite = True
+            self.purge()
+
+    def write_meta(self, url, meta):
+        if not self.actif:
+            return
+        _, metadonnees = self.get_path(url)
+        tmp = f'{metadonnees}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, metadonnees)
+
+    def invalidate(self, nom=None):
+        """ Fait revalider avant usage les entrées du jeu de données `nom` (ou toutes)"""
+
+        if not os.path.isdir(self.root):
+            return
+        for filename in os.listdir(self.root):
+            if not filename.endswith('.meta.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, filename), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if nom is None or meta.get('nom') == nom:
+                self.write_meta(meta['url'], dict(meta, valide_le=0))
+
+    def purge(self, age=PURGE):
+        """ Supprime les entrées non validées depuis `age` secondes (requêtes qui ne sont plus faites)
+            Retourne le nombre d'entrées supprimées"""
+
+        supprimees = 0
+        limite = self._clock() - age
+        for filename in os.listdir(self.root):
+            if not filename.endswith('.meta.json'):
+                continue
+            path = os.path.join(self.root, filename)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    ancienne = json.load(f)['valide_le'] < limite
+                if ancienne:
+                    os.remove(path[:-len('.meta.json')] + '.json.gz')
+                    os.remove(path)
+                    supprimees += 1
+            except (OSError, ValueError, KeyError):
+                continue
+        return supprimees
+
+    def _count(self, nom, name):
+        with self._lock:
+            counters = self._stats.setdefault(nom, {'hits': 0, 'stale': 0, 'misses': 0, 'not_modified': 0,
+                                                    'fetches': 0, 'errors': 0})
+            counters[name] += 1
+
+    def stats(self):
+        """ Compteurs par jeu de données : réponses servies du disque, revalidations (304 / 200)"""
+
+        with self._lock:
+            return {nom: dict(counters) for nom, counters in self._stats.items()}
+
+
+# instance unique du processus : une couche modifiée est oubliée du fetch_cache
+cache_http = CacheHttp(on_change=fetch_cache.invalidate, actif=os.environ.get('GRAND_LYON_CACHE_HTTP') != '0')
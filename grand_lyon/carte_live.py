@@ -0,0 +1,121 @@
+""" Carte temps réel persistante (composant Streamlit) mise à jour par deltas.
+
+    Le composant (frontend/carte_live/index.html, Leaflet) charge une seule fois
+    les couches statiques : positions des stations, tracé de la ligne. Aux
+    actualisations suivantes, il ne reçoit que l'état qui a changé depuis le
+    dernier envoi (quelques entiers par station), appliqué sur les marqueurs
+    existants : pas de rechargement de la page, le zoom et la position sont
+    conservés.
+
+    Chaque envoi porte un numéro (`seq`) et le numéro de l'état auquel le delta
+    s'applique (`base`). Le serveur suppose que le navigateur a appliqué le
+    dernier envoi : appliquer un envoi ne renvoie rien à Streamlit (pas de
+    réexécution du script). Seul un delta inapplicable (iframe recréée après un
+    changement de page, par exemple) produit une demande d'envoi complet
+    ({'demande': '<iframe>:<n>'}, unique par iframe) ; une demande pas encore
+    servie donne un envoi complet.
+
+    La valeur du composant porte aussi la dernière position choisie sur la carte
+    (clic ou géolocalisation) : {'position': [lat, lon]} (get_position). Les
+    repères (position et stations mises en évidence) sont envoyés à chaque
+    affichage, hors deltas."""
+
+import os
+
+import streamlit.components.v1 as components
+
+from grand_lyon.rendu import get_digest
+
+
+FRONTEND_DIR = os.path.join(os.path.dirname(__file__), 'frontend', 'carte_live')
+
+# état d'une station Vélo'v : [vélos, places, code(, vélos prévus)] avec code 0 = OK, 1 = fermée, 2 = sans données
+VELOV_OK, VELOV_FERMEE, VELOV_SANS_DONNEES = 0, 1, 2
+
+_component = components.declare_component('carte_live', path=FRONTEND_DIR)
+
+
+def get_static_velov(df, centre):
+    """ Couche statique des Vélo'v : [numéro, lat, lng, nom] par station"""
+
+    nom = df['name'].fillna('').astype(str)
+    nom = nom.where(nom != '', df['address'].fillna('').astype(str))
+    stations = [[str(n), round(lat, 6), round(lng, 6), s]
+                for n, lat, lng, s in zip(df['number'], df['lat'], df['lng'], nom)]
+    return {'kind': 'velov', 'vue': 'velov', 'centre': centre, 'stations': stations}
+
+
+def get_etat_velov(df, velos_prevus=None):
+    """ État des Vélo'v : {numéro: [vélos, places, code]}
+        velos_prevus (Series alignée sur df, grand_lyon.prevision) : ajoute les vélos prévus
+        (None si pas de prévision pour la station)"""
+
+    velos = df['available_bikes'].fillna(0).astype(int)
+    places = df['available_bike_stands'].fillna(0).astype(int)
+    code = (df['status'] == 'CLOSED').astype(int) * VELOV_FERMEE
+    code = code.where(code > 0, (df['availability'].fillna('').astype(str) == '').astype(int) * VELOV_SANS_DONNEES)
+    etat = {str(n): [int(v), int(p), int(c)] for n, v, p, c in zip(df['number'], velos, places, code)}
+    if velos_prevus is not None:
+        for n, prevu in zip(df['number'], velos_prevus):
+            etat[str(n)].append(None if prevu != prevu else int(prevu))
+    return etat
+
+
+def get_static_tram(p, geometry, ligne, terminus, centre, terminus_noms):
+    """ Couche statique d'une ligne de tram : tracé, [id, lat, lon, nom, terminus] par station"""
+
+    stations = [[str(i), round(lon_lat[1], 6), round(lon_lat[0], 6), nom, nom in terminus_noms]
+                for i, nom, lon_lat in zip(p['id'], p['properties.nom'], p['geometry.coordinates'])]
+    return {'kind': 'tram', 'vue': f'{ligne}|{terminus}', 'centre': centre, 'terminus': terminus,
+            'geometry': geometry, 'stations': stations}
+
+
+def get_etat_tram(p):
+    """ État d'une ligne de tram : {id: délai du prochain passage}"""
+
+    return {str(i): delai for i, delai in zip(p['id'], p['delaipassage'])}
+
+
+def get_delta(previous, current):
+    """ Différence entre deux états : clés modifiées ou ajoutées, clés supprimées"""
+
+    changed = {k: v for k, v in current.items() if previous.get(k) != v}
+    removed = [k for k in previous if k not in current]
+    return {'set': changed, 'del': removed}
+
+
+def get_position(key, session_state):
+    """ Dernière position [lat, lon] choisie sur la carte `key`, ou None"""
+
+    return (session_state.get(key) or {}).get('position')
+
+
+def carte_live(key, static, etat, session_state, height=800, reperes=None):
+    """ Affiche (ou met à jour) la carte `key`.
+        `session_state` garde ce qui a été envoyé au navigateur pour cette carte.
+        `reperes` : {'position': [lat, lon], 'proches': [identifiants]} ou None
+        Retourne les arguments envoyés (dict)"""
+
+    version = get_digest(static)
+    record = session_state.get(f'{key}.envoi')
+    # dernière demande d'envoi complet du navigateur (None : aucune, ou valeur oubliée hors de la page)
+    demande = (session_state.get(key) or {}).get('demande')
+
+    if record is None or record['version'] != version or demande != record['demande']:
+        # envoi complet : couche statique + état
+        seq = (record['seq'] + 1) if record else 1
+        args = {'version': version, 'static': static, 'seq': seq, 'base': None, 'etat': etat}
+        record = {'version': version, 'seq': seq, 'demande': demande, 'etat': etat, 'args': args}
+    elif etat != record['etat']:
+        seq = record['seq'] + 1
+        args = {'version': version, 'static': None, 'seq': seq, 'base': record['seq'],
+                'delta': get_delta(record['etat'], etat)}
+        record = dict(record, seq=seq, etat=etat, args=args)
+    else:
+        # rien de nouveau : mêmes arguments, ignorés par le navigateur
+        args = record['args']
+
+    session_state[f'{key}.envoi'] = record
+    args = dict(args, reperes=reperes)
+    _component(key=key, height=height, default=None, **args)
+    return args
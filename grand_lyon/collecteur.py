@@ -0,0 +1,167 @@
+""" Collecteur d'historique : relève les flux temps réel à intervalle fixe
+    et les ajoute au stockage partitionné par jour (data_grand_lyon/collecte/).
+
+    Lancement :   python -m grand_lyon.collecteur [--interval 60] [--flush 10]
+
+    - chaque relevé est encodé (grand_lyon.delta) : pour les Vélo'v, seules les
+      stations dont la disponibilité a changé sont gardées, avec un relevé complet
+      par heure ; pour les parcs relais, les lignes dont `last_update` a changé ;
+    - les lignes sont écrites par lots (toutes les `flush` relevés) par un thread
+      d'écriture ; si l'écriture prend du retard, les lots restent en attente dans
+      le collecteur (jusqu'à `max_pending` lignes, les plus anciennes sont ensuite
+      abandonnées) sans jamais bloquer les relevés ;
+    - chaque relevé complet alimente aussi les agrégats minute / heure / jour
+      (grand_lyon.rollups), enregistrés à chaque écriture ;
+    - au redémarrage, le dernier état connu de chaque station est relu dans le
+      stockage : rien n'est écrit en double."""
+
+import argparse
+import datetime as dt
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+
+import pandas as pd
+
+from grand_lyon import api, rollups, temps_reel
+from grand_lyon.delta import DeltaEncoder, LastUpdateFilter
+from grand_lyon.stockage import Store
+
+
+DATA_DIR = 'data_grand_lyon'
+COLLECTE_DIR = os.path.join(DATA_DIR, 'collecte')
+
+# flux relevés : nom -> (fonction de récupération, encodeur des relevés)
+FLUX = {'velov': (temps_reel.get_df_velov_tr, lambda: DeltaEncoder('number')),
+        'parcs_relais': (temps_reel.get_df_parcs_relais_tr, lambda: LastUpdateFilter('id'))}
+
+logger = logging.getLogger(__name__)
+
+
+class Collecteur:
+    """ Relevés périodiques de plusieurs flux vers un stockage en ajout seul"""
+
+    def __init__(self, flux=FLUX, root=COLLECTE_DIR, interval=60, flush_every=10,
+                 max_queue=4, max_pending=1_000_000, rollups_root=rollups.ROLLUPS_DIR):
+        self.flux = flux
+        self.stores = {name: Store(os.path.join(root, name)) for name in flux}
+        self.interval = interval
+        self.flush_every = flush_every
+        self.max_pending = max_pending
+        self.pending = {name: [] for name in flux}
+        self.encoders = {name: encoder() for name, (_, encoder) in flux.items()}
+        for name, encoder in self.encoders.items():
+            encoder.recover(self.stores[name])
+        self.rollups = {}
+        if rollups_root is not None:
+            self.rollups = {name: rollups.get_rollups(name, rollups_root) for name in flux if name in rollups.FLUX}
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stop_event = threading.Event()
+        self.stats = {'polls': 0, 'rows_in': 0, 'rows_kept': 0, 'rows_dropped': 0,
+                      'errors': 0, 'files': 0}
+        self.writer = threading.Thread(target=self.write_loop, name='collecteur_writer', daemon=True)
+
+    def poll(self):
+        """ Un relevé de chaque flux (en parallèle)"""
+
+        futures = {name: api.executor.submit(fetch) for name, (fetch, _) in self.flux.items()}
+        for name, future in futures.items():
+            try:
+                df = future.result()
+            except Exception:
+                self.stats['errors'] += 1
+                logger.exception("relevé %s impossible", name)
+                continue
+            if name in self.rollups:
+                # relevé inattendu (nettoyage ou agrégation impossible) : agrégats sautés, relevé gardé
+                try:
+                    clean = rollups.FLUX[name][0]
+                    self.rollups[name].add(clean(df.copy()))
+                except Exception:
+                    self.stats['errors'] += 1
+                    logger.exception("agrégats %s impossibles", name)
+            kept = self.encoders[name].encode(df)
+            self.stats['rows_in'] += len(df)
+            self.stats['rows_kept'] += len(kept)
+            if len(kept):
+                self.pending[name].append(kept)
+        self.stats['polls'] += 1
+
+    def flush(self, block=False):
+        """ Transmet les lots en attente au thread d'écriture.
+            File pleine : les lots restent en attente pour le prochain essai."""
+
+        for r in self.rollups.values():
+            r.save()
+        batch = {name: pd.concat(frames, ignore_index=True) for name, frames in self.pending.items() if frames}
+        if not batch:
+            return
+        try:
+            self.queue.put(batch, block=block)
+        except queue.Full:
+            # écriture en retard : on garde les lignes, dans la limite de max_pending
+            for name, df in batch.items():
+                if len(df) > self.max_pending:
+                    self.stats['rows_dropped'] += len(df) - self.max_pending
+                    df = df.iloc[-self.max_pending:]
+                self.pending[name] = [df]
+            logger.warning("écriture en retard, %d lignes en attente", sum(len(df) for df in batch.values()))
+            return
+        self.pending = {name: [] for name in self.flux}
+        logger.info("encodage : %s", {name: e.stats() for name, e in self.encoders.items()})
+
+    def write_loop(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            for name, df in batch.items():
+                try:
+                    self.stats['files'] += len(self.stores[name].append(df))
+                except Exception:
+                    self.stats['errors'] += 1
+                    logger.exception("écriture %s impossible", name)
+
+    def run(self):
+        """ Boucle de relevés à cadence fixe, jusqu'à stop()"""
+
+        self.writer.start()
+        start = time.monotonic()
+        tick = 0
+        while not self.stop_event.is_set():
+            self.poll()
+            if self.stats['polls'] % self.flush_every == 0:
+                self.flush()
+            # cadence fixe : les relevés en retard sont sautés, pas rattrapés
+            tick = max(tick + 1, int((time.monotonic() - start) / self.interval) + 1)
+            self.stop_event.wait(max(0, start + tick * self.interval - time.monotonic()))
+
+        self.flush(block=True)
+        self.queue.put(None)
+        self.writer.join()
+        logger.info("arrêt du collecteur : %s", self.stats)
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Collecte continue des flux temps réel du Grand Lyon")
+    parser.add_argument('--interval', type=float, default=60, help="secondes entre deux relevés")
+    parser.add_argument('--flush', type=int, default=10, help="nombre de relevés par écriture")
+    parser.add_argument('--root', default=COLLECTE_DIR, help="dossier du stockage")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    collecteur = Collecteur(root=args.root, interval=args.interval, flush_every=args.flush)
+    signal.signal(signal.SIGINT, collecteur.stop)
+    signal.signal(signal.SIGTERM, collecteur.stop)
+    logger.info("collecte démarrée le %s, toutes les %s s", dt.datetime.now().isoformat(timespec='seconds'), args.interval)
+    collecteur.run()
+
+
+if __name__ == '__main__':
+    main()
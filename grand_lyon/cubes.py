@@ -0,0 +1,98 @@
+""" Cubes pré-agrégés (jour de la semaine × heure × entité) des historiques.
+
+    Un cube garde la somme et le nombre de valeurs de taux_remplissage pour
+    chaque combinaison de clés : les moyennes restent exactes quel que soit le
+    regroupement demandé (par commune à partir des stations, par exemple), et de
+    nouvelles lignes brutes s'ajoutent sans recalculer tout l'historique.
+    Les graphiques découpent le cube au lieu de refaire un pivot sur les données brutes."""
+
+import os
+
+import pandas as pd
+
+from grand_lyon import historique
+
+
+DATA_DIR = 'data_grand_lyon'
+CUBE_PARCS = os.path.join(DATA_DIR, 'cube_parcs_relais.parquet')
+CUBE_VELOV = os.path.join(DATA_DIR, 'cube_velov.parquet')
+
+CLES_PARCS = ['jour', 'heure', 'nom']
+CLES_VELOV = ['jour', 'heure', 'commune', 'name']
+
+
+class Cube:
+    """ Sommes et effectifs d'une valeur, par combinaison de clés"""
+
+    def __init__(self, data, keys, value='taux_remplissage'):
+        self.data = data
+        self.keys = list(keys)
+        self.value = value
+
+    @classmethod
+    def build(cls, df, keys, value='taux_remplissage'):
+        """ Construit le cube à partir de lignes brutes"""
+
+        return cls(cls.aggregate(df, keys, value), keys, value)
+
+    @staticmethod
+    def aggregate(df, keys, value):
+        data = df.groupby(keys, observed=True)[value].agg(['sum', 'count'])
+        return data.reset_index()
+
+    def update(self, df):
+        """ Ajoute de nouvelles lignes brutes au cube"""
+
+        new = self.aggregate(df, self.keys, self.value)
+        data = pd.concat([self.data, new], ignore_index=True)
+        self.data = data.groupby(self.keys, observed=True, as_index=False)[['sum', 'count']].sum()
+        return self
+
+    def slice(self, by, **filters):
+        """ Moyenne de la valeur regroupée par les clés `by`, pour les lignes vérifiant `filters`
+            Retourne un DataFrame (clés de `by` + colonne de la valeur)"""
+
+        data = self.data
+        for key, value in filters.items():
+            data = data[data[key] == value]
+        data = data.groupby(by, observed=True)[['sum', 'count']].sum()
+        data[self.value] = data['sum'] / data['count']
+        return data[[self.value]].reset_index()
+
+    def entities(self, key):
+        """ Valeurs distinctes de la clé `key`, triées"""
+
+        return sorted(self.data[key].unique())
+
+    def to_parquet(self, path):
+        tmp = path + '.tmp'
+        self.data.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def read_parquet(cls, path, keys, value='taux_remplissage'):
+        return cls(pd.read_parquet(path), keys, value)
+
+
+def get_cube(path, source, load, keys):
+    """ Lit le cube enregistré, ou le reconstruit si l'historique source (Parquet) est plus récent"""
+
+    if not historique.is_stale(source, path):
+        return Cube.read_parquet(path, keys)
+    cube = Cube.build(load(keys + ['taux_remplissage']), keys)
+    cube.to_parquet(path)
+    return cube
+
+
+def get_cube_parcs_relais():
+    """ Cube (jour, heure, nom) du remplissage des parcs relais"""
+
+    source = historique.get_parcs_relais_parquet()
+    return get_cube(CUBE_PARCS, source, historique.load_parcs_relais, CLES_PARCS)
+
+
+def get_cube_velov():
+    """ Cube (jour, heure, commune, name) du remplissage des stations Vélo'v"""
+
+    source = historique.get_velov_parquet()
+    return get_cube(CUBE_VELOV, source, historique.load_velov, CLES_VELOV)
@@ -0,0 +1,147 @@
+""" Encodage des relevés successifs d'un flux : on ne garde que ce qui change.
+
+    DeltaEncoder (Vélo'v) compare chaque relevé au dernier état connu de chaque
+    station et ne garde que les stations dont `status` ou `available_*` ont
+    changé. Un relevé complet (keyframe) est écrit au premier relevé, toutes les
+    `keyframe_interval` et à chaque changement de jour : chaque partition
+    journalière du stockage se relit donc seule.
+
+    LastUpdateFilter (parcs relais) garde les lignes dont `last_update` a changé.
+
+    Les lignes gardées ont une colonne booléenne `keyframe`. Les partitions écrites
+    avant l'encodage (relevés complets, sans cette colonne) se relisent comme des
+    keyframes."""
+
+import pandas as pd
+
+
+CHAMPS_VELOV = ['status', 'available_bikes', 'available_bike_stands']
+
+
+class DeltaEncoder:
+    """ Relevés complets -> keyframes + lignes modifiées"""
+
+    def __init__(self, key='number', fields=CHAMPS_VELOV, keyframe_interval=pd.Timedelta(hours=1)):
+        self.key = key
+        self.fields = list(fields)
+        self.keyframe_interval = keyframe_interval
+        self.state = None
+        self.last_keyframe = None
+        self.rows_in = 0
+        self.rows_out = 0
+        self.keyframes = 0
+
+    def is_keyframe(self, ts):
+        if self.state is None or self.last_keyframe is None:
+            return True
+        return (ts - self.last_keyframe >= self.keyframe_interval
+                or ts.date() != self.last_keyframe.date())
+
+    def encode(self, snapshot):
+        """ Input = relevé complet (une ligne par station, colonne timestamp)
+            Retourne les lignes à stocker"""
+
+        snapshot = snapshot.drop_duplicates(subset=[self.key], keep='last')
+        ts = snapshot['timestamp'].max()
+        current = snapshot.set_index(self.key)[self.fields]
+        self.rows_in += len(snapshot)
+
+        if self.is_keyframe(ts):
+            rows = snapshot.assign(keyframe=True)
+            self.state = current
+            self.last_keyframe = ts
+            self.keyframes += 1
+        else:
+            previous = self.state.reindex(current.index)
+            changed = (current.ne(previous) & ~(current.isna() & previous.isna())).any(axis=1)
+            rows = snapshot[changed.to_numpy()].assign(keyframe=False)
+            self.state = pd.concat([self.state.drop(current.index, errors='ignore'), current])
+
+        self.rows_out += len(rows)
+        return rows
+
+    def recover(self, store):
+        """ Reprend l'état à partir du dernier jour stocké (redémarrage)"""
+
+        days = store.days()
+        if not days:
+            return
+        rows = store.read(start=days[-1], end=days[-1])
+        keyframes = get_keyframes(rows)
+        if rows.empty or not keyframes.any():
+            return
+        state = reconstruct(rows, rows['timestamp'].max(), self.key)
+        self.state = state.set_index(self.key)[self.fields]
+        self.last_keyframe = rows.loc[keyframes, 'timestamp'].max()
+
+    def compression_ratio(self):
+        """ Lignes reçues / lignes stockées"""
+
+        return self.rows_in / self.rows_out if self.rows_out else 0.0
+
+    def stats(self):
+        return {'rows_in': self.rows_in, 'rows_out': self.rows_out, 'keyframes': self.keyframes,
+                'compression_ratio': round(self.compression_ratio(), 2)}
+
+
+class LastUpdateFilter:
+    """ Ne garde que les lignes dont le last_update a changé"""
+
+    def __init__(self, key='id'):
+        self.key = key
+        self.state = pd.Series(dtype=object)
+        self.rows_in = 0
+        self.rows_out = 0
+
+    def encode(self, snapshot):
+        snapshot = snapshot.drop_duplicates(subset=[self.key], keep='last')
+        current = snapshot.set_index(self.key)['last_update']
+        changed = current.ne(self.state.reindex(current.index)).to_numpy()
+        self.state = pd.concat([self.state.drop(current.index, errors='ignore'), current])
+        rows = snapshot[changed].assign(keyframe=False)
+        self.rows_in += len(snapshot)
+        self.rows_out += len(rows)
+        return rows
+
+    def recover(self, store):
+        """ Dernier last_update connu par ligne, relu dans les deux derniers jours stockés"""
+
+        days = store.days()
+        if not days:
+            return
+        df = store.read(start=days[-2] if len(days) > 1 else days[-1], columns=['timestamp', self.key, 'last_update'])
+        df = df.sort_values('timestamp').drop_duplicates(subset=[self.key], keep='last')
+        self.state = df.set_index(self.key)['last_update']
+
+    def stats(self):
+        ratio = self.rows_in / self.rows_out if self.rows_out else 0.0
+        return {'rows_in': self.rows_in, 'rows_out': self.rows_out, 'compression_ratio': round(ratio, 2)}
+
+
+def get_keyframes(rows):
+    """ Masque des keyframes ; colonne absente ou vide (relevés complets écrits avant
+        l'encodage) : keyframe"""
+
+    if 'keyframe' not in rows:
+        return pd.Series(True, index=rows.index)
+    return rows['keyframe'].fillna(True).astype(bool)
+
+
+def reconstruct(rows, at, key='number'):
+    """ Input = lignes encodées (au moins depuis la keyframe précédant `at`)
+        Retourne l'état de chaque station à l'instant `at` (DataFrame)"""
+
+    rows = rows[rows['timestamp'] <= at]
+    keyframes = rows.loc[get_keyframes(rows), 'timestamp']
+    if keyframes.empty:
+        return rows.iloc[0:0]
+    rows = rows[rows['timestamp'] >= keyframes.max()]
+    rows = rows.sort_values('timestamp', kind='stable').drop_duplicates(subset=[key], keep='last')
+    return rows.reset_index(drop=True)
+
+
+def state_at(store, at, key='number'):
+    """ État de chaque station à l'instant `at`, relu dans la seule partition du jour de `at`"""
+
+    day = pd.Timestamp(at).strftime('%Y-%m-%d')
+    return reconstruct(store.read(start=day, end=day), at, key)
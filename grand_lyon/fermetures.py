@@ -0,0 +1,63 @@
+""" Règles de fermeture des parcs relais.
+
+    Quand un parc est fermé, son taux de remplissage est ramené à 0. Chaque règle
+    est un tuple (parcs, jours, heure maximale, aucune place disponible) où None
+    signifie « pas de condition » ; une ligne est fermée dès qu'une règle
+    s'applique. Les jours de fermeture de chaque parc sont lus dans le texte
+    `horaires` fourni par l'API (« ... - Fermé les dimanches et jours fériés »)."""
+
+import re
+
+import pandas as pd
+
+
+JOURS = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
+
+# (parcs, jours, heure maximale, aucune place disponible)
+REGLES_FERMETURE = [(None, None, 5, True)]      # la nuit, 0 place disponible : parc fermé
+
+_re_ferme = re.compile(r'Fermé les ([^-]*)', re.IGNORECASE)
+_re_jour = re.compile(r'(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche)', re.IGNORECASE)
+
+
+def parse_jours_fermeture(horaires):
+    """ 'Ouvert ... - Fermé les samedis, dimanches et jours fériés' -> ['Samedi', 'Dimanche']"""
+
+    if not isinstance(horaires, str):
+        return []
+    match = _re_ferme.search(horaires)
+    if not match:
+        return []
+    return [jour.capitalize() for jour in _re_jour.findall(match.group(1))]
+
+
+def regles_horaires(nom, horaires):
+    """ Input = Series des noms de parcs et de leurs horaires
+        Retourne une règle de fermeture par parc fermé certains jours"""
+
+    horaires_parcs = pd.DataFrame({'nom': nom, 'horaires': horaires}).drop_duplicates()
+    regles = []
+    for parc, texte in zip(horaires_parcs['nom'], horaires_parcs['horaires']):
+        jours = parse_jours_fermeture(texte)
+        if jours:
+            regles.append(([parc], jours, None, False))
+    return regles
+
+
+def get_masque_fermeture(df, regles):
+    """ Input = DataFrame avec les colonnes nom, jour, heure, nb_tot_place_dispo
+        Retourne la Series booléenne des lignes où le parc est fermé"""
+
+    ferme = pd.Series(False, index=df.index)
+    for parcs, jours, heure_max, places_nulles in regles:
+        masque = pd.Series(True, index=df.index)
+        if parcs is not None:
+            masque &= df['nom'].isin(parcs)
+        if jours is not None:
+            masque &= df['jour'].isin(jours)
+        if heure_max is not None:
+            masque &= df['heure'] <= heure_max
+        if places_nulles:
+            masque &= df['nb_tot_place_dispo'] == 0
+        ferme |= masque
+    return ferme
@@ -0,0 +1,120 @@
+""" Lecture en flux des grandes réponses JSON des API du Grand Lyon.
+
+    Les réponses ws/rdata ({"values": [...]}) et WFS ({"features": [...]})
+    couvrent tout le réseau, alors que le dashboard n'en garde qu'une petite
+    partie (les tramways parmi tous les passages, quelques propriétés des
+    tracés de bus). Les enregistrements du tableau sont décodés un par un, au
+    fil des morceaux reçus, filtrés et réduits aux champs utiles dès leur
+    lecture : ni le texte complet de la réponse ni les enregistrements écartés
+    ne sont gardés en mémoire."""
+
+import codecs
+import json
+import re
+
+
+# début du tableau des enregistrements : "values": [
+_DEBUT = '"{}"\\s*:\\s*\\['
+_BLANCS = re.compile(r'[\s,]*')
+# enregistrement sans objet imbriqué (cas des flux ws/rdata), découpé sans être décodé
+_PLAT = re.compile(r'\{[^{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^{}"]*)*\}')
+
+_decoder = json.JSONDecoder()
+
+
+def iter_records(chunks, cle='values', filtre=None, membres=None):
+    """ Enregistrements du tableau `cle` d'un document JSON reçu par morceaux (bytes ou str)
+        filtre(texte) -> bool : pré-filtre sur le texte brut d'un enregistrement sans objet
+        imbriqué, appliqué avant son décodage (les autres enregistrements sont tous décodés)
+        membres : dict complété, à la fin du tableau, par les autres membres du document
+        (numberMatched, numberReturned des réponses WFS...)
+        Retourne un itérateur de dict"""
+
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    debut = re.compile(_DEBUT.format(re.escape(cle)))
+    # texte du document avant le tableau (gardé seulement si `membres` est demandé)
+    avant = []
+    buffer = ''
+    pos = None
+    fini = False
+    # texte non lu nécessaire avant de retenter le décodage d'un enregistrement incomplet
+    besoin = 0
+    chunks = iter(chunks)
+
+    while True:
+        if pos is None:
+            m = debut.search(buffer)
+            if m is not None:
+                avant.append(buffer[:m.start()])
+                pos = m.end()
+        else:
+            pos = _BLANCS.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                if membres is not None:
+                    apres = [buffer[pos + 1:]] + [utf8.decode(c) if isinstance(c, bytes) else c for c in chunks]
+                    document = json.loads(''.join(avant) + f'"{cle}": []' + ''.join(apres) + utf8.decode(b'', final=True))
+                    del document[cle]
+                    membres.update(document)
+                return
+            if pos < len(buffer):
+                plat = _PLAT.match(buffer, pos)
+                if plat is not None:
+                    pos = plat.end()
+                    if filtre is None or filtre(plat.group()):
+                        yield json.loads(plat.group())
+                    continue
+                try:
+                    record, fin = _decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # enregistrement incomplet : nouvel essai quand le texte disponible a doublé
+                    if fini:
+                        raise
+                    besoin = 2 * (len(buffer) - pos)
+                else:
+                    pos = fin
+                    yield record
+                    continue
+
+        if fini:
+            if pos is None:
+                raise ValueError(f"tableau '{cle}' absent de la réponse")
+            raise ValueError("réponse JSON tronquée")
+        # le texte déjà lu est oublié
+        if pos is None and membres is not None:
+            avant.append(buffer[:max(len(buffer) - len(cle) - 8, 0)])
+        parts = [buffer[pos:] if pos is not None else buffer[max(len(buffer) - len(cle) - 8, 0):]]
+        taille = len(parts[0])
+        while not fini and (taille < besoin or len(parts) == 1):
+            chunk = next(chunks, None)
+            if chunk is None:
+                fini = True
+                chunk = b''
+            parts.append(utf8.decode(chunk, final=fini) if isinstance(chunk, bytes) else chunk)
+            taille += len(parts[-1])
+        buffer = ''.join(parts)
+        pos = 0 if pos is not None else None
+        besoin = 0
+
+
+def get_colonnes(records, champs, garder=None):
+    """ Colonnes `champs` des enregistrements retenus par garder(record)
+        Retourne {champ: liste de valeurs} (None si le champ manque)"""
+
+    colonnes = {champ: [] for champ in champs}
+    listes = list(colonnes.items())
+    for record in records:
+        if garder is not None and not garder(record):
+            continue
+        for champ, valeurs in listes:
+            valeurs.append(record.get(champ))
+    return colonnes
+
+
+def project_features(features, proprietes):
+    """ Features GeoJSON réduites aux `proprietes` (et à leur géométrie)
+        Retourne un itérateur de dict"""
+
+    for feature in features:
+        props = feature.get('properties') or {}
+        yield {'type': feature.get('type', 'Feature'), 'geometry': feature.get('geometry'),
+               'properties': {p: props[p] for p in proprietes if p in props}}
@@ -0,0 +1,174 @@
+""" Préparation des tracés pour l'affichage : quantification, fusion des tronçons
+    communs, simplification et encodage compact (TopoJSON).
+
+    1. les coordonnées sont ramenées sur une grille dont le pas est une fraction
+       de pixel au niveau de zoom de référence de la couche (ZOOM_COUCHES) ;
+    2. les tronçons empruntés par plusieurs lignes (rues communes à plusieurs bus,
+       aller et retour superposés) ne sont gardés qu'une fois : le réseau est
+       découpé en arcs entre deux carrefours (points de degré différent de 2) ;
+    3. chaque arc est simplifié (Douglas-Peucker) avec la même tolérance ; les
+       extrémités des arcs ne bougent pas, les lignes restent donc raccordées ;
+    4. les arcs sont encodés en TopoJSON : entiers, en différences successives.
+
+    Le résultat (un topology par couche) est lu dans le navigateur par
+    topojson-client (folium.TopoJson)."""
+
+import math
+
+import numpy as np
+
+
+# latitude de référence (Lyon) pour convertir les degrés de longitude en mètres
+LAT_REF = 45.75
+# fraction de pixel tolérée par la quantification et par la simplification
+PIXEL_TOLERANCE = 0.5
+# niveau de zoom de référence de chaque couche de la carte des tracés
+ZOOM_COUCHES = {'Bus': 14, 'Tramway': 16, 'Métro': 16, 'Funiculaire': 16}
+
+
+def get_tolerance(zoom, pixels=PIXEL_TOLERANCE, lat=LAT_REF):
+    """ Tolérance (degrés de latitude) au niveau de zoom `zoom` : `pixels` pixels à l'écran"""
+
+    metres_par_pixel = 156543.03392 * math.cos(math.radians(lat)) / 2 ** zoom
+    return pixels * metres_par_pixel / 111_320
+
+
+def get_lines(geometry):
+    """ Listes de coordonnées [lon, lat] d'une géométrie LineString ou MultiLineString"""
+
+    if geometry is None:
+        return []
+    if geometry['type'] == 'LineString':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiLineString':
+        return list(geometry['coordinates'])
+    return []
+
+
+def quantize(coords, quantum):
+    """ Coordonnées -> tuples d'entiers sur la grille, sans points consécutifs identiques"""
+
+    points = np.rint(np.asarray(coords, dtype='float64')[:, :2] / quantum).astype('int64')
+    if len(points) > 1:
+        points = points[np.r_[True, (np.diff(points, axis=0) != 0).any(axis=1)]]
+    return [tuple(p) for p in points.tolist()]
+
+
+def get_arcs(lines):
+    """ Input = lignes quantifiées (listes de points)
+        Découpe le réseau en arcs entre carrefours : chaque tronçon n'apparaît qu'une fois
+        Retourne la liste des arcs (listes de points)"""
+
+    voisins = {}
+    for line in lines:
+        for a, b in zip(line[:-1], line[1:]):
+            voisins.setdefault(a, set()).add(b)
+            voisins.setdefault(b, set()).add(a)
+
+    vus = set()
+    arcs = []
+
+    def parcours(depart, suivant):
+        arc = [depart, suivant]
+        vus.add(frozenset((depart, suivant)))
+        while len(voisins[arc[-1]]) == 2 and arc[-1] != depart:
+            nxt = next((n for n in voisins[arc[-1]] if frozenset((arc[-1], n)) not in vus), None)
+            if nxt is None:
+                break
+            vus.add(frozenset((arc[-1], nxt)))
+            arc.append(nxt)
+        return arc
+
+    # arcs partant des carrefours et extrémités
+    for point, adjacents in voisins.items():
+        if len(adjacents) != 2:
+            for n in adjacents:
+                if frozenset((point, n)) not in vus:
+                    arcs.append(parcours(point, n))
+    # boucles sans carrefour
+    for point, adjacents in voisins.items():
+        for n in adjacents:
+            if frozenset((point, n)) not in vus:
+                arcs.append(parcours(point, n))
+    return arcs
+
+
+def simplify(points, tolerance, ratio_x=math.cos(math.radians(LAT_REF))):
+    """ Douglas-Peucker sur un arc de points entiers, `tolerance` en unités de la grille
+        (abscisses multipliées par `ratio_x` : longitude corrigée par cos(LAT_REF) par défaut,
+        1 pour des coordonnées déjà projetées)
+        Retourne les points gardés, extrémités comprises"""
+
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    xy = np.asarray(points, dtype='float64')
+    xy[:, 0] *= ratio_x
+    garder = np.zeros(len(points), dtype=bool)
+    garder[[0, -1]] = True
+    pile = [(0, len(points) - 1)]
+    while pile:
+        debut, fin = pile.pop()
+        if fin - debut < 2:
+            continue
+        a, b = xy[debut], xy[fin]
+        seg = b - a
+        p = xy[debut + 1:fin] - a
+        norme = math.hypot(seg[0], seg[1])
+        if norme == 0:
+            distances = np.hypot(p[:, 0], p[:, 1])
+        else:
+            distances = np.abs(seg[0] * p[:, 1] - seg[1] * p[:, 0]) / norme
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            milieu = debut + 1 + i
+            garder[milieu] = True
+            pile.append((debut, milieu))
+            pile.append((milieu, fin))
+    return [pt for pt, g in zip(points, garder) if g]
+
+
+def encode_arc(points):
+    """ Arc en différences successives (premier point absolu)"""
+
+    pts = np.asarray(points, dtype='int64')
+    return np.vstack([pts[:1], np.diff(pts, axis=0)]).tolist()
+
+
+def get_topology(geometries, zoom, name='traces'):
+    """ Input = géométries GeoJSON d'une couche, niveau de zoom de référence
+        Retourne un topology TopoJSON avec un seul objet `name` (MultiLineString de tous les arcs)"""
+
+    quantum = get_tolerance(zoom)
+    lines = [quantize(coords, quantum) for g in geometries for coords in get_lines(g) if len(coords) > 1]
+    lines = [line for line in lines if len(line) > 1]
+    arcs = [simplify(arc, 1) for arc in get_arcs(lines)]
+
+    if arcs:
+        origine = np.min([np.min(arc, axis=0) for arc in arcs], axis=0)
+    else:
+        origine = np.zeros(2, dtype='int64')
+    arcs = [encode_arc(np.asarray(arc) - origine) for arc in arcs]
+
+    return {'type': 'Topology',
+            'transform': {'scale': [quantum, quantum],
+                          'translate': [float(origine[0]) * quantum, float(origine[1]) * quantum]},
+            'objects': {name: {'type': 'GeometryCollection',
+                               'geometries': [{'type': 'MultiLineString',
+                                               'arcs': [[i] for i in range(len(arcs))]}] if arcs else []}},
+            'arcs': arcs}
+
+
+def decode(topology):
+    """ Topology -> liste de lignes [[lon, lat], ...] (vérifications, mesures)"""
+
+    sx, sy = topology['transform']['scale']
+    tx, ty = topology['transform']['translate']
+    lines = []
+    for arc in topology['arcs']:
+        pts = np.cumsum(np.asarray(arc, dtype='int64'), axis=0)
+        lines.append([[x * sx + tx, y * sy + ty] for x, y in pts.tolist()])
+    return lines
+
+
+def count_points(topology):
+    return sum(len(arc) for arc in topology['arcs'])
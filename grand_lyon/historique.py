@@ -0,0 +1,144 @@
+""" Historiques des parcs relais et des Vélo'v (collecte de janvier 2022).
+
+    Les CSV bruts sont nettoyés une seule fois et convertis en Parquet typé :
+    noms de stations, de parcs et de communes en catégories, heure et jour de la
+    semaine en petits entiers, taux de remplissage précalculé. Les chargeurs ne
+    lisent ensuite que les colonnes demandées.
+
+    Conversion manuelle :   python -m grand_lyon.historique"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from grand_lyon import fermetures
+
+
+DATA_DIR = 'data_grand_lyon'
+PARCS_CSV = os.path.join(DATA_DIR, 'parcs_relais.csv')
+PARCS_PARQUET = os.path.join(DATA_DIR, 'parcs_relais.parquet')
+VELOV_CSV = os.path.join(DATA_DIR, 'velov_concat.csv')
+VELOV_PARQUET = os.path.join(DATA_DIR, 'velov_concat.parquet')
+
+JOURS = fermetures.JOURS
+
+# colonnes utilisées par les graphiques
+COLONNES_PARCS = ['nom', 'jour', 'heure', 'taux_remplissage']
+COLONNES_VELOV = ['commune', 'name', 'jour', 'heure', 'taux_remplissage']
+
+
+def get_date_columns(df):
+    """ Ajoute dateTime (heure locale de Lyon), weekday (0 = lundi), jour et heure"""
+
+    df['dateTime'] = pd.to_datetime(df['timestamp'], utc=True).dt.tz_convert('Europe/Paris').dt.tz_localize(None)
+    df['weekday'] = df['dateTime'].dt.weekday.astype('int8')
+    df['jour'] = pd.Categorical.from_codes(df['weekday'], categories=JOURS, ordered=True)
+    df['heure'] = df['dateTime'].dt.hour.astype('int8')
+    return df
+
+
+def clean_parcs_relais(df_parc):
+    """ Input = DataFrame brut du csv parcs relais
+        Retourne un DataFrame nettoyé et typé"""
+
+    # filtrage & reformatage (sur les noms distincts, pas ligne par ligne)
+    df_parc['nom'] = df_parc['nom'].astype('category')
+    df_parc['nom'] = df_parc['nom'].cat.rename_categories(
+        lambda x : x.replace('Parc Relais TCL ', '').replace('Hopital', 'Hôp.'))
+    parcs_nan = ['Feyssine', 'Gare de Vénissieux', 'Grézieu la Varenne', 'Porte des Alpes',
+                'Irigny-Yvours', 'Oullins La Saulaie Nord', 'Porte de Lyon']
+    df_parc = df_parc[~df_parc['nom'].isin(parcs_nan)]
+    # relevés temps réel : capacité parfois absente (parc fermé, capteur en panne)
+    df_parc = df_parc.assign(capacite=pd.to_numeric(df_parc['capacite'], errors='coerce'))
+    df_parc = df_parc[df_parc['capacite'] > 0]
+    df_parc = df_parc.reset_index(drop=True)
+    df_parc['nom'] = df_parc['nom'].cat.remove_unused_categories()
+
+    df_parc = get_date_columns(df_parc)
+    df_parc['periode'] = pd.Categorical(np.where(df_parc['heure'] < 12, 'Matin', 'Apres_midi'))
+    df_parc['taux_remplissage'] = (df_parc['capacite'] - df_parc['nb_tot_place_dispo'])/df_parc['capacite'] * 100
+
+    # fermetures : règles fixes + jours de fermeture lus dans les horaires
+    regles = fermetures.REGLES_FERMETURE + fermetures.regles_horaires(df_parc['nom'], df_parc['horaires'])
+    ferme = fermetures.get_masque_fermeture(df_parc, regles)
+    df_parc['taux_remplissage'] = df_parc['taux_remplissage'].mask(ferme, 0)
+
+    return pd.DataFrame({'dateTime': df_parc['dateTime'],
+                         'nom': df_parc['nom'],
+                         'capacite': df_parc['capacite'].astype('int16'),
+                         'nb_tot_place_dispo': df_parc['nb_tot_place_dispo'].astype('float32'),
+                         'weekday': df_parc['weekday'],
+                         'jour': df_parc['jour'],
+                         'heure': df_parc['heure'],
+                         'periode': df_parc['periode'],
+                         'taux_remplissage': df_parc['taux_remplissage'].astype('float32')})
+
+
+def clean_velov(df_velov):
+    """ Input = DataFrame brut du csv velov
+        Retourne un DataFrame nettoyé et typé"""
+
+    df_velov = get_date_columns(df_velov)
+    taux_remplissage = (df_velov['available_bike_stands']/df_velov['bike_stands'])*100
+
+    return pd.DataFrame({'dateTime': df_velov['dateTime'],
+                         'number': df_velov['number'].astype('int32'),
+                         'name': df_velov['name'].astype('category'),
+                         'commune': df_velov['commune'].astype('category'),
+                         'weekday': df_velov['weekday'],
+                         'jour': df_velov['jour'],
+                         'heure': df_velov['heure'],
+                         'taux_remplissage': taux_remplissage.astype('float32')})
+
+
+def ingest(csv, parquet, clean, **read_csv_kwargs):
+    """ Convertit un csv brut en Parquet nettoyé"""
+
+    df = clean(pd.read_csv(csv, **read_csv_kwargs))
+    tmp = parquet + '.tmp'
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, parquet)
+    return parquet
+
+
+def is_stale(source, target):
+    """ Vrai si le fichier dérivé `target` est absent ou plus ancien que `source`"""
+
+    if not os.path.exists(target):
+        return True
+    return os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(target)
+
+
+def get_parcs_relais_parquet():
+    """ Retourne le chemin du Parquet parcs relais, après conversion du csv si nécessaire"""
+
+    if is_stale(PARCS_CSV, PARCS_PARQUET):
+        ingest(PARCS_CSV, PARCS_PARQUET, clean_parcs_relais, index_col=[0])
+    return PARCS_PARQUET
+
+
+def get_velov_parquet():
+    """ Retourne le chemin du Parquet velov, après conversion du csv si nécessaire"""
+
+    if is_stale(VELOV_CSV, VELOV_PARQUET):
+        ingest(VELOV_CSV, VELOV_PARQUET, clean_velov)
+    return VELOV_PARQUET
+
+
+def load_parcs_relais(columns=COLONNES_PARCS):
+    """ Retourne l'historique des parcs relais (colonnes `columns`)"""
+
+    return pd.read_parquet(get_parcs_relais_parquet(), columns=columns)
+
+
+def load_velov(columns=COLONNES_VELOV):
+    """ Retourne l'historique des Vélo'v (colonnes `columns`)"""
+
+    return pd.read_parquet(get_velov_parquet(), columns=columns)
+
+
+if __name__ == '__main__':
+    print(ingest(PARCS_CSV, PARCS_PARQUET, clean_parcs_relais, index_col=[0]))
+    if os.path.exists(VELOV_CSV):
+        print(ingest(VELOV_CSV, VELOV_PARQUET, clean_velov))
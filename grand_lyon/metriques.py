@@ -0,0 +1,270 @@
+""" Mesure des fonctions de données et de rendu en production : durée, octets
+    téléchargés, lignes en entrée et en sortie, pic de mémoire, par fonction et par étape.
+
+    - @instrumente mesure un appel complet (étape 'total') : lignes du premier
+      DataFrame en argument, lignes du résultat ;
+    - `with etape('json_normalize') as e:` mesure une étape interne, rattachée à la
+      fonction instrumentée en cours dans le thread (ou à `fonction`) ;
+      e.lignes(entree, sortie) et e.octets complètent la mesure ;
+    - le pic de mémoire (tracemalloc) n'est mesuré que si le suivi est activé
+      (tracer_memoire(True), ou GRAND_LYON_TRACEMALLOC=1) : il ralentit les
+      allocations. tracemalloc est global au processus : le pic d'une étape
+      inclut les allocations des autres threads pendant l'étape.
+
+    Les dernières RESERVOIR durées de chaque étape sont gardées pour les
+    quantiles (p50, p95). export() les présente au format texte Prometheus,
+    écrit par write_export() dans data_grand_lyon/metriques.txt, hors du dossier
+    servi publiquement. Avec GRAND_LYON_METRIQUES_PUBLIQUES=1, il est écrit dans
+    static/metriques.txt et servi par Streamlit sous /app/static/metriques.txt."""
+
+from collections import deque
+import contextlib
+import functools
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+
+RESERVOIR = 512
+QUANTILES = [0.5, 0.95]
+# static/ est servi à tous les visiteurs : l'export n'y est écrit que sur demande
+PUBLIQUE = os.environ.get('GRAND_LYON_METRIQUES_PUBLIQUES') == '1'
+EXPORT_FILE = os.path.join('static' if PUBLIQUE else 'data_grand_lyon', 'metriques.txt')
+EXPORT_URL = '/app/static/metriques.txt'
+# secondes entre deux écritures de l'export
+EXPORT_INTERVAL = 15
+PREFIXE = 'grand_lyon'
+
+_local = threading.local()
+
+
+class Mesure:
+    """ Étape en cours : compléter avec lignes(entree, sortie) et octets"""
+
+    def __init__(self, fonction, nom):
+        self.fonction = fonction
+        self.nom = nom
+        self.octets = 0
+        self.entree = None
+        self.sortie = None
+        self.memoire = None
+        self.pic = None
+
+    def lignes(self, entree=None, sortie=None):
+        if entree is not None:
+            self.entree = entree
+        if sortie is not None:
+            self.sortie = sortie
+
+
+class _Serie:
+    """ Mesures cumulées d'une étape"""
+
+    def __init__(self):
+        self.appels = 0
+        self.erreurs = 0
+        self.total = 0.0
+        self.durees = deque(maxlen=RESERVOIR)
+        self.octets = 0
+        self.entree = 0
+        self.sortie = 0
+        self.derniere_entree = None
+        self.derniere_sortie = None
+        self.pic = None
+
+
+class Metriques:
+    """ Mesures par (fonction, étape), partagées par toutes les sessions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._written_at = 0
+
+    def add(self, fonction, nom, duree, octets=0, entree=None, sortie=None, pic=None, erreur=False):
+        with self._lock:
+            serie = self._series.get((fonction, nom))
+            if serie is None:
+                serie = self._series[(fonction, nom)] = _Serie()
+            serie.appels += 1
+            serie.erreurs += bool(erreur)
+            serie.total += duree
+            serie.durees.append(duree)
+            serie.octets += octets
+            if entree is not None:
+                serie.entree += entree
+                serie.derniere_entree = entree
+            if sortie is not None:
+                serie.sortie += sortie
+                serie.derniere_sortie = sortie
+            if pic is not None:
+                serie.pic = max(serie.pic or 0, pic)
+
+    @contextlib.contextmanager
+    def etape(self, nom, fonction=None):
+        """ Mesure le bloc comme étape `nom` de `fonction` (par défaut : la fonction
+            instrumentée en cours dans ce thread)"""
+
+        pile = _get_pile()
+        if fonction is None:
+            fonction = pile[-1].fonction if pile else 'autre'
+        mesure = Mesure(fonction, nom)
+        if tracemalloc.is_tracing():
+            courant, pic = tracemalloc.get_traced_memory()
+            # le pic est remis à zéro pour cette étape : celui des étapes englobantes est gardé
+            for parent in pile:
+                parent.pic = max(parent.pic or 0, pic)
+            tracemalloc.reset_peak()
+            mesure.memoire, mesure.pic = courant, courant
+        pile.append(mesure)
+        erreur = False
+        debut = time.perf_counter()
+        try:
+            yield mesure
+        except BaseException:
+            erreur = True
+            raise
+        finally:
+            duree = time.perf_counter() - debut
+            pile.pop()
+            pic = None
+            if mesure.memoire is not None and tracemalloc.is_tracing():
+                pic_courant = tracemalloc.get_traced_memory()[1]
+                for parent in pile:
+                    parent.pic = max(parent.pic or 0, pic_courant)
+                pic = max(mesure.pic, pic_courant) - mesure.memoire
+            self.add(fonction, nom, duree, mesure.octets, mesure.entree, mesure.sortie, pic, erreur)
+
+    def instrumente(self, f):
+        """ Décorateur : mesure chaque appel de `f` (étape 'total')"""
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with self.etape('total', f.__name__) as mesure:
+                entree = next((a for a in args if isinstance(a, pd.DataFrame)), None)
+                if entree is not None:
+                    mesure.lignes(entree=len(entree))
+                resultat = f(*args, **kwargs)
+                if isinstance(resultat, (pd.DataFrame, pd.Series, list)):
+                    mesure.lignes(sortie=len(resultat))
+                return resultat
+
+        return wrapper
+
+    def table(self):
+        """ Une ligne par (fonction, étape) : appels, p50 / p95 / max (ms), octets, lignes, pic (Mo)
+            Retourne un DataFrame"""
+
+        with self._lock:
+            series = {cle: (serie, np.array(serie.durees) * 1e3) for cle, serie in self._series.items()}
+        lignes = [{'fonction': fonction, 'étape': nom, 'appels': serie.appels, 'erreurs': serie.erreurs,
+                   'p50 (ms)': np.percentile(durees, 50), 'p95 (ms)': np.percentile(durees, 95),
+                   'max (ms)': durees.max(), 'total (s)': serie.total, 'octets (ko)': serie.octets / 1e3,
+                   'lignes entrée': serie.derniere_entree, 'lignes sortie': serie.derniere_sortie,
+                   'pic (Mo)': None if serie.pic is None else serie.pic / 1e6}
+                  for (fonction, nom), (serie, durees) in series.items()]
+        colonnes = ['fonction', 'étape', 'appels', 'erreurs', 'p50 (ms)', 'p95 (ms)', 'max (ms)', 'total (s)',
+                    'octets (ko)', 'lignes entrée', 'lignes sortie', 'pic (Mo)']
+        return pd.DataFrame(lignes, columns=colonnes).sort_values(['fonction', 'étape'], ignore_index=True)
+
+    def export(self, fetch_stats=None, render_stats=None, http_stats=None):
+        """ Mesures au format texte Prometheus, avec les compteurs des caches
+            (fetch_cache.stats(), render_cache.stats(), cache_http.stats()) s'ils sont donnés"""
+
+        with self._lock:
+            series = {cle: (serie, np.array(serie.durees)) for cle, serie in self._series.items()}
+        sortie = []
+
+        def metrique(nom, type, aide, valeurs):
+            sortie.append(f'# HELP {PREFIXE}_{nom} {aide}')
+            sortie.append(f'# TYPE {PREFIXE}_{nom} {type}')
+            for suffixe, labels, valeur in valeurs:
+                labels = f'{{{get_labels(labels)}}}' if labels else ''
+                sortie.append(f'{PREFIXE}_{nom}{suffixe}{labels} {valeur:.9g}')
+
+        metrique('etape_duree_secondes', 'summary', "Durée des étapes (quantiles sur les derniers appels)",
+                 [v for (fonction, nom), (serie, durees) in series.items()
+                  for v in [('', {'fonction': fonction, 'etape': nom, 'quantile': q}, np.quantile(durees, q))
+                            for q in QUANTILES]
+                  + [('_sum', {'fonction': fonction, 'etape': nom}, serie.total),
+                     ('_count', {'fonction': fonction, 'etape': nom}, serie.appels)]])
+        for nom, attribut, aide in [('etape_erreurs_total', 'erreurs', "Appels terminés par une exception"),
+                                    ('etape_octets_total', 'octets', "Octets téléchargés (ou html produit)"),
+                                    ('etape_lignes_entree_total', 'entree', "Lignes en entrée"),
+                                    ('etape_lignes_sortie_total', 'sortie', "Lignes en sortie")]:
+            metrique(nom, 'counter', aide, [('', {'fonction': fonction, 'etape': etape}, getattr(serie, attribut))
+                                            for (fonction, etape), (serie, _) in series.items()])
+        metrique('etape_pic_memoire_octets', 'gauge', "Pic d'allocation le plus haut (si tracemalloc est actif)",
+                 [('', {'fonction': fonction, 'etape': etape}, serie.pic)
+                  for (fonction, etape), (serie, _) in series.items() if serie.pic is not None])
+        if fetch_stats is not None:
+            metrique('fetch_cache_total', 'counter', "Accès au cache des API par jeu de données",
+                     [('', {'cle': cle, 'evenement': evenement}, valeur) for cle, compteurs in fetch_stats.items()
+                      for evenement, valeur in compteurs.items() if evenement != 'ttl'])
+        if render_stats is not None:
+            metrique('render_cache_total', 'counter', "Accès au cache des cartes",
+                     [('', {'evenement': evenement}, valeur) for evenement, valeur in render_stats.items()
+                      if evenement not in ('entries', 'bytes')])
+            metrique('render_cache_octets', 'gauge', "Html des cartes en mémoire",
+                     [('', {}, render_stats.get('bytes', 0))])
+        if http_stats is not None:
+            metrique('cache_http_total', 'counter', "Réponses du cache HTTP sur disque et revalidations",
+                     [('', {'cle': cle, 'evenement': evenement}, valeur) for cle, compteurs in http_stats.items()
+                      for evenement, valeur in compteurs.items()])
+        return '\n'.join(sortie) + '\n'
+
+    def write_export(self, filename=EXPORT_FILE, fetch_stats=None, render_stats=None, http_stats=None,
+                     interval=EXPORT_INTERVAL):
+        """ Écrit export() dans `filename` (au plus une fois toutes les `interval` secondes)
+            Retourne True si le fichier a été écrit"""
+
+        now = time.monotonic()
+        with self._lock:
+            if now - self._written_at < interval:
+                return False
+            self._written_at = now
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        tmp = f'{filename}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.export(fetch_stats, render_stats, http_stats))
+        os.replace(tmp, filename)
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _get_pile():
+    """ Étapes ouvertes dans ce thread"""
+
+    if not hasattr(_local, 'pile'):
+        _local.pile = []
+    return _local.pile
+
+
+def get_labels(labels):
+    echappe = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in labels.items()}
+    return ','.join(f'{k}="{v}"' for k, v in echappe.items())
+
+
+def tracer_memoire(actif):
+    """ Active ou arrête la mesure des pics de mémoire"""
+
+    if actif and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not actif and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+# instance unique du processus
+metriques = Metriques()
+etape = metriques.etape
+instrumente = metriques.instrumente
+
+if os.environ.get('GRAND_LYON_TRACEMALLOC') == '1':
+    tracer_memoire(True)
@@ -0,0 +1,102 @@
+""" Normalisation et rapprochement des noms d'arrêts, de terminus et de directions.
+
+    Chaque nom brut est d'abord développé (abréviations), puis replié (accents,
+    casse, ponctuation). Un nom déjà rencontré est résolu par simple recherche
+    dans un dictionnaire ; le score flou (fuzz.partial_ratio) n'est calculé
+    qu'une fois par nom inconnu, contre l'ensemble des noms canoniques."""
+
+from functools import lru_cache
+import re
+import threading
+import unicodedata
+
+from fuzzywuzzy import fuzz
+
+
+# harmonisation orthographe
+ABREVIATIONS = {'H.' : 'Hôtel',
+                'Hôp.' : 'Hôpital',
+                'G.Berger' : 'Gaston Berger',
+                'St' : 'Saint',
+                'Vaulx' : 'Vaulx-en-Velin'}
+
+TRAM_TERMINUS = ['Debourg', 'Hôtel de Région Montrochet', 'IUT Feyssine', 'Saint-Priest Bel Air',
+                 'La Doua-Gaston Berger', 'Hôpital Feyzin Vénissieux', 'Eurexpo', 'Grange Blanche',
+                 'Meyzieu les Panettes', 'Gare Part-Dieu', 'Décines-O.L.Vallée',
+                 'Vaulx-en-Velin La Soie', 'Hôpitaux Est-Pinel']
+
+
+def expand(nom):
+    """ Remplace les abréviations connues, mot par mot"""
+
+    return ' '.join(ABREVIATIONS.get(word, word) for word in nom.split())
+
+
+@lru_cache(maxsize=None)
+def fold(nom):
+    """ Clé de comparaison : abréviations développées, sans accents, minuscules, sans ponctuation"""
+
+    nom = unicodedata.normalize('NFKD', expand(nom))
+    nom = ''.join(c for c in nom if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', nom.lower()).split())
+
+
+@lru_cache(maxsize=65536)
+def similarity(a, b):
+    """ Score fuzz.partial_ratio mémorisé entre deux noms (0 si l'un des deux manque)"""
+
+    if not isinstance(a, str) or not isinstance(b, str):
+        return 0
+    return fuzz.partial_ratio(fold(a), fold(b))
+
+
+class NameIndex:
+    """ Résout un nom brut vers le nom canonique le plus proche (ou None)"""
+
+    def __init__(self, canonicals, threshold=80):
+        self.canonicals = list(canonicals)
+        self.threshold = threshold
+        self._keys = {fold(c): c for c in self.canonicals}
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, raw):
+        """ Nom canonique correspondant à `raw`, ou None en dessous du seuil"""
+
+        if not isinstance(raw, str):
+            return None
+        try:
+            return self._memo[raw]
+        except KeyError:
+            pass
+
+        key = fold(raw)
+        canonical = self._keys.get(key)
+        if canonical is None and self._keys:
+            # nom inconnu : un seul calcul de score contre tous les noms canoniques
+            scores = [(fuzz.partial_ratio(key, k), c) for k, c in self._keys.items()]
+            score, best = max(scores, key=lambda sc: sc[0])
+            if score >= self.threshold:
+                canonical = best
+
+        with self._lock:
+            self._memo[raw] = canonical
+        return canonical
+
+    def resolve_many(self, raws):
+        """ Résout une Series de noms (chaque valeur distincte une seule fois)"""
+
+        return raws.map({raw: self.resolve(raw) for raw in raws.unique()})
+
+
+@lru_cache(maxsize=64)
+def get_index(canonicals, threshold=80):
+    """ Index partagé pour un ensemble (tuple) de noms canoniques"""
+
+    return NameIndex(canonicals, threshold)
+
+
+def terminus_index():
+    """ Index des terminus de tramway"""
+
+    return get_index(tuple(TRAM_TERMINUS))
@@ -0,0 +1,373 @@
+""" Prévision à court terme du remplissage des stations Vélo'v et des parcs relais.
+
+    Le modèle est entraîné hors ligne sur l'historique (janvier 2022 et collecte
+    continue, grand_lyon.collecteur) et enregistré sous forme de petites tables :
+    - un profil par entité (station ou parc), jour de la semaine et quart d'heure :
+      taux de remplissage moyen, lissé sur les quarts d'heure voisins et ramené
+      vers le profil tous jours confondus tant que l'historique compte peu de semaines ;
+    - pour chaque entité et chaque horizon (HORIZONS), un coefficient `beta` de
+      persistance de l'écart au profil, ajusté par moindres carrés et ramené vers
+      la valeur commune à toutes les entités quand l'historique est court.
+
+    Prévision à l'horizon h, à partir du taux actuel :
+
+        taux(t + h) = profil(t + h) + beta(h) * (taux(t) - profil(t))
+
+    Pour toutes les stations à la fois, c'est une lecture dans les tables et
+    quelques opérations numpy : rien n'est recalculé à l'affichage. Une entité
+    inconnue du modèle garde son taux actuel.
+
+    Entraînement :   python -m grand_lyon.prevision [--test-jours 1]"""
+
+import argparse
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from grand_lyon import historique
+from grand_lyon.stockage import Store
+
+
+DATA_DIR = 'data_grand_lyon'
+COLLECTE_DIR = os.path.join(DATA_DIR, 'collecte')
+
+PAS = 15                                    # minutes par intervalle du profil
+INTERVALLES = 24 * 60 // PAS                # intervalles par jour
+HORIZONS = [15, 30, 60, 120]                # horizons ajustés (minutes)
+HORIZON = 30                                # horizon affiché dans le dashboard
+# un relevé reste valable au plus MAX_TROU (données encodées par deltas)
+MAX_TROU = pd.Timedelta(hours=2)
+# poids du profil tous jours confondus dans le profil d'un jour : deux semaines d'historique
+# (chaque valeur compte dans trois intervalles après lissage)
+PROFIL_PRIOR = 6
+# poids de la valeur commune dans beta : équivalent d'un jour d'historique
+BETA_PRIOR = INTERVALLES
+
+# flux : nom -> (clé de l'entité, nettoyage des relevés bruts, chargeur et fichiers de l'historique)
+FLUX = {'velov': ('number', historique.clean_velov, historique.load_velov,
+                  [historique.VELOV_CSV, historique.VELOV_PARQUET]),
+        'parcs_relais': ('nom', historique.clean_parcs_relais, historique.load_parcs_relais,
+                         [historique.PARCS_CSV, historique.PARCS_PARQUET])}
+
+_modeles = {}
+_lock = threading.Lock()
+
+
+def get_filename(name, root=DATA_DIR):
+    return os.path.join(root, f'prevision_{name}.npz')
+
+
+def get_slot(at):
+    """ (jour de la semaine, intervalle du jour) d'un instant"""
+
+    return at.weekday(), (at.hour * 60 + at.minute) // PAS
+
+
+class Modele:
+    """ Tables du modèle d'un flux : entités, profils (entité × jour × intervalle), beta (entité × horizon)"""
+
+    def __init__(self, entities, profil, beta, horizons=HORIZONS):
+        self.entities = pd.Index(entities).astype(str)
+        self.profil = np.asarray(profil, dtype='float32')
+        self.beta = np.asarray(beta, dtype='float32')
+        self.horizons = np.asarray(horizons, dtype='float32')
+
+    def __len__(self):
+        return len(self.entities)
+
+    def get_beta(self, idx, horizon):
+        """ beta de chaque entité à l'horizon `horizon` (minutes), interpolé entre les horizons ajustés
+            (beta = 1 à l'horizon 0)"""
+
+        x = np.r_[0, self.horizons]
+        betas = np.c_[np.ones(len(self)), self.beta][idx]
+        j = int(np.clip(np.searchsorted(x, horizon), 1, len(x) - 1))
+        w = np.clip((horizon - x[j - 1]) / (x[j] - x[j - 1]), 0, 1)
+        return (1 - w) * betas[:, j - 1] + w * betas[:, j]
+
+    def predict(self, entities, taux, at, horizon=HORIZON):
+        """ Input = identifiants, taux actuels (%), heure du relevé (heure de Paris, sans fuseau)
+            Retourne les taux prévus à `horizon` minutes (tableau numpy)"""
+
+        idx = self.entities.get_indexer(pd.Index(entities).astype(str))
+        connu = idx >= 0
+        idx = np.where(connu, idx, 0)
+        at = pd.Timestamp(at)
+        maintenant = self.profil[(idx, *get_slot(at))]
+        futur = self.profil[(idx, *get_slot(at + pd.Timedelta(minutes=horizon)))]
+        taux = np.asarray(taux, dtype='float64')
+        prevu = futur + self.get_beta(idx, horizon) * (taux - maintenant)
+        prevu = np.where(connu & np.isfinite(prevu), prevu, taux)
+        return np.clip(prevu, 0, 100)
+
+    def save(self, filename):
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, entities=self.entities.to_numpy(dtype=str), profil=self.profil.astype('float16'),
+                                beta=self.beta, horizons=self.horizons)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(data['entities'], data['profil'], data['beta'], data['horizons'])
+
+
+def get_releves(name, root=COLLECTE_DIR):
+    """ Relevés nettoyés (dateTime, clé, taux_remplissage) du flux `name` :
+        historique de janvier 2022 s'il existe, puis collecte continue"""
+
+    key, clean, load, sources = FLUX[name]
+    columns = ['dateTime', key, 'taux_remplissage']
+    parts = []
+    if any(os.path.exists(source) for source in sources):
+        parts.append(load(columns=columns))
+    store = Store(os.path.join(root, name))
+    if store.days():
+        parts.append(clean(store.read())[columns])
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    releves = pd.concat([p.astype({key: str}) for p in parts], ignore_index=True)
+    return releves.dropna(subset=['taux_remplissage'])
+
+
+def get_series(releves, key):
+    """ Relevés -> taux par intervalle de PAS minutes (lignes) et par entité (colonnes).
+        Un relevé reste valable jusqu'au suivant (au plus MAX_TROU)."""
+
+    slot = releves['dateTime'].dt.floor(f'{PAS}min')
+    series = releves.assign(slot=slot).groupby(['slot', key], observed=True)['taux_remplissage'].mean().unstack(key)
+    series = series.reindex(pd.date_range(series.index.min(), series.index.max(), freq=f'{PAS}min'))
+    return series.ffill(limit=int(MAX_TROU / pd.Timedelta(minutes=PAS)))
+
+
+def get_semaine(index):
+    """ Intervalle de la semaine (0 .. 7 * INTERVALLES - 1) de chaque instant"""
+
+    return (index.weekday * INTERVALLES + (index.hour * 60 + index.minute) // PAS).to_numpy()
+
+
+def get_sommes(valeurs, semaine):
+    """ Sommes et nombres de valeurs par intervalle de la semaine (7 * INTERVALLES × entité),
+        lissés sur l'intervalle précédent, courant et suivant"""
+
+    somme = np.zeros((7 * INTERVALLES, valeurs.shape[1]))
+    nombre = np.zeros_like(somme)
+    np.add.at(somme, semaine, np.nan_to_num(valeurs))
+    np.add.at(nombre, semaine, np.isfinite(valeurs))
+    somme = somme + np.roll(somme, 1, axis=0) + np.roll(somme, -1, axis=0)
+    nombre = nombre + np.roll(nombre, 1, axis=0) + np.roll(nombre, -1, axis=0)
+    return somme, nombre
+
+
+def get_moyennes(somme, nombre, moyenne):
+    """ Moyennes par intervalle de la semaine, ramenées vers la moyenne de l'intervalle tous
+        jours confondus (poids PROFIL_PRIOR), elle-même remplacée par `moyenne` (par entité)
+        quand l'intervalle n'a aucune valeur"""
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        jour = somme.reshape(7, INTERVALLES, -1).sum(axis=0) / nombre.reshape(7, INTERVALLES, -1).sum(axis=0)
+    jour = np.tile(np.where(np.isfinite(jour), jour, moyenne[None]), (7, 1))
+    return (somme + PROFIL_PRIOR * jour) / (nombre + PROFIL_PRIOR)
+
+
+def get_moyenne(valeurs):
+    """ Moyenne de chaque entité (moyenne générale pour une entité sans valeur)"""
+
+    valide = np.isfinite(valeurs)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        moyenne = np.nansum(valeurs, axis=0) / valide.sum(axis=0)
+    return np.where(np.isfinite(moyenne), moyenne, np.nanmean(valeurs) if valide.any() else 0)
+
+
+def get_profil(series):
+    """ Profil (entité × 7 jours × INTERVALLES) : moyenne par jour de la semaine et intervalle,
+        lissée sur les intervalles voisins (get_moyennes)"""
+
+    valeurs = series.to_numpy(dtype='float64')
+    profil = get_moyennes(*get_sommes(valeurs, get_semaine(series.index)), get_moyenne(valeurs))
+    return profil.reshape(7, INTERVALLES, -1).transpose(2, 0, 1)
+
+
+def get_ecarts(series):
+    """ Écarts de chaque relevé au profil calculé sans le jour du relevé (mêmes dimensions que
+        `series`) : avec peu de semaines d'historique, le profil complet contient le relevé
+        lui-même et les écarts seraient artificiellement petits"""
+
+    valeurs = series.to_numpy(dtype='float64')
+    semaine = get_semaine(series.index)
+    somme, nombre = get_sommes(valeurs, semaine)
+    moyenne = get_moyenne(valeurs)
+    ecarts = np.full_like(valeurs, np.nan)
+    dates = series.index.normalize()
+    for date in dates.unique():
+        lignes = np.flatnonzero(dates == date)
+        somme_jour, nombre_jour = get_sommes(valeurs[lignes], semaine[lignes])
+        profil = get_moyennes(somme - somme_jour, nombre - nombre_jour, moyenne)
+        ecarts[lignes] = valeurs[lignes] - profil[semaine[lignes]]
+    return ecarts
+
+
+def get_beta(ecarts, horizons=HORIZONS):
+    """ Coefficient de persistance des écarts (entité × horizon), moindres carrés sans constante,
+        ramené vers le coefficient commun (poids BETA_PRIOR), borné à [0, 1]"""
+
+    beta = np.zeros((ecarts.shape[1], len(horizons)))
+    for j, horizon in enumerate(horizons):
+        k = horizon // PAS
+        x, y = ecarts[:-k], ecarts[k:]
+        valide = np.isfinite(x) & np.isfinite(y)
+        sxy = np.where(valide, x * y, 0).sum(axis=0)
+        sxx = np.where(valide, x * x, 0).sum(axis=0)
+        n = valide.sum(axis=0)
+        commun = sxy.sum() / sxx.sum() if sxx.sum() > 0 else 0.0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            propre = np.where(sxx > 0, sxy / sxx, commun)
+        w = n / (n + BETA_PRIOR)
+        beta[:, j] = w * propre + (1 - w) * commun
+    return np.clip(beta, 0, 1)
+
+
+def train(series, horizons=HORIZONS):
+    """ Input = taux par intervalle et par entité (get_series)
+        Retourne le modèle (Modele)"""
+
+    return Modele(series.columns, get_profil(series), get_beta(get_ecarts(series), horizons), horizons)
+
+
+def evaluate(modele, series, horizons=HORIZONS):
+    """ Erreur absolue moyenne (points de taux) par horizon : modèle, persistance, profil seul
+        Retourne un DataFrame"""
+
+    valeurs = series.to_numpy(dtype='float64')
+    resultats = []
+    for horizon in horizons:
+        k = horizon // PAS
+        erreurs = {'modele': [], 'persistance': [], 'profil': []}
+        for i in range(len(series) - k):
+            actuel, reel = valeurs[i], valeurs[i + k]
+            valide = np.isfinite(actuel) & np.isfinite(reel)
+            if not valide.any():
+                continue
+            at = series.index[i]
+            prevu = modele.predict(series.columns[valide], actuel[valide], at, horizon)
+            idx = np.maximum(modele.entities.get_indexer(series.columns[valide].astype(str)), 0)
+            profil = modele.profil[(idx, *get_slot(at + pd.Timedelta(minutes=horizon)))]
+            erreurs['modele'].append(np.abs(prevu - reel[valide]))
+            erreurs['persistance'].append(np.abs(actuel[valide] - reel[valide]))
+            erreurs['profil'].append(np.abs(profil - reel[valide]))
+        resultats.append({'horizon': horizon, **{nom: float(np.concatenate(v).mean()) if v else np.nan
+                                                 for nom, v in erreurs.items()}})
+    return pd.DataFrame(resultats)
+
+
+def build(name, root=DATA_DIR, test_jours=0):
+    """ Entraîne et enregistre le modèle du flux `name`
+        test_jours > 0 : évalue d'abord un modèle entraîné sans les `test_jours` derniers jours
+        Retourne (modèle, évaluation ou None), ou None sans historique"""
+
+    releves = get_releves(name)
+    if releves.empty:
+        return None
+    series = get_series(releves, FLUX[name][0])
+    evaluation = None
+    if test_jours:
+        coupure = series.index.max() - pd.Timedelta(days=test_jours)
+        evaluation = evaluate(train(series[series.index <= coupure]), series[series.index > coupure])
+    modele = train(series)
+    modele.save(get_filename(name, root))
+    return modele, evaluation
+
+
+def get_modele(name, root=DATA_DIR):
+    """ Modèle du flux `name`, relu seulement quand le fichier change ; None s'il n'a pas été entraîné"""
+
+    filename = get_filename(name, root)
+    try:
+        version = os.path.getmtime(filename)
+    except OSError:
+        return None
+    with _lock:
+        entry = _modeles.get(filename)
+        if entry is None or entry[0] != version:
+            entry = (version, Modele.load(filename))
+            _modeles[filename] = entry
+    return entry[1]
+
+
+def get_version(name, root=DATA_DIR):
+    """ Date de l'entraînement du modèle (pour les clés de cache), ou None"""
+
+    try:
+        return os.path.getmtime(get_filename(name, root))
+    except OSError:
+        return None
+
+
+def get_heure(df):
+    """ Heure du relevé temps réel (heure de Paris, sans fuseau)"""
+
+    return pd.Timestamp(df['timestamp'].iloc[0]).tz_convert('Europe/Paris').tz_localize(None)
+
+
+def prevoir_velov(df, horizon=HORIZON):
+    """ Input = DataFrame velov temps réel
+        Retourne le nombre de vélos prévu dans `horizon` minutes par station (Series, NaN pour
+        les stations fermées ou sans données), ou None si le modèle n'a pas été entraîné"""
+
+    modele = get_modele('velov')
+    if modele is None or df.empty:
+        return None
+    velos = pd.to_numeric(df['available_bikes'], errors='coerce').to_numpy(dtype='float64')
+    places = pd.to_numeric(df['available_bike_stands'], errors='coerce').to_numpy(dtype='float64')
+    bornes = pd.to_numeric(df['bike_stands'], errors='coerce').to_numpy(dtype='float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        taux = places / bornes * 100
+    prevu = modele.predict(df['number'], taux, get_heure(df), horizon)
+
+    # le taux porte sur les places libres : les vélos suivent en sens inverse
+    velos_prevus = np.clip(np.round(velos - (prevu - taux) * bornes / 100), 0, velos + places)
+    valide = (np.isfinite(velos_prevus) & (bornes > 0) & (df['status'] != 'CLOSED').to_numpy()
+              & (df['availability'].fillna('').astype(str) != '').to_numpy())
+    return pd.Series(np.where(valide, velos_prevus, np.nan), index=df.index, name='velos_prevus')
+
+
+def prevoir_parcs_relais(df, horizon=HORIZON):
+    """ Input = DataFrame parcs relais temps réel (colonnes du csv)
+        Retourne un DataFrame : parc, capacité, places disponibles, places prévues dans `horizon` minutes
+        (colonne absente si le modèle n'a pas été entraîné)"""
+
+    parcs = historique.clean_parcs_relais(df.copy())
+    resultat = pd.DataFrame({'Parc relais': parcs['nom'].astype(str),
+                             'Capacité': parcs['capacite'],
+                             'Places disponibles': parcs['nb_tot_place_dispo'].round().astype('Int64')})
+    modele = get_modele('parcs_relais')
+    if modele is not None and not parcs.empty:
+        prevu = modele.predict(parcs['nom'], parcs['taux_remplissage'], parcs['dateTime'].iloc[0], horizon)
+        places = np.round(parcs['capacite'].to_numpy() * (1 - prevu / 100))
+        resultat[f'Dans {horizon} min (prévision)'] = pd.array(places, dtype='Int64')
+    return resultat.sort_values('Parc relais').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entraînement des modèles de prévision")
+    parser.add_argument('--test-jours', type=int, default=0,
+                        help="évalue d'abord un modèle entraîné sans les N derniers jours")
+    args = parser.parse_args()
+
+    for name in FLUX:
+        resultat = build(name, test_jours=args.test_jours)
+        if resultat is None:
+            print(f"{name} : pas d'historique")
+            continue
+        modele, evaluation = resultat
+        filename = get_filename(name)
+        print(f'{name} : {len(modele)} entités, {os.path.getsize(filename) / 1e3:.0f} ko   {filename}')
+        if evaluation is not None:
+            print(evaluation.round(2).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
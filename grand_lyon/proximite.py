@@ -0,0 +1,148 @@
+""" Index spatial des stations Vélo'v et des points d'arrêt TCL.
+
+    Les points sont projetés en mètres (projection équirectangulaire centrée sur
+    Lyon, largement assez précise à l'échelle de la métropole) et rangés dans une
+    grille dont la taille des cases suit la densité des points (quelques points
+    par case). Une requête ne lit que les cases voisines :
+    - within(lat, lon, rayon)         : points à moins de `rayon` mètres ;
+    - nearest(lat, lon, k, masque)    : k plus proches parmi les points retenus par
+                                        `masque` (ex. stations avec au moins N vélos),
+                                        en élargissant la recherche case par case.
+
+    L'index est reconstruit une fois par actualisation des données (get_index) ;
+    une requête prend quelques dizaines de microsecondes, y compris sur
+    l'ensemble des arrêts de bus du réseau."""
+
+import math
+import threading
+
+import numpy as np
+
+
+LAT_REF = 45.75
+METRES_LAT = 111_320
+METRES_LON = METRES_LAT * math.cos(math.radians(LAT_REF))
+# nombre moyen de points par case visé, bornes de la taille des cases (mètres)
+POINTS_PAR_CASE = 4
+CELL_MIN, CELL_MAX = 50, 2000
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def to_metres(lat, lon):
+    """ Coordonnées -> (x, y) en mètres"""
+
+    return np.asarray(lon, dtype='float64') * METRES_LON, np.asarray(lat, dtype='float64') * METRES_LAT
+
+
+class GridIndex:
+    """ Grille de points : {(i, j): positions des points de la case}"""
+
+    def __init__(self, lat, lon, cell=None):
+        self.x, self.y = to_metres(lat, lon)
+        self.x = np.nan_to_num(self.x, nan=np.inf)
+        self.y = np.nan_to_num(self.y, nan=np.inf)
+        valides = np.isfinite(self.x) & np.isfinite(self.y)
+        positions = np.flatnonzero(valides)
+        if cell is None:
+            cell = get_cell(self.x[positions], self.y[positions])
+        self.cell = cell
+        ci = np.floor(self.x[positions] / cell).astype('int64')
+        cj = np.floor(self.y[positions] / cell).astype('int64')
+        order = np.lexsort((cj, ci))
+        ci, cj, positions = ci[order], cj[order], positions[order]
+        coupures = np.flatnonzero((np.diff(ci) != 0) | (np.diff(cj) != 0)) + 1
+        self.cells = {(int(i[0]), int(j[0])): p
+                      for i, j, p in zip(np.split(ci, coupures), np.split(cj, coupures), np.split(positions, coupures))
+                      if len(p)}
+        if self.cells:
+            cles = np.array(list(self.cells))
+            self.bornes = cles.min(axis=0), cles.max(axis=0)
+        else:
+            self.bornes = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def candidates(self, i0, j0, anneau):
+        """ Positions des points des cases à distance de Tchebychev `anneau` de la case (i0, j0)"""
+
+        if anneau == 0:
+            cases = [(i0, j0)]
+        else:
+            cases = ([(i0 + d, j0 - anneau) for d in range(-anneau, anneau + 1)]
+                     + [(i0 + d, j0 + anneau) for d in range(-anneau, anneau + 1)]
+                     + [(i0 - anneau, j0 + d) for d in range(-anneau + 1, anneau)]
+                     + [(i0 + anneau, j0 + d) for d in range(-anneau + 1, anneau)])
+        trouves = [self.cells[c] for c in cases if c in self.cells]
+        return np.concatenate(trouves) if trouves else np.empty(0, dtype='int64')
+
+    def distances(self, x, y, positions):
+        return np.hypot(self.x[positions] - x, self.y[positions] - y)
+
+    def within(self, lat, lon, rayon):
+        """ Points à moins de `rayon` mètres
+            Retourne (positions, distances) triés par distance"""
+
+        x, y = to_metres(lat, lon)
+        i0, j0 = int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+        n = int(math.ceil(rayon / self.cell))
+        trouves = [self.cells[(i, j)] for i in range(i0 - n, i0 + n + 1) for j in range(j0 - n, j0 + n + 1)
+                   if (i, j) in self.cells]
+        if not trouves:
+            return np.empty(0, dtype='int64'), np.empty(0)
+        positions = np.concatenate(trouves)
+        d = self.distances(x, y, positions)
+        garder = d <= rayon
+        positions, d = positions[garder], d[garder]
+        order = np.argsort(d, kind='stable')
+        return positions[order], d[order]
+
+    def nearest(self, lat, lon, k=5, masque=None):
+        """ k points les plus proches parmi ceux pour lesquels `masque` (tableau booléen) est vrai
+            Retourne (positions, distances) triés par distance"""
+
+        if self.bornes is None:
+            return np.empty(0, dtype='int64'), np.empty(0)
+        x, y = to_metres(lat, lon)
+        i0, j0 = int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
+        # anneau au-delà duquel toutes les cases ont été vues
+        dernier = max(abs(i0 - self.bornes[0][0]), abs(i0 - self.bornes[1][0]),
+                      abs(j0 - self.bornes[0][1]), abs(j0 - self.bornes[1][1]))
+        positions, d = np.empty(0, dtype='int64'), np.empty(0)
+        for anneau in range(dernier + 1):
+            nouveaux = self.candidates(i0, j0, anneau)
+            if masque is not None and len(nouveaux):
+                nouveaux = nouveaux[masque[nouveaux]]
+            if len(nouveaux):
+                positions = np.concatenate([positions, nouveaux])
+                d = np.concatenate([d, self.distances(x, y, nouveaux)])
+            # les anneaux 0..anneau couvrent au moins anneau * cell mètres autour du point
+            if len(d) >= k and np.partition(d, k - 1)[k - 1] <= anneau * self.cell:
+                break
+        order = np.argsort(d, kind='stable')[:k]
+        return positions[order], d[order]
+
+
+def get_cell(x, y):
+    """ Taille des cases pour environ POINTS_PAR_CASE points par case"""
+
+    if len(x) < 2:
+        return CELL_MAX
+    surface = max(np.ptp(x), 1) * max(np.ptp(y), 1)
+    return float(np.clip(math.sqrt(surface * POINTS_PAR_CASE / len(x)), CELL_MIN, CELL_MAX))
+
+
+def get_index(name, version, lat, lon, cell=None):
+    """ Index des points `name`, reconstruit seulement quand `version` change
+        (ex. heure du relevé Vélo'v, date de mise à jour de la table des arrêts)"""
+
+    with _lock:
+        entry = _indexes.get(name)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+    index = GridIndex(lat, lon, cell)
+    with _lock:
+        _indexes[name] = (version, index)
+    return index
@@ -0,0 +1,341 @@
+""" Enregistrement et rejeu hors ligne des API du Grand Lyon.
+
+    Enregistrement :   python -m grand_lyon.rejeu enregistrer [--interval 60] [--duree 86400] [jeux...]
+    Rejeu :            python -m grand_lyon.rejeu servir [--port 8765] [--vitesse 60] [--latence 0.1]
+
+    - l'enregistrement relève les jeux temps réel (clés de api.WS_DATASETS) à
+      intervalle fixe et garde chaque réponse telle quelle, compressée :
+      data_grand_lyon/rejeu/<clé>/<AAAAMMJJTHHMMSS>.json.gz ; les couches WFS
+      (wfs.<couche>), qui changent rarement, ne sont relevées qu'une fois ;
+    - le serveur local imite les points d'accès ws/rdata et wfs/rdata : il sert,
+      pour chaque jeu, le dernier relevé antérieur à l'heure du rejeu, qui avance
+      `vitesse` fois plus vite que l'heure réelle (une journée en 24 minutes à
+      60×) et reprend au début à la fin de l'enregistrement ; chaque réponse est
+      retardée de `latence` secondes (plus une gigue aléatoire) et peut être
+      envoyée à un débit limité par connexion (`debit`, ko/s) ;
+    - les requêtes WFS avec propertyName, FILTER (opérateurs de grand_lyon.wfs),
+      sortBy, startIndex / count sont appliquées au relevé comme par le serveur
+      du Grand Lyon (numberMatched, numberReturned) ;
+    - chaque réponse porte un ETag et un Last-Modified (date du relevé) : les
+      requêtes conditionnelles reçoivent un 304 si la réponse n'a pas changé ;
+    - un dossier de réponses uniques (<clé>.json.gz, comme benchmarks/fixtures/)
+      est aussi servi, chaque réponse valant pour toute la durée du rejeu.
+
+    Le dashboard et le collecteur utilisent le serveur via GRAND_LYON_URL :
+        GRAND_LYON_URL=http://127.0.0.1:8765 streamlit run streamlit_app.py
+    Le serveur ne demande pas d'identifiants."""
+
+import argparse
+import bisect
+import datetime as dt
+from email.utils import formatdate
+from functools import lru_cache
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from grand_lyon import api, flux_json, wfs
+
+
+DATA_DIR = 'data_grand_lyon'
+REJEU_DIR = os.path.join(DATA_DIR, 'rejeu')
+FORMAT = '%Y%m%dT%H%M%S'
+EXTENSION = '.json.gz'
+
+# jeux enregistrés : clé -> URL
+URLS = {**{name: api.ws_url(name) for name in api.WS_DATASETS},
+        **{f'wfs.{layer}': api.wfs_url(layer) for layer in api.WFS_LAYERS}}
+# jeux dont l'accès demande une authentification
+AUTH = ['passages_tram']
+
+logger = logging.getLogger(__name__)
+
+
+def get_filename(name, instant, root=REJEU_DIR):
+    return os.path.join(root, name, instant.strftime(FORMAT) + EXTENSION)
+
+
+def record(names, root=REJEU_DIR, instant=None):
+    """ Un relevé des jeux `names`, enregistré tel que renvoyé par l'API
+        Retourne {clé: octets enregistrés}"""
+
+    instant = instant or dt.datetime.now()
+    tailles = {}
+    for name in names:
+        r = api.get_session().get(URLS[name], auth=api.get_auth() if name in AUTH else None, timeout=api.TIMEOUT)
+        r.raise_for_status()
+        filename = get_filename(name, instant, root)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with gzip.open(filename + '.tmp', 'wb') as f:
+            f.write(r.content)
+        os.replace(filename + '.tmp', filename)
+        tailles[name] = os.path.getsize(filename)
+    return tailles
+
+
+def record_loop(names, root=REJEU_DIR, interval=60, duree=None, stop_event=None):
+    """ Relevés à cadence fixe pendant `duree` secondes (jusqu'à stop_event sinon),
+        les couches WFS au premier relevé seulement"""
+
+    stop_event = stop_event or threading.Event()
+    start = time.monotonic()
+    tick = 0
+    while not stop_event.is_set() and (duree is None or time.monotonic() - start < duree):
+        jeux = [name for name in names if tick == 0 or not name.startswith('wfs.')]
+        try:
+            tailles = record(jeux, root)
+            logger.info("relevé %s : %s ko", tick, round(sum(tailles.values()) / 1e3))
+        except Exception:
+            logger.exception("relevé impossible")
+        # cadence fixe : les relevés en retard sont sautés, pas rattrapés
+        tick = max(tick + 1, int((time.monotonic() - start) / interval) + 1)
+        stop_event.wait(max(0, start + tick * interval - time.monotonic()))
+
+
+@lru_cache(maxsize=64)
+def read(filename):
+    """ Réponse compressée enregistrée dans `filename` (gardée en mémoire)"""
+
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+@lru_cache(maxsize=16)
+def read_json(filename):
+    """ Réponse enregistrée dans `filename`, décodée (gardée en mémoire)"""
+
+    return json.loads(gzip.decompress(read(filename)))
+
+
+def is_query_wfs(name, query):
+    """ Vrai si la requête `query` (paramètres en minuscules) sur le jeu `name` demande
+        autre chose que la couche WFS entière"""
+
+    return name.startswith('wfs.') and bool(query.keys() & {'propertyname', 'filter', 'sortby', 'count'}
+                                            or query.get('startindex', '0') != '0')
+
+
+def query_wfs(data, query):
+    """ Applique à la collection GeoJSON `data` les paramètres WFS `query` (noms en minuscules) :
+        FILTER, sortBy, startIndex / count, propertyName
+        Retourne la collection (dict)"""
+
+    features = data['features']
+    if 'filter' in query:
+        filtre = wfs.from_fes(query['filter'])
+        features = [f for f in features if wfs.match(filtre, f.get('properties') or {})]
+    if 'sortby' in query:
+        cle = query['sortby'].split()[0]
+        features = sorted(features, key=lambda f: str((f.get('properties') or {}).get(cle, '')).zfill(12))
+    total = len(features)
+    start = int(query.get('startindex', 0))
+    fin = start + int(query['count']) if 'count' in query else None
+    features = features[start:fin]
+    if 'propertyname' in query:
+        features = list(flux_json.project_features(features, query['propertyname'].split(',')))
+    return {'type': 'FeatureCollection', 'features': features,
+            'numberMatched': total, 'numberReturned': len(features)}
+
+
+@lru_cache(maxsize=256)
+def read_wfs(filename, query):
+    """ Réponse compressée de la requête WFS `query` ((paramètre, valeur), ...) sur le relevé
+        `filename` (gardée en mémoire : le serveur ne compte que le transfert)"""
+
+    data = query_wfs(read_json(filename), dict(query))
+    return gzip.compress(json.dumps(data, ensure_ascii=False).encode('utf-8'), compresslevel=6, mtime=0)
+
+
+def get_etag(body):
+    """ Validateur de la réponse compressée `body`"""
+
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+class Rejeu:
+    """ Relevés enregistrés dans `root`, rejoués `vitesse` fois plus vite que l'heure réelle"""
+
+    def __init__(self, root=REJEU_DIR, vitesse=60, boucle=True):
+        self.root = root
+        self.vitesse = vitesse
+        self.boucle = boucle
+        # clé -> (instants triés, fichiers) ; instant None : réponse unique
+        self.releves = {}
+        for entry in sorted(os.listdir(root)):
+            path = os.path.join(root, entry)
+            if os.path.isdir(path) and entry in URLS:
+                fichiers = sorted(f for f in os.listdir(path) if f.endswith(EXTENSION))
+                if fichiers:
+                    instants = [dt.datetime.strptime(f[:-len(EXTENSION)], FORMAT) for f in fichiers]
+                    self.releves[entry] = (instants, [os.path.join(path, f) for f in fichiers])
+            elif entry.endswith(EXTENSION) and entry[:-len(EXTENSION)] in URLS:
+                self.releves.setdefault(entry[:-len(EXTENSION)], ([None], [path]))
+        if not self.releves:
+            raise FileNotFoundError(f"aucun relevé enregistré dans {root}")
+        instants = [i for instants, _ in self.releves.values() for i in instants if i is not None]
+        self.debut = min(instants, default=None)
+        self.fin = max(instants, default=None)
+        self.demarrage = time.monotonic()
+
+    def get_heure(self):
+        """ Heure du rejeu (None si les relevés ne sont pas datés)"""
+
+        if self.debut is None:
+            return None
+        ecoule = (time.monotonic() - self.demarrage) * self.vitesse
+        duree = (self.fin - self.debut).total_seconds()
+        if duree <= 0:
+            return self.debut
+        ecoule = ecoule % duree if self.boucle else min(ecoule, duree)
+        return self.debut + dt.timedelta(seconds=ecoule)
+
+    def get(self, name, heure=None):
+        """ Réponse compressée du jeu `name` à l'heure `heure` (heure du rejeu par défaut) :
+            dernier relevé antérieur, ou le premier relevé si aucun ne l'est"""
+
+        return read(self.get_filename(name, heure))
+
+    def get_filename(self, name, heure=None):
+        instants, fichiers = self.releves[name]
+        if instants[0] is None:
+            return fichiers[0]
+        heure = heure or self.get_heure()
+        return fichiers[max(bisect.bisect_right(instants, heure) - 1, 0)]
+
+    def get_wfs(self, name, query):
+        """ Réponse compressée de la requête WFS `query` sur la couche `name`"""
+
+        return read_wfs(self.get_filename(name), tuple(sorted(query.items())))
+
+    def state(self):
+        heure = self.get_heure()
+        return {'heure': heure and heure.isoformat(timespec='seconds'),
+                'debut': self.debut and self.debut.isoformat(timespec='seconds'),
+                'fin': self.fin and self.fin.isoformat(timespec='seconds'),
+                'vitesse': self.vitesse,
+                'jeux': {name: len(fichiers) for name, (_, fichiers) in self.releves.items()}}
+
+
+def get_handler(rejeu, latence=0.0, gigue=0.0, debit=None):
+    """ Gestionnaire HTTP servant les relevés de `rejeu` après `latence` (+ gigue) secondes,
+        à `debit` ko/s par connexion (sans limite par défaut)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if urlparse(self.path).path.rstrip('/') in ('', '/rejeu'):
+                return self.send(json.dumps(rejeu.state()).encode(), compresse=False)
+            name = api.get_name(self.path)
+            if name is None or name not in rejeu.releves:
+                return self.send(b'{"error": "not found"}', status=404, compresse=False)
+            time.sleep(latence + random.uniform(0, gigue))
+            query = {k.lower(): v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            filename = rejeu.get_filename(name)
+            if is_query_wfs(name, query):
+                try:
+                    body = rejeu.get_wfs(name, query)
+                except (ValueError, KeyError, SyntaxError) as e:
+                    return self.send(json.dumps({'error': str(e)}).encode(), status=400, compresse=False)
+            else:
+                body = read(filename)
+            # validateurs : requêtes conditionnelles (If-None-Match / If-Modified-Since) -> 304
+            entetes = {'ETag': get_etag(body), 'Last-Modified': formatdate(os.path.getmtime(filename), usegmt=True)}
+            if 'If-None-Match' in self.headers:
+                inchange = entetes['ETag'] in [e.strip() for e in self.headers['If-None-Match'].split(',')]
+            else:
+                inchange = self.headers.get('If-Modified-Since') == entetes['Last-Modified']
+            if inchange:
+                return self.send(b'', status=304, compresse=False, entetes=entetes)
+            self.send(body, entetes=entetes)
+
+        def send(self, body, status=200, compresse=True, entetes=None):
+            heure = rejeu.get_heure()
+            if compresse and 'gzip' not in self.headers.get('Accept-Encoding', ''):
+                body, compresse = gzip.decompress(body), False
+            self.send_response(status)
+            for key, value in (entetes or {}).items():
+                self.send_header(key, value)
+            if heure is not None:
+                self.send_header('X-Rejeu-Heure', heure.isoformat(timespec='seconds'))
+            if status == 304:
+                self.end_headers()
+                return
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            if compresse:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if not debit:
+                self.wfile.write(body)
+                return
+            # débit limité : morceaux de 10 ms
+            taille = max(int(debit * 10), 1)
+            for i in range(0, len(body), taille):
+                self.wfile.write(body[i:i + taille])
+                time.sleep(0.01)
+
+        def log_message(self, format, *args):
+            logger.debug("%s %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def serve(rejeu, host='127.0.0.1', port=8765, latence=0.0, gigue=0.0, debit=None):
+    """ Serveur HTTP local (un thread par connexion), à lancer par serve_forever()"""
+
+    server = ThreadingHTTPServer((host, port), get_handler(rejeu, latence, gigue, debit))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enregistrement et rejeu hors ligne des API du Grand Lyon")
+    commandes = parser.add_subparsers(dest='commande', required=True)
+
+    enregistrer = commandes.add_parser('enregistrer', help="relève les API à intervalle fixe")
+    enregistrer.add_argument('noms', nargs='*', help=f"jeux enregistrés (défaut : tous, {', '.join(URLS)})")
+    enregistrer.add_argument('--interval', type=float, default=60, help="secondes entre deux relevés")
+    enregistrer.add_argument('--duree', type=float, help="durée de l'enregistrement en secondes (défaut : sans fin)")
+    enregistrer.add_argument('--dossier', default=REJEU_DIR)
+
+    servir = commandes.add_parser('servir', help="sert les relevés enregistrés")
+    servir.add_argument('--dossier', default=REJEU_DIR)
+    servir.add_argument('--host', default='127.0.0.1')
+    servir.add_argument('--port', type=int, default=8765)
+    servir.add_argument('--vitesse', type=float, default=60, help="accélération du rejeu")
+    servir.add_argument('--latence', type=float, default=0.1, help="délai de chaque réponse, en secondes")
+    servir.add_argument('--gigue', type=float, default=0.0, help="délai aléatoire ajouté, en secondes")
+    servir.add_argument('--debit', type=float, help="débit par connexion, en ko/s (défaut : sans limite)")
+    servir.add_argument('--sans-boucle', action='store_true', help="reste sur le dernier relevé à la fin")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.commande == 'enregistrer':
+        stop_event = threading.Event()
+        signal.signal(signal.SIGINT, lambda *a: stop_event.set())
+        signal.signal(signal.SIGTERM, lambda *a: stop_event.set())
+        record_loop(args.noms or list(URLS), args.dossier, args.interval, args.duree, stop_event)
+        return
+
+    rejeu = Rejeu(args.dossier, args.vitesse, boucle=not args.sans_boucle)
+    server = serve(rejeu, args.host, args.port, args.latence, args.gigue, args.debit)
+    logger.info("rejeu de %s sur http://%s:%s : %s", args.dossier, args.host, args.port, rejeu.state())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
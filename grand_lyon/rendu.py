@@ -0,0 +1,98 @@
+""" Rendu des cartes Folium en mémoire, partagé par toutes les sessions Streamlit.
+
+    Une carte est rendue directement en html (str), sans fichier intermédiaire,
+    puis gardée en mémoire sous une empreinte de ses entrées (ligne, terminus,
+    heure du relevé…) : des sessions qui affichent la même vue ne la rendent
+    qu'une fois. Les rendus concurrents d'une même vue sont regroupés
+    (single-flight) et seules les `max_entries` vues servies le plus récemment
+    sont gardées."""
+
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from grand_lyon.cache import _Flight
+from grand_lyon.metriques import etape
+
+
+MAX_ENTRIES = 64
+
+
+def get_digest(*parts):
+    """ Empreinte (str) des entrées d'un rendu"""
+
+    key = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def to_html(map):
+    """ Html complet de la carte Folium (identique au fichier écrit par map.save())"""
+
+    with etape('to_html') as mesure:
+        html = map.get_root().render()
+        mesure.octets = len(html)
+    return html
+
+
+class RenderCache:
+    """ Html des cartes indexé par l'empreinte de leurs entrées (LRU + single-flight)"""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._stats = {'hits': 0, 'renders': 0, 'coalesced': 0, 'errors': 0}
+
+    def get(self, parts, render):
+        """ Retourne le html de la vue décrite par `parts` (tuple),
+            en appelant `render()` s'il n'est pas en mémoire"""
+
+        key = get_digest(*parts)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._entries[key]
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._stats['coalesced'] += 1
+
+        if leader:
+            try:
+                flight.value = render()
+            except Exception as e:
+                flight.error = e
+            with self._lock:
+                if flight.error is None:
+                    self._entries[key] = flight.value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                    self._stats['renders'] += 1
+                else:
+                    self._stats['errors'] += 1
+                del self._flights[key]
+            flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries),
+                        bytes=sum(len(html) for html in self._entries.values()))
+
+
+# instance unique du processus
+render_cache = RenderCache()
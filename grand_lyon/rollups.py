@@ -0,0 +1,247 @@
+""" Agrégats multi-résolution (minute, heure, jour) de l'historique collecté.
+
+    Pour chaque intervalle et chaque station / parc, on garde le minimum, le
+    maximum, la somme et le nombre de valeurs du taux de remplissage. Chaque
+    résolution a sa propre durée de conservation (RETENTION). Les agrégats sont
+    alimentés par le collecteur à chaque relevé complet.
+
+    Rollups.slice() a la même interface que Cube.slice() : les graphiques
+    l'interrogent sans savoir d'où viennent les données, et la résolution la plus
+    grossière capable de répondre (heure pour un profil horaire, jour sinon) est
+    choisie automatiquement."""
+
+import datetime as dt
+import os
+import threading
+
+import pandas as pd
+
+from grand_lyon import cubes, historique
+
+
+DATA_DIR = 'data_grand_lyon'
+ROLLUPS_DIR = os.path.join(DATA_DIR, 'rollups')
+
+# résolutions, de la plus fine à la plus grossière
+RESOLUTIONS = {'minute': pd.Timedelta(minutes=1),
+               'hour': pd.Timedelta(hours=1),
+               'day': pd.Timedelta(days=1)}
+
+# durée de conservation par résolution (None = illimitée)
+RETENTION = {'minute': pd.Timedelta(days=2),
+             'hour': pd.Timedelta(days=400),
+             'day': None}
+
+# flux agrégés : nom -> (nettoyage des relevés bruts, clés de l'entité)
+FLUX = {'velov': (historique.clean_velov, ['commune', 'name']),
+        'parcs_relais': (historique.clean_parcs_relais, ['nom'])}
+
+AGGREGATS = ['min', 'max', 'sum', 'count']
+FUSION = {'min': 'min', 'max': 'max', 'sum': 'sum', 'count': 'sum'}
+
+# intervalles clos enregistrés par partition : une heure de minutes, un mois d'heures, une année de jours
+PARTITIONS = {'minute': 'h', 'hour': 'M', 'day': 'Y'}
+FORMAT_PARTITION = '%Y%m%dT%H'
+# intervalles ouverts (susceptibles de recevoir d'autres relevés)
+OUVERT = 'ouvert'
+
+
+class Rollups:
+    """ Agrégats d'un flux, une table par résolution.
+
+        Chaque résolution est gardée en deux parties : les intervalles ouverts (le
+        dernier intervalle reçu, une petite table mise à jour à chaque relevé) et
+        les intervalles clos, enregistrés par partition (<résolution>/<début>.parquet).
+        Un relevé ne recalcule que la table des intervalles ouverts ; l'enregistrement
+        ne réécrit que les partitions qui ont reçu des intervalles clos depuis le
+        précédent. L'historique complet n'est lu qu'à la première consultation."""
+
+    def __init__(self, root, keys, value='taux_remplissage', retention=RETENTION):
+        self.root = root
+        self.keys = list(keys)
+        self.value = value
+        self.retention = dict(retention)
+        self._lock = threading.Lock()
+        self.ouverts = {res: self.read(self.path(res, OUVERT)) for res in RESOLUTIONS}
+        # intervalles clos pas encore enregistrés : résolution -> {partition: [DataFrame]}
+        self.clos = {res: {} for res in RESOLUTIONS}
+        # historique complet par résolution, lu à la demande
+        self._tables = {}
+
+    def path(self, res, partition):
+        return os.path.join(self.root, res, f'{partition}.parquet')
+
+    def get_partitions(self, res):
+        """ Partitions enregistrées des intervalles clos de `res` : {début: fichier}"""
+
+        dossier = os.path.join(self.root, res)
+        if not os.path.isdir(dossier):
+            return {}
+        return {f[:-len('.parquet')]: os.path.join(dossier, f) for f in sorted(os.listdir(dossier))
+                if f.endswith('.parquet') and f != f'{OUVERT}.parquet'}
+
+    def get_partition(self, buckets, res):
+        """ Début de la partition de chaque intervalle (str, FORMAT_PARTITION)"""
+
+        # calculé sur les intervalles distincts
+        uniques = pd.Series(buckets.unique(), dtype=buckets.dtype)
+        debuts = uniques.dt.to_period(PARTITIONS[res]).dt.start_time.dt.strftime(FORMAT_PARTITION)
+        return buckets.map(dict(zip(uniques, debuts)))
+
+    def read(self, path):
+        if os.path.exists(path):
+            return pd.read_parquet(path)
+        table = {'bucket': pd.Series(dtype='datetime64[ns]')}
+        table.update({key: pd.Series(dtype=str) for key in self.keys})
+        table.update({agg: pd.Series(dtype='float64') for agg in AGGREGATS})
+        return pd.DataFrame(table)
+
+    def write(self, path, table):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        table.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+    def merge(self, table):
+        """ Fusionne les lignes d'un même (intervalle, entité) : min, max, somme et nombre restent exacts"""
+
+        return (table.groupby(['bucket'] + self.keys, observed=True).agg(FUSION)
+                     .reset_index().sort_values('bucket', kind='stable', ignore_index=True))
+
+    @property
+    def tables(self):
+        """ Historique complet par résolution (partitions enregistrées, clos en attente, ouverts)"""
+
+        with self._lock:
+            for res in RESOLUTIONS:
+                if res not in self._tables:
+                    parts = [pd.read_parquet(path) for path in self.get_partitions(res).values()]
+                    parts += [frame for frames in self.clos[res].values() for frame in frames]
+                    parts.append(self.ouverts[res])
+                    self._tables[res] = pd.concat(parts, ignore_index=True)
+            return dict(self._tables)
+
+    def empty(self):
+        return all(table.empty for table in self.ouverts.values())
+
+    def add(self, rows):
+        """ Input = lignes nettoyées (dateTime, clés, valeur)
+            Met à jour les intervalles ouverts des trois résolutions : le coût ne dépend
+            pas de l'historique conservé. Les intervalles antérieurs au dernier reçu sont clos."""
+
+        if rows.empty:
+            return
+        with self._lock:
+            for res, size in RESOLUTIONS.items():
+                new = (rows.assign(bucket=rows['dateTime'].dt.floor(size))
+                           .groupby(['bucket'] + self.keys, observed=True)[self.value]
+                           .agg(AGGREGATS).reset_index())
+                new[self.keys] = new[self.keys].astype(str)
+                new['count'] = new['count'].astype('float64')
+                ouverts = self.merge(pd.concat([self.ouverts[res], new], ignore_index=True))
+                dernier = ouverts['bucket'] >= ouverts['bucket'].max()
+                clos = ouverts[~dernier]
+                self.ouverts[res] = ouverts[dernier].reset_index(drop=True)
+                # relevé en retard sur un intervalle déjà clos : ligne ajoutée, fusionnée à l'enregistrement
+                for partition, part in clos.groupby(self.get_partition(clos['bucket'], res)):
+                    self.clos[res].setdefault(partition, []).append(part)
+            self._tables.clear()
+
+    def apply_retention(self, now=None):
+        """ Supprime les partitions entièrement plus anciennes que la durée de conservation"""
+
+        for res in RESOLUTIONS:
+            if self.retention.get(res) is None:
+                continue
+            horizon = (now or self.ouverts[res]['bucket'].max()) - self.retention[res]
+            if pd.isna(horizon):
+                continue
+            for partition, path in self.get_partitions(res).items():
+                debut = pd.Timestamp(dt.datetime.strptime(partition, FORMAT_PARTITION))
+                if (pd.Period(debut, PARTITIONS[res]) + 1).start_time <= horizon:
+                    os.remove(path)
+        with self._lock:
+            self._tables.clear()
+
+    def save(self):
+        """ Enregistre les intervalles clos depuis le dernier enregistrement (dans leur
+            partition) et les intervalles ouverts, puis applique la conservation"""
+
+        with self._lock:
+            clos, self.clos = self.clos, {res: {} for res in RESOLUTIONS}
+            ouverts = dict(self.ouverts)
+        for res in RESOLUTIONS:
+            for partition, frames in clos[res].items():
+                path = self.path(res, partition)
+                self.write(path, self.merge(pd.concat([self.read(path)] + frames, ignore_index=True)))
+            self.write(self.path(res, OUVERT), ouverts[res])
+        self.apply_retention()
+
+    def choose_resolution(self, granularity, start=None):
+        """ Résolution la plus grossière dont les intervalles ne dépassent pas `granularity`
+            et (si possible) dont la conservation couvre la période depuis `start`"""
+
+        candidates = [res for res, size in reversed(RESOLUTIONS.items()) if size <= granularity]
+        for res in candidates:
+            table = self.tables[res]
+            if not table.empty and (start is None or table['bucket'].min() <= start):
+                return res
+        return candidates[0]
+
+    def slice(self, by, start=None, **filters):
+        """ Moyenne (exacte) du taux regroupée par `by` parmi jour, heure et les clés de l'entité,
+            pour les lignes vérifiant `filters`. Retourne un DataFrame comme Cube.slice()"""
+
+        granularity = RESOLUTIONS['hour'] if 'heure' in by or 'heure' in filters else RESOLUTIONS['day']
+        res = self.choose_resolution(granularity, start)
+        data = self.tables[res]
+        if start is not None:
+            data = data[data['bucket'] >= start]
+        data = data.assign(jour=pd.Categorical.from_codes(data['bucket'].dt.weekday, categories=historique.JOURS,
+                                                          ordered=True),
+                           heure=data['bucket'].dt.hour)
+        for key, value in filters.items():
+            data = data[data[key] == value]
+        data = data.groupby(by, observed=True).agg({'min': 'min', 'max': 'max', 'sum': 'sum', 'count': 'sum'})
+        data[self.value] = data['sum'] / data['count']
+        return data[[self.value, 'min', 'max']].reset_index()
+
+    def entities(self, key):
+        """ Valeurs distinctes de la clé `key`, triées"""
+
+        return sorted(self.tables['day'][key].unique())
+
+    def weekdays(self):
+        """ Jours de la semaine (0 = lundi) présents dans l'historique"""
+
+        return set(self.tables['day']['bucket'].dt.weekday.unique().tolist())
+
+    def period(self):
+        """ Premier et dernier jour de l'historique (Timestamp)"""
+
+        days = self.tables['day']['bucket']
+        return days.min(), days.max()
+
+
+def get_rollups(name, root=ROLLUPS_DIR):
+    """ Agrégats du flux collecté `name` (clé de FLUX)"""
+
+    return Rollups(os.path.join(root, name), FLUX[name][1])
+
+
+def get_historique(name, get_cube):
+    """ Agrégats de la collecte continue s'ils couvrent les sept jours de la semaine,
+        sinon le cube de janvier 2022 (un jour pas encore collecté donnerait des graphiques vides)"""
+
+    rollups = get_rollups(name)
+    if rollups.empty() or len(rollups.weekdays()) < len(historique.JOURS):
+        return get_cube()
+    return rollups
+
+
+def get_historique_parcs_relais():
+    return get_historique('parcs_relais', cubes.get_cube_parcs_relais)
+
+
+def get_historique_velov():
+    return get_historique('velov', cubes.get_cube_velov)
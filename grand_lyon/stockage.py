@@ -0,0 +1,63 @@
+""" Stockage en ajout seul, partitionné par jour, des relevés temps réel.
+
+    Arborescence :  <racine>/date=AAAA-MM-JJ/part-<horodatage>-<id>.parquet
+    Chaque écriture produit un nouveau fichier, écrit sous un nom temporaire
+    puis renommé : un lecteur ne voit jamais de fichier incomplet, et un arrêt
+    brutal du collecteur ne corrompt pas les données déjà écrites."""
+
+import glob
+import os
+import time
+import uuid
+
+import pandas as pd
+
+
+class Store:
+    """ Relevés d'un flux (DataFrame avec une colonne `timestamp`), partitionnés par jour"""
+
+    def __init__(self, root, time_col='timestamp'):
+        self.root = root
+        self.time_col = time_col
+
+    def partition(self, day):
+        return os.path.join(self.root, f'date={day}')
+
+    def days(self):
+        """ Jours présents dans le stockage, triés (AAAA-MM-JJ)"""
+
+        return sorted(os.path.basename(p)[len('date='):] for p in glob.glob(os.path.join(self.root, 'date=*')))
+
+    def append(self, df):
+        """ Ajoute des lignes : un fichier par jour concerné
+            Retourne la liste des fichiers écrits"""
+
+        if df.empty:
+            return []
+        files = []
+        days = pd.to_datetime(df[self.time_col]).dt.strftime('%Y-%m-%d')
+        for day, part in df.groupby(days.to_numpy()):
+            folder = self.partition(day)
+            os.makedirs(folder, exist_ok=True)
+            filename = os.path.join(folder, f'part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet')
+            part.to_parquet(filename + '.tmp', index=False)
+            os.replace(filename + '.tmp', filename)
+            files.append(filename)
+        return files
+
+    def files(self, start=None, end=None):
+        """ Fichiers des jours compris entre `start` et `end` (AAAA-MM-JJ, inclus)"""
+
+        files = []
+        for day in self.days():
+            if (start is None or day >= start) and (end is None or day <= end):
+                files += sorted(glob.glob(os.path.join(self.partition(day), 'part-*.parquet')))
+        return files
+
+    def read(self, start=None, end=None, columns=None):
+        """ Relit les lignes des jours compris entre `start` et `end`"""
+
+        files = self.files(start, end)
+        if not files:
+            return pd.DataFrame(columns=columns)
+        return pd.concat([pd.read_parquet(f, columns=columns) for f in files], ignore_index=True)
@@ -0,0 +1,57 @@
+""" Flux temps réel du Grand Lyon (Vélo'v, parcs relais), sous forme de DataFrame.
+
+    Fonctions sans dépendance à Streamlit : utilisées par le dashboard et par
+    le collecteur d'historique (grand_lyon.collecteur)."""
+
+import datetime as dt
+
+import pandas as pd
+import pytz
+
+from grand_lyon import api
+from grand_lyon.metriques import etape, instrumente
+
+
+def get_timestamp():
+    """ Heure de la requête, à la seconde, heure de Paris"""
+
+    return dt.datetime.now(pytz.timezone('Europe/Paris')).replace(microsecond=0)
+
+
+@instrumente
+def get_df_velov_tr():
+    """ Récupère les disponibilités en temps réel des Vélo'v depuis l'API du Grand Lyon
+        Retourne un DataFrame """
+
+    data = api.get_json(api.ws_url('velov_tr'))
+    with etape('json_normalize') as mesure:
+        bikes = pd.json_normalize(data, record_path='values')
+        mesure.lignes(sortie=len(bikes))
+
+    # insertion d'un timestamp
+    bikes.insert(0, 'timestamp', get_timestamp())
+
+    columns_to_keep = ['timestamp', 'number', 'address', 'availability', 'available_bike_stands',
+                       'available_bikes', 'bike_stands', 'lat', 'lng', 'name', 'commune', 'status', 'last_update']
+
+    with etape('nettoyage'):
+        bikes = bikes[columns_to_keep]
+
+        # transformer les colonnes de coordonnées en float
+        bikes['lat'] = bikes['lat'].astype('float64')
+        bikes['lng'] = bikes['lng'].astype('float64')
+
+    return bikes
+
+
+@instrumente
+def get_df_parcs_relais_tr():
+    """ Récupère l'occupation en temps réel des parcs relais depuis l'API du Grand Lyon
+        Retourne un DataFrame (mêmes colonnes que data_grand_lyon/parcs_relais.csv)"""
+
+    data = api.get_json(api.ws_url('parcs_relais_tr'))
+    with etape('json_normalize'):
+        parcs = pd.json_normalize(data, record_path='values')
+    parcs.insert(0, 'timestamp', get_timestamp())
+
+    return parcs
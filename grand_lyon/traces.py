@@ -0,0 +1,279 @@
+""" Carte de l'ensemble du réseau TCL (bus, tram, métro, funiculaires).
+
+    Les tracés ne changent que quelques fois par an : la carte est construite une
+    seule fois par version des données, puis servie depuis le fichier html déjà
+    généré, lu une seule fois et gardé en mémoire (grand_lyon.rendu). La version
+    est une empreinte des `last_update` des features (ou de leur contenu si ce
+    champ manque) ; elle est notée dans un manifeste json.
+
+    Les tracés sont découpés en tuiles vectorielles (grand_lyon.tuiles) : la
+    carte ne contient plus de géométrie, le navigateur ne télécharge que les
+    tuiles visibles. La version TopoJSON (grand_lyon.geometrie : quantification,
+    fusion des tronçons communs, simplification) n'est plus calculée que pour la
+    comparaison (--mesure).
+
+    Construction manuelle :   python -m grand_lyon.traces [--force]
+    Comparaison avec les tracés bruts (octets, points, temps d'affichage) :
+                              python -m grand_lyon.traces --mesure"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import folium
+
+from grand_lyon import geometrie, tuiles, wfs
+from grand_lyon.cache import fetch_cache
+from grand_lyon.cache_http import cache_http
+from grand_lyon.rendu import render_cache
+
+
+DATA_DIR = 'data_grand_lyon'
+MANIFEST = os.path.join(DATA_DIR, 'map_all_traces.json')
+# délai entre deux vérifications de la version en ligne (secondes)
+CHECK_INTERVAL = 3600
+
+color_red_st = '#FF4B4B'        # rouge par défaut sur Streamlit
+
+_build_lock = threading.Lock()
+
+
+def get_lines_dict(layers):
+    """ Regroupe les features par moyen de transport"""
+
+    traces_metro = layers['metro']
+    lines_dict = {}
+    lines_dict['Bus'] = layers['bus']
+    lines_dict['Tramway'] = layers['tram']
+    lines_dict['Métro'] = [t for t in traces_metro if t['properties']['famille_transport']=='MET']
+    lines_dict['Funiculaire'] = [t for t in traces_metro if t['properties']['famille_transport']=='FUN']
+    return lines_dict
+
+
+def get_version(layers):
+    """ Empreinte des données : change dès qu'une feature est ajoutée, retirée ou mise à jour"""
+
+    h = hashlib.sha1()
+    for layer in sorted(layers):
+        for feature in layers[layer]:
+            props = feature['properties']
+            if props.get('last_update'):
+                key = [props.get('code_ligne'), props.get('gid'), props['last_update']]
+            else:
+                key = feature
+            h.update(json.dumps(key, sort_keys=True, default=str).encode('utf-8'))
+        h.update(layer.encode('utf-8'))
+    return h.hexdigest()[:12]
+
+
+# script ajouté aux cartes de mesure : temps écoulé jusqu'au premier affichage des tracés
+PAINT_TIMING = """
+requestAnimationFrame(function () { requestAnimationFrame(function () {
+    var ms = Math.round(performance.now());
+    console.log('traces : premier affichage après ' + ms + ' ms');
+    document.title = 'affichage ' + ms + ' ms';
+}); });
+"""
+
+
+def get_geometries(lines_dict):
+    """ Géométries de chaque moyen de transport, une par code_ligne"""
+
+    geometries_dict = {}
+    for transport_type, lines in lines_dict.items():
+        geometries = {}
+        for line in lines:
+            geometries.setdefault(line['properties']['code_ligne'], line['geometry'])
+        geometries_dict[transport_type] = list(geometries.values())
+    return geometries_dict
+
+
+def get_topologies(lines_dict):
+    """ Un topology TopoJSON par moyen de transport"""
+
+    return {transport_type: geometrie.get_topology(geometries, zoom=geometrie.ZOOM_COUCHES[transport_type])
+            for transport_type, geometries in get_geometries(lines_dict).items()}
+
+
+def build_map(lines_dict, topologies=None, version_tuiles=None, url_tuiles=tuiles.TUILES_URL, mesure=False):
+    """ Construit la carte Folium des tracés : tuiles vectorielles de la version `version_tuiles`,
+        sinon topologies si elles sont fournies, sinon une couche GeoJSON par ligne à pleine résolution
+        mesure=True : ajoute le temps de premier affichage dans le titre de la page
+        Retourne la carte"""
+
+    # paramétrage :
+    centre = [45.75540611072912, 4.842535168843551]      # Guillotière
+    map = folium.Map(location=centre, zoom_start=13, tiles=None)
+    map.add_child(folium.TileLayer('Cartodb dark_matter'))
+    map.add_child(folium.TileLayer('Cartodb Positron'))
+
+    # 0075bf bleu B
+    # bleu turquoise #00C4B3
+    # tram #8c368c
+    # funiculaire #95c23d
+
+    for transport_type, lines in lines_dict.items():
+        fg = folium.FeatureGroup(name=transport_type)
+
+        # tracés des bus plus fins, et par défaut non affichés :
+        if transport_type == 'Bus':
+            fg = folium.FeatureGroup(name=transport_type, show=False)
+            style_function = lambda x: {'color': '#00C4B3', 'weight': 1}
+        elif transport_type == 'Tramway':
+            style_function = lambda x : {'color' : '#0075bf', 'weight' : 3}
+        elif transport_type == 'Funiculaire':
+            style_function = lambda x: {'color': '#95c23d', 'weight': 3}
+        elif transport_type == 'Métro':
+            style_function = lambda x : {'color' : color_red_st, 'weight' : 3}
+
+        if version_tuiles is not None:
+            tuiles.TuilesVectorielles(tuiles.get_url(version_tuiles, transport_type, url_tuiles), style_function(None),
+                                      name=transport_type, show=transport_type != 'Bus').add_to(map)
+            continue
+        if topologies is not None:
+            folium.TopoJson(topologies[transport_type], 'objects.traces', style_function=style_function,
+                            name=transport_type, show=transport_type != 'Bus').add_to(map)
+            continue
+
+        map.add_child(fg)
+        code_lignes = []
+
+        for line in lines:
+            code_ligne = line['properties']['code_ligne']
+            if code_ligne not in code_lignes:
+                code_lignes.append(code_ligne)
+                gjson = folium.features.GeoJson(line['geometry'],
+                                                style_function = style_function)
+                fg.add_child(gjson)
+
+    folium.LayerControl().add_to(map)
+    if mesure:
+        map.get_root().script.add_child(folium.Element(PAINT_TIMING))
+
+    return map
+
+
+def read_manifest():
+    """ Retourne le manifeste de la dernière construction, ou None"""
+
+    try:
+        with open(MANIFEST, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(manifest):
+    tmp = MANIFEST + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, MANIFEST)
+
+
+def build(force=False):
+    """ Télécharge les tracés et (re)construit la carte si leur version a changé
+        Retourne le nom du fichier html (str)"""
+
+    with _build_lock:
+        layers = wfs.get_layers(['tram', 'bus', 'metro'])
+        version = get_version(layers)
+        manifest = read_manifest()
+
+        if not force and manifest and manifest['version'] == version and os.path.exists(manifest['filename']):
+            manifest['checked_at'] = time.time()
+            write_manifest(manifest)
+            return manifest['filename']
+
+        lines_dict = get_lines_dict(layers)
+        tuiles.build(get_geometries(lines_dict), version)
+        tuiles.remove_others(version)
+
+        filename = os.path.join(DATA_DIR, f'map_all_traces_{version}.html')
+        tmp = filename + '.tmp'
+        build_map(lines_dict, version_tuiles=version).save(tmp)
+        os.replace(tmp, filename)
+
+        # suppression de l'ancienne version (et du TopoJSON des constructions précédentes)
+        if manifest and manifest['filename'] != filename:
+            for old in [manifest['filename'], manifest.get('topology')]:
+                if old and os.path.exists(old):
+                    os.remove(old)
+
+        write_manifest({'version': version, 'filename': filename, 'checked_at': time.time()})
+        return filename
+
+
+def get_map_file():
+    """ Retourne le fichier html de la carte, sans rien télécharger
+        si la version a été vérifiée il y a moins de CHECK_INTERVAL secondes"""
+
+    manifest = read_manifest()
+    if (manifest and os.path.exists(manifest['filename'])
+            and time.time() - manifest['checked_at'] < CHECK_INTERVAL):
+        return manifest['filename']
+    return build()
+
+
+def read_html(filename):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def get_map_html():
+    """ Retourne le html de la carte (str), lu sur le disque une seule fois par version"""
+
+    filename = get_map_file()
+    return render_cache.get(('traces', filename), lambda: read_html(filename))
+
+
+def invalidate():
+    """ Force un nouveau téléchargement des tracés et une reconstruction
+        de la carte à la prochaine demande"""
+
+    for layer in ['tram', 'bus', 'metro']:
+        fetch_cache.invalidate(f'wfs.{layer}')
+        cache_http.invalidate(f'wfs.{layer}')
+    with _build_lock:
+        manifest = read_manifest()
+        if manifest:
+            manifest['checked_at'] = 0
+            manifest['version'] = None
+            write_manifest(manifest)
+
+
+def mesure(layers=None):
+    """ Construit la carte avec les tracés bruts, en TopoJSON et en tuiles vectorielles,
+        chacune avec le temps de premier affichage dans son titre. Pour les ouvrir dans un
+        navigateur : `python -m http.server` à la racine du dépôt, puis /data_grand_lyon/...
+        Retourne {variante: (fichier, octets téléchargés pour la vue initiale, points)}
+        (tuiles : html + tuiles visibles au zoom de départ, bus affichés compris)"""
+
+    lines_dict = get_lines_dict(layers or wfs.get_layers(['tram', 'bus', 'metro']))
+    topologies = get_topologies(lines_dict)
+    tuiles.build(get_geometries(lines_dict), 'mesure')
+    points_bruts = sum(len(coords) for lines in lines_dict.values() for line in lines
+                       for coords in geometrie.get_lines(line['geometry']))
+    resultats = {}
+    for variante, topo, version, points in [
+            ('brut', None, None, points_bruts),
+            ('topojson', topologies, None, sum(map(geometrie.count_points, topologies.values()))),
+            ('tuiles', None, 'mesure', None)]:
+        filename = os.path.join(DATA_DIR, f'map_all_traces_mesure_{variante}.html')
+        build_map(lines_dict, topo, version, url_tuiles='../' + tuiles.TUILES_DIR, mesure=True).save(filename)
+        octets = os.path.getsize(filename)
+        if version is not None:
+            octets += sum(tuiles.get_view_bytes(version, couche, [45.75540611072912, 4.842535168843551], 13)
+                          for couche in lines_dict)
+        resultats[variante] = (filename, octets, points)
+    return resultats
+
+
+if __name__ == '__main__':
+    if '--mesure' in sys.argv[1:]:
+        for variante, (filename, octets, points) in mesure().items():
+            print(f'{variante:10} {octets / 1e6:8.2f} Mo {points or 0:9d} points   {filename}')
+    else:
+        print(build(force='--force' in sys.argv[1:]))
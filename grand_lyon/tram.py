@@ -0,0 +1,94 @@
+""" Nettoyage des prochains passages de tramway (flux tcl_sytral.tclpassagearret).
+
+    Les corrections de lignes et les exclusions sont décrites par des tables de
+    règles, appliquées avec des masques vectorisés sur le flux brut normalisé
+    (une ligne par passage, tout le réseau TCL).
+
+    read_passages lit le flux au fil de sa réception et ne garde que les
+    passages des lignes de tram, réduits aux colonnes utiles : la mémoire et le
+    temps de lecture suivent le nombre de passages de tram, pas la taille du réseau."""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from grand_lyon import flux_json
+
+
+LIGNES_TRAM = ['T1', 'T2', 'T3', 'T4', 'T5', 'T6', 'T7']
+
+# (ligne contient, direction contient) -> ligne corrigée
+# la première règle qui s'applique l'emporte
+TRAM_CORRECTIONS = [('T1', 'Mermoz', 'T6'),
+                    ('T1', 'Perrache', 'T2'),
+                    ('T1', 'Meyzieu', 'T3'),
+                    ('T4', 'Gare Part-Dieu', 'T3'),
+                    ('T4', 'Meyzieu', 'T3')]
+
+# (ligne, direction) supprimées après correction
+TRAM_EXCLUSIONS = [('T2', 'Porte des Alpes'),
+                   ('T2', 'Perrache'),
+                   ('T2', 'Grange Blanche')]
+
+COLONNES_INUTILES = ['coursetheorique', 'gid', 'idtarretdestination', 'last_update_fme', 'type']
+# colonnes gardées par read_passages
+COLONNES = ['delaipassage', 'direction', 'heurepassage', 'id', 'ligne']
+# pré-filtre sur le texte brut d'un passage : ligne contenant un 'T'
+_LIGNE_T = re.compile(r'"ligne"\s*:\s*"[^"]*T')
+
+
+def is_ligne_t(record):
+    ligne = record.get('ligne')
+    return isinstance(ligne, str) and 'T' in ligne
+
+
+def read_passages(chunks):
+    """ Input = réponse brute du flux des passages, par morceaux (api.get_chunks)
+        Retourne le DataFrame des passages des lignes contenant un 'T' (colonnes COLONNES),
+        à nettoyer par clean_passages"""
+
+    records = flux_json.iter_records(chunks, 'values', filtre=_LIGNE_T.search)
+    return pd.DataFrame(flux_json.get_colonnes(records, COLONNES, garder=is_ligne_t), columns=COLONNES)
+
+
+def correct_lignes(ligne, direction, corrections=TRAM_CORRECTIONS):
+    """ Applique la table de corrections, retourne la Series des lignes corrigées"""
+
+    if not corrections:
+        return ligne
+    masks = [ligne.str.contains(l, regex=False, na=False) & direction.str.contains(d, regex=False, na=False)
+             for l, d, _ in corrections]
+    values = [corrected for _, _, corrected in corrections]
+    return pd.Series(np.select(masks, values, ligne), index=ligne.index)
+
+
+def clean_passages(passages, corrections=TRAM_CORRECTIONS, exclusions=TRAM_EXCLUSIONS):
+    """ Input = DataFrame brut des passages (tout le réseau)
+        Retourne les passages de tramway nettoyés, un seul (le prochain) par ligne/direction/arrêt"""
+
+    # filtrage précoce : toute ligne de tram contient un 'T' (avant comme après correction)
+    passages = passages[passages['ligne'].str.contains('T', regex=False, na=False)]
+
+    ligne = correct_lignes(passages['ligne'], passages['direction'], corrections)
+    ligne = ligne.str.replace('A', '', regex=False)
+    direction = passages['direction'].str.strip()
+
+    garder = ligne.isin(LIGNES_TRAM)
+    for l, d in exclusions:
+        garder &= ~((ligne == l) & (direction == d))
+
+    passages = passages[garder].drop(columns=COLONNES_INUTILES, errors='ignore')
+    passages['ligne'] = ligne[garder]
+    passages['direction'] = direction[garder]
+    # transformation en format date
+    passages['heurepassage'] = pd.to_datetime(passages['heurepassage'])
+    passages['delaipassage'] = passages['delaipassage'].replace('Proche', '0 min')
+
+    # prochain passage uniquement
+    passages['concat'] = passages['ligne'] + ' - ' + passages['direction'] + ' - ' + passages['id'].astype(str)
+    passages = passages.sort_values(['concat', 'heurepassage']).drop_duplicates(subset=['concat'])
+
+    passages.reset_index(inplace=True, drop=True)
+
+    return passages
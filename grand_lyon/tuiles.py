@@ -0,0 +1,214 @@
+""" Tuiles vectorielles pré-découpées des tracés (bus, tram, métro, funiculaires).
+
+    Pour chaque moyen de transport et chaque niveau de zoom entre MIN_ZOOM et
+    MAX_ZOOM, les tracés sont projetés (Web Mercator), ramenés sur une grille de
+    EXTENT unités par tuile (un demi-pixel), fusionnés et simplifiés comme dans
+    grand_lyon.geometrie, puis découpés en tuiles de 256 pixels :
+
+        static/tuiles/<version>/<couche>/<z>/<x>/<y>.json
+
+    Une tuile est une liste de lignes, chacune en entiers relatifs au coin de la
+    tuile, en différences successives : [x0, y0, dx1, dy1, ...]. Seules les
+    tuiles traversées par une ligne sont écrites.
+
+    Les fichiers sont servis par Streamlit (server.enableStaticServing, voir
+    .streamlit/config.toml) ; la carte des tracés les charge avec une couche
+    Leaflet (TuilesVectorielles) qui ne télécharge que les tuiles visibles et les
+    dessine sur un canvas. Au-delà de MAX_ZOOM, les tuiles MAX_ZOOM sont agrandies."""
+
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+from jinja2 import Template
+from folium.map import Layer
+
+from grand_lyon import geometrie
+
+
+STATIC_DIR = 'static'
+TUILES_DIR = os.path.join(STATIC_DIR, 'tuiles')
+# URL des tuiles (service des fichiers statiques de Streamlit)
+TUILES_URL = '/app/static/tuiles'
+
+MIN_ZOOM = 10
+MAX_ZOOM = 16
+TILE_SIZE = 256
+EXTENT = 512                # unités par tuile : 2 par pixel
+BUFFER = 4                  # marge (unités) autour de chaque tuile
+
+
+def get_pixels(coords, zoom):
+    """ [lon, lat] -> coordonnées entières (unités de tuile) dans le monde au niveau `zoom`"""
+
+    coords = np.asarray(coords, dtype='float64')[:, :2]
+    taille = EXTENT * 2 ** zoom
+    x = (coords[:, 0] + 180) / 360 * taille
+    lat = np.radians(coords[:, 1])
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * taille
+    points = np.rint(np.c_[x, y]).astype('int64')
+    if len(points) > 1:
+        points = points[np.r_[True, (np.diff(points, axis=0) != 0).any(axis=1)]]
+    return [tuple(p) for p in points.tolist()]
+
+
+def cut(arc, tiles):
+    """ Découpe un arc (points entiers) en morceaux par tuile, ajoutés à `tiles` {(x, y): [lignes]}.
+        Un segment est ajouté à toutes les tuiles que touche sa boîte englobante (+ BUFFER)."""
+
+    derniers = {}
+    for i, (a, b) in enumerate(zip(arc[:-1], arc[1:])):
+        x0, x1 = (min(a[0], b[0]) - BUFFER) // EXTENT, (max(a[0], b[0]) + BUFFER) // EXTENT
+        y0, y1 = (min(a[1], b[1]) - BUFFER) // EXTENT, (max(a[1], b[1]) + BUFFER) // EXTENT
+        for tx in range(x0, x1 + 1):
+            for ty in range(y0, y1 + 1):
+                lignes = tiles.setdefault((tx, ty), [])
+                if derniers.get((tx, ty)) == i - 1:
+                    lignes[-1].append(b)
+                else:
+                    lignes.append([a, b])
+                derniers[(tx, ty)] = i
+
+
+def encode_tile(lignes, tx, ty):
+    """ Lignes d'une tuile -> listes plates [x0, y0, dx1, dy1, ...] relatives au coin de la tuile"""
+
+    origine = np.array([tx * EXTENT, ty * EXTENT], dtype='int64')
+    return [geometrie.encode_arc(np.asarray(ligne) - origine) for ligne in lignes]
+
+
+def get_tiles(geometries, zoom):
+    """ Input = géométries GeoJSON d'une couche
+        Retourne {(x, y): lignes encodées} au niveau `zoom`"""
+
+    lines = [get_pixels(coords, zoom) for g in geometries for coords in geometrie.get_lines(g) if len(coords) > 1]
+    lines = [line for line in lines if len(line) > 1]
+    tiles = {}
+    for arc in geometrie.get_arcs(lines):
+        cut(geometrie.simplify(arc, 1, ratio_x=1), tiles)
+    return {key: [[v for point in ligne for v in point] for ligne in encode_tile(lignes, *key)]
+            for key, lignes in tiles.items()}
+
+
+def build(geometries_dict, version, root=TUILES_DIR):
+    """ Input = {couche: géométries GeoJSON}
+        Écrit les tuiles de toutes les couches dans <root>/<version>/
+        Retourne {couche: (nombre de tuiles, octets)}"""
+
+    tmp = os.path.join(root, f'{version}.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    stats = {}
+    for couche, geometries in geometries_dict.items():
+        n, octets = 0, 0
+        for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+            for (tx, ty), lignes in get_tiles(geometries, zoom).items():
+                folder = os.path.join(tmp, get_couche(couche), str(zoom), str(tx))
+                os.makedirs(folder, exist_ok=True)
+                data = json.dumps(lignes, separators=(',', ':'))
+                with open(os.path.join(folder, f'{ty}.json'), 'w', encoding='utf-8') as f:
+                    f.write(data)
+                n += 1
+                octets += len(data)
+        stats[couche] = (n, octets)
+
+    # remplacement de la version publiée
+    final = os.path.join(root, version)
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+    return stats
+
+
+def remove_others(version, root=TUILES_DIR):
+    """ Supprime les tuiles des autres versions"""
+
+    for old in os.listdir(root):
+        if old != version:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+def get_view_bytes(version, couche, centre, zoom, width=1280, height=800, root=TUILES_DIR):
+    """ Octets des tuiles de `couche` téléchargées pour afficher une vue de width x height pixels
+        centrée sur `centre` [lat, lon] au niveau `zoom` (<= MAX_ZOOM)"""
+
+    cx, cy = get_pixels([[centre[1], centre[0]]], zoom)[0]
+    unites = EXTENT / TILE_SIZE
+    x0, x1 = int((cx - width / 2 * unites) // EXTENT), int((cx + width / 2 * unites) // EXTENT)
+    y0, y1 = int((cy - height / 2 * unites) // EXTENT), int((cy + height / 2 * unites) // EXTENT)
+    octets = 0
+    for tx in range(x0, x1 + 1):
+        for ty in range(y0, y1 + 1):
+            filename = os.path.join(root, version, get_couche(couche), str(zoom), str(tx), f'{ty}.json')
+            if os.path.exists(filename):
+                octets += os.path.getsize(filename)
+    return octets
+
+
+def get_couche(couche):
+    """ Nom de dossier d'une couche ('Métro' -> 'metro')"""
+
+    return couche.lower().replace('é', 'e')
+
+
+def get_url(version, couche, base=TUILES_URL):
+    return f'{base}/{version}/{get_couche(couche)}/{{z}}/{{x}}/{{y}}.json'
+
+
+class TuilesVectorielles(Layer):
+    """ Couche Leaflet des tuiles vectorielles d'un moyen de transport, dessinées sur canvas"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            if (!L.GridLayer.TuilesVectorielles) {
+                L.GridLayer.TuilesVectorielles = L.GridLayer.extend({
+                    createTile: function (coords, done) {
+                        var tile = document.createElement('canvas');
+                        var size = this.getTileSize();
+                        tile.width = size.x;
+                        tile.height = size.y;
+                        var style = this.options.style;
+                        var k = size.x / {{ this.extent }};
+                        fetch(L.Util.template(this.options.url, coords))
+                            .then(function (r) { return r.ok ? r.json() : []; })
+                            .then(function (lignes) {
+                                var ctx = tile.getContext('2d');
+                                ctx.strokeStyle = style.color;
+                                ctx.lineWidth = style.weight;
+                                ctx.lineJoin = 'round';
+                                ctx.lineCap = 'round';
+                                ctx.beginPath();
+                                lignes.forEach(function (l) {
+                                    var x = l[0], y = l[1];
+                                    ctx.moveTo(x * k, y * k);
+                                    for (var i = 2; i < l.length; i += 2) {
+                                        x += l[i];
+                                        y += l[i + 1];
+                                        ctx.lineTo(x * k, y * k);
+                                    }
+                                });
+                                ctx.stroke();
+                                done(null, tile);
+                            })
+                            .catch(function () { done(null, tile); });
+                        return tile;
+                    }
+                });
+            }
+            var {{ this.get_name() }} = new L.GridLayer.TuilesVectorielles({
+                url: {{ this.url|tojson }},
+                style: {{ this.style|tojson }},
+                minNativeZoom: {{ this.min_zoom }},
+                maxNativeZoom: {{ this.max_zoom }}
+            });
+        {% endmacro %}
+        """)
+
+    def __init__(self, url, style, name=None, show=True):
+        super().__init__(name=name, overlay=True, control=True, show=show)
+        self._name = 'TuilesVectorielles'
+        self.url = url
+        self.style = style
+        self.extent = EXTENT
+        self.min_zoom = MIN_ZOOM
+        self.max_zoom = MAX_ZOOM
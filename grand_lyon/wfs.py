@@ -0,0 +1,284 @@
+""" Client WFS des couches du Grand Lyon : projection, filtres et pagination côté serveur.
+
+    Chaque couche n'est demandée qu'avec les propriétés utilisées par le
+    dashboard (propertyName) et, si possible, filtrée par le serveur (filtre
+    FES 2.0 : famille_transport des lignes de métro, last_update des arrêts).
+    Les couches sont mises en cache par `fetch_cache` : une même couche n'est
+    téléchargée qu'une fois même si plusieurs fonctions (ou plusieurs sessions)
+    en ont besoin. Les grandes couches sont découpées en pages (startIndex / count)
+    téléchargées en parallèle : les PARALLELE premières pages sont demandées
+    d'emblée, la première réponse donne le nombre total de features
+    (numberMatched) et donc les pages restantes.
+
+    Les réponses sont lues en flux (grand_lyon.flux_json) : les features sont
+    projetées au fil de leur lecture, sans garder le texte ni les propriétés
+    écartées en mémoire.
+
+    Si le serveur refuse la requête, ne renvoie pas les géométries ou ignore la
+    pagination (page plus longue que `count`, startIndex sans effet), la couche
+    est téléchargée entière puis filtrée et projetée localement : le résultat est
+    le même.
+
+    Comparaison des octets transférés (requête complète / projetée et filtrée) :
+                              python -m grand_lyon.wfs [couches...]"""
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import json
+import logging
+import sys
+from urllib.parse import urlencode
+from xml.sax.saxutils import escape
+import xml.etree.ElementTree as ET
+
+import requests
+
+from grand_lyon import api, flux_json
+from grand_lyon.cache import fetch_cache
+
+
+# propriétés utilisées par le dashboard, par couche
+PROPRIETES = {'tram': ['ligne', 'code_ligne', 'nom_origine', 'nom_destination', 'gid', 'last_update'],
+              'bus': ['code_ligne', 'gid', 'last_update'],
+              'metro': ['code_ligne', 'famille_transport', 'gid', 'last_update'],
+              'arrets': ['id', 'nom', 'desserte', 'last_update']}
+# attribut géométrique, demandé avec les propriétés
+GEOMETRIE = 'the_geom'
+# filtres : ('=', propriété, valeur), ('>', propriété, valeur), ('ou', [filtres]), ('et', [filtres])
+FILTRES = {'metro': ('ou', [('=', 'famille_transport', 'MET'), ('=', 'famille_transport', 'FUN')])}
+# features par page (les tracés de bus sont lourds, les arrêts légers)
+PAGES = {'bus': 200, 'arrets': 1000}
+PAGE = 500
+# tri stable entre les pages
+TRI = 'gid'
+# pages demandées avant de connaître le nombre total de features
+PARALLELE = 4
+
+FES = 'http://www.opengis.net/fes/2.0'
+OPERATEURS = {'=': 'PropertyIsEqualTo', '>': 'PropertyIsGreaterThan', '<': 'PropertyIsLessThan'}
+LOGIQUES = {'ou': 'Or', 'et': 'And'}
+
+executor = ThreadPoolExecutor(max_workers=PARALLELE, thread_name_prefix='grand_lyon_wfs')
+logger = logging.getLogger(__name__)
+
+
+def to_fes(filtre):
+    """ Filtre (tuple) -> document XML FES 2.0 (str)"""
+
+    def element(f):
+        if f[0] in LOGIQUES:
+            return f'<fes:{LOGIQUES[f[0]]}>' + ''.join(element(g) for g in f[1]) + f'</fes:{LOGIQUES[f[0]]}>'
+        operateur, propriete, valeur = f
+        return (f'<fes:{OPERATEURS[operateur]}><fes:ValueReference>{propriete}</fes:ValueReference>'
+                f'<fes:Literal>{escape(str(valeur))}</fes:Literal></fes:{OPERATEURS[operateur]}>')
+
+    return f'<fes:Filter xmlns:fes="{FES}">{element(filtre)}</fes:Filter>'
+
+
+def from_fes(xml):
+    """ Document XML FES 2.0 -> filtre (tuple), pour les opérateurs de to_fes"""
+
+    operateurs = {v: k for k, v in OPERATEURS.items()}
+    logiques = {v: k for k, v in LOGIQUES.items()}
+
+    def lire(e):
+        tag = e.tag.split('}')[-1]
+        if tag in logiques:
+            return (logiques[tag], [lire(c) for c in e])
+        if tag in operateurs:
+            enfants = {c.tag.split('}')[-1]: c.text for c in e}
+            return (operateurs[tag], enfants['ValueReference'], enfants['Literal'])
+        raise ValueError(f"opérateur FES non pris en charge : {tag}")
+
+    racine = ET.fromstring(xml)
+    return lire(racine[0])
+
+
+def match(filtre, props):
+    """ Vrai si les propriétés `props` d'une feature satisfont le filtre"""
+
+    if filtre is None:
+        return True
+    if filtre[0] == 'ou':
+        return any(match(f, props) for f in filtre[1])
+    if filtre[0] == 'et':
+        return all(match(f, props) for f in filtre[1])
+    operateur, propriete, valeur = filtre
+    v = props.get(propriete)
+    if v is None:
+        return False
+    v = str(v)
+    return v == valeur if operateur == '=' else v > valeur if operateur == '>' else v < valeur
+
+
+def get_url(layer, proprietes=None, filtre=None, start=None, count=None):
+    """ URL GetFeature de la couche `layer` (clé de api.WFS_LAYERS) :
+        propriétés demandées, filtre, page [start, start + count)"""
+
+    params = {'SERVICE': 'WFS', 'VERSION': '2.0.0', 'request': 'GetFeature', 'typename': api.WFS_LAYERS[layer],
+              'outputFormat': 'application/json; subtype=geojson', 'SRSNAME': 'EPSG:4171'}
+    if proprietes:
+        params['propertyName'] = ','.join(list(proprietes) + [GEOMETRIE])
+    if filtre is not None:
+        params['FILTER'] = to_fes(filtre)
+    if count is not None:
+        params.update(startIndex=start or 0, count=count, sortBy=TRI)
+    return f"{api.BASE_URL}/wfs/rdata?{urlencode(params)}"
+
+
+def get_total(data):
+    """ Nombre de features de la requête entière (toutes pages), ou None s'il n'est pas donné"""
+
+    for key in ['numberMatched', 'totalFeatures']:
+        if isinstance(data.get(key), int):
+            return data[key]
+    return None
+
+
+def read_page(layer, proprietes, filtre, start, page):
+    """ Page [start, start + page) de la requête, lue en flux et projetée
+        Retourne (features, autres membres de la collection : numberMatched, numberReturned...)"""
+
+    membres = {}
+    records = flux_json.iter_records(api.get_chunks(get_url(layer, proprietes, filtre, start, page)), 'features',
+                                     membres=membres)
+    features = list(flux_json.project_features(records, proprietes) if proprietes else records)
+    return features, membres
+
+
+def get_cle(feature):
+    """ Identifiant d'une feature (gid), pour reconnaître une page déjà lue"""
+
+    props = feature.get('properties') or {}
+    if props.get(TRI) is not None:
+        return props[TRI]
+    return json.dumps(feature, sort_keys=True)
+
+
+def read_pages(layer, proprietes=None, filtre=None, page=None):
+    """ Features de la requête projetée et filtrée, par pages téléchargées en parallèle :
+        les PARALLELE premières pages d'emblée, les suivantes une fois le total connu
+        ValueError si le serveur ignore la pagination (page plus longue que `count`,
+        ou qui recommence une page déjà lue)"""
+
+    page = page or PAGES.get(layer, PAGE)
+
+    def submit(start):
+        return executor.submit(read_page, layer, proprietes, filtre, start, page)
+
+    futures = {start: submit(start) for start in range(0, PARALLELE * page, page)}
+    try:
+        total = get_total(futures[0].result()[1])
+        if total is not None:
+            futures.update({start: submit(start) for start in range(PARALLELE * page, total, page)})
+        features = []
+        vus = set()
+        start = 0
+        while total is None or start < total:
+            # nombre total inconnu : au-delà des premières pages, l'une après l'autre
+            future = futures.pop(start, None)
+            suite, membres = future.result() if future is not None else read_page(layer, proprietes, filtre,
+                                                                                  start, page)
+            if len(suite) > page or membres.get('numberReturned', len(suite)) != len(suite):
+                raise ValueError(f"pagination ignorée : {len(suite)} features pour count={page}")
+            if suite:
+                cle = get_cle(suite[0])
+                if cle in vus:
+                    raise ValueError(f"pagination ignorée : startIndex={start} recommence une page déjà lue")
+                vus.add(cle)
+            features += suite
+            if len(suite) < page:
+                break
+            start += page
+        return features
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+
+def read_layer(layer, proprietes=None, filtre=None):
+    """ Couche entière lue en flux, filtrée et projetée localement"""
+
+    records = flux_json.iter_records(api.get_chunks(api.wfs_url(layer)), 'features')
+    features = (feature for feature in records if match(filtre, feature.get('properties') or {}))
+    return list(flux_json.project_features(features, proprietes) if proprietes else features)
+
+
+def read_features(layer, proprietes=None, filtre=None, page=None):
+    """ Features de la couche `layer` réduites à `proprietes` et filtrées par `filtre`
+        (par défaut : PROPRIETES et FILTRES de la couche), lues en flux"""
+
+    proprietes = PROPRIETES.get(layer) if proprietes is None else proprietes
+    filtre = FILTRES.get(layer) if filtre is None else filtre
+    if not proprietes and filtre is None:
+        return read_layer(layer)
+    try:
+        features = read_pages(layer, proprietes, filtre, page)
+        if all(feature.get('geometry') is not None for feature in features):
+            return features
+        logger.warning("géométries absentes de la couche %s projetée : couche entière", layer)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.warning("requête WFS projetée refusée pour %s (%s) : couche entière", layer, e)
+    return read_layer(layer, proprietes, filtre)
+
+
+def get_features(layer):
+    """ Retourne la liste des features de la couche WFS `layer`, mise en cache.
+        Les features sont partagées : ne pas les modifier en place."""
+
+    return fetch_cache.get(f'wfs.{layer}', lambda: read_features(layer))
+
+
+def get_layers(layers):
+    """ Télécharge plusieurs couches WFS en parallèle
+        Retourne un dictionnaire {couche: features}"""
+
+    futures = {layer: api.executor.submit(get_features, layer) for layer in layers}
+    return {layer: future.result() for layer, future in futures.items()}
+
+
+def get_octets(url):
+    """ Télécharge `url` : octets transférés (compressés), octets du JSON, JSON décodé"""
+
+    r = api.get_session().get(url, timeout=api.TIMEOUT, stream=True)
+    r.raise_for_status()
+    with r:
+        brut = r.raw.read(decode_content=False)
+    texte = gzip.decompress(brut) if r.headers.get('Content-Encoding') == 'gzip' else brut
+    return len(brut), len(texte), json.loads(texte)
+
+
+def mesure(layers=None):
+    """ Octets transférés par couche : requête complète / requêtes projetées, filtrées et paginées
+        Retourne {couche: {'complet': (transférés, JSON, features), 'projete': (transférés, JSON, features)}}"""
+
+    resultats = {}
+    for layer in layers or PROPRIETES:
+        transferes, octets, data = get_octets(api.wfs_url(layer))
+        complet = (transferes, octets, len(data['features']))
+        page = PAGES.get(layer, PAGE)
+        projete = [0, 0, 0]
+        start = 0
+        while True:
+            transferes, octets, data = get_octets(get_url(layer, PROPRIETES.get(layer), FILTRES.get(layer),
+                                                          start, page))
+            n = len(data['features'])
+            projete = [projete[0] + transferes, projete[1] + octets, projete[2] + n]
+            if n < page:
+                break
+            start += page
+        resultats[layer] = {'complet': complet, 'projete': tuple(projete)}
+    return resultats
+
+
+def main():
+    print(f"{'couche':8} {'JSON complet':>13} {'JSON projeté':>13} {'réduction':>10} "
+          f"{'transféré':>10} {'transféré':>10} {'réduction':>10} {'features':>16}")
+    for layer, r in mesure(sys.argv[1:] or None).items():
+        (t1, j1, n1), (t2, j2, n2) = r['complet'], r['projete']
+        print(f"{layer:8} {j1 / 1e3:10.0f} ko {j2 / 1e3:10.0f} ko {1 - j2 / j1:10.0%} "
+              f"{t1 / 1e3:7.0f} ko {t2 / 1e3:7.0f} ko {1 - t2 / t1:10.0%} {n1:>7} -> {n2:<7}")
+
+
+if __name__ == '__main__':
+    main()
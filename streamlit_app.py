@@ -1,17 +1,23 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import requests
-import json
 import datetime as dt
-import folium
-from folium.plugins import MarkerCluster
 import streamlit.components.v1 as components
 from streamlit_option_menu import option_menu
-from fuzzywuzzy import fuzz
 import time
+import tracemalloc
 import pytz
 import plotly.express as px
+from grand_lyon.cache import fetch_cache
+from grand_lyon.cache_http import cache_http
+from grand_lyon.rendu import render_cache
+from grand_lyon import api, arrets, carte_live, historique, noms, prevision, proximite, rollups, traces, wfs
+from grand_lyon.metriques import EXPORT_FILE, EXPORT_URL, PUBLIQUE, RESERVOIR, etape, instrumente, metriques, \
+    tracer_memoire
+from grand_lyon.tram import clean_passages, read_passages
+from grand_lyon.temps_reel import get_df_parcs_relais_tr, get_df_velov_tr
 
 
 #Paramétrage
@@ -58,435 +64,205 @@ st.markdown(
 # BACK END
 
 # Authentification
-import base64
-from requests.auth import HTTPBasicAuth
-USERNAME = st.secrets["USERNAME"]
-PASSWORD = st.secrets["PASSWORD"]
-
-
-def get_request_json(r):
-    """ Retourne un DataFrame"""
-    df = pd.json_normalize(r.json(), record_path='values')
-    return df
-
-
-def get_request_geojson(r):
-    """ Retourne un DataFrame"""
-    df = pd.json_normalize(r.json(), record_path='features')
-    return df
-
-
-def get_df_velov_tr():
-    """ Récupère les disponibilités en temps réel des Vélo'v depuis l'API du Grand Lyon
-        Retourne un DataFrame """
-
-    link_velov = "https://download.data.grandlyon.com/ws/rdata/jcd_jcdecaux.jcdvelov/all.json?maxfeatures=-1&start=1"
-    r_velov = requests.get(link_velov)
-    bikes = get_request_json(r_velov)
-
-    # insertion d'un timestamp
-    t = [dt.datetime.now(pytz.timezone('Europe/Paris')).replace(microsecond=0) for i in range(len(bikes))]
-    s = pd.Series(t, name = 'timestamp')
-    bikes.insert(0, 'timestamp', s)
-
-    columns_to_keep = ['timestamp', 'address', 'availability', 'available_bike_stands',
-                       'available_bikes', 'bike_stands', 'lat', 'lng', 'name', 'status',]
-
-    bikes = bikes[columns_to_keep]
-
-    # transformer les colonnes de coordonnées en float
-    bikes['lat'] = bikes['lat'].astype('float64')
-    bikes['lng'] = bikes['lng'].astype('float64')
-
-    return bikes
-
-
-def get_map_velov_tr(df):
-    """  Input = DataFrame velov temps réel
-         Génère une carte Folium, l'exporte en html
-         Eetourne le nom du fichier (str)"""
-
-    centre = [45.7548790164649, 4.84367508189202]       # Guillotière
-    map_velov = folium.Map(location=centre, zoom_start=14)
-    map_velov.add_child(folium.TileLayer("cartodbpositron"))
-    velov_cluster = MarkerCluster(name="Velo'v cluster").add_to(map_velov)
-
-    # ajout marqueurs
-    for i in range(len(df)):
-        status = df.loc[i]['status']
-        # loc = bikes.loc[i]['point_coord']
-        loc = [df.loc[i]['lat'], df.loc[i]['lng']]
-        velos_dispo = df.loc[i]['available_bikes']
-        places_dispo = df.loc[i]['available_bike_stands']
-        availability = df.loc[i]['availability']
-        nom = df.loc[i]['name']
-        adresse = df.loc[i]['address']
-        max_width = 220
-        seuil_velo = 3
-
-        if velos_dispo > 1:
-            v_dispo = 'vélos disponibles'
-        else:
-            v_dispo = 'vélo disponible'
-        if places_dispo > 1:
-            p_dispo = 'places disponibles'
-        else:
-            p_dispo = 'place disponible'
-
-        if nom:
-            tip = folium.Tooltip(f"<b>{nom}</b><br>• {velos_dispo} {v_dispo}<br>• {places_dispo} {p_dispo}",)
-        else:
-            tip = folium.Tooltip(f"<b>{adresse}</b><br>• {velos_dispo} {v_dispo}<br>• {places_dispo} {p_dispo}",)
-
-        if status == 'CLOSED':
-            icon = folium.Icon(color='gray', icon='glyphicon-remove')
-            tip = folium.Tooltip(f"<b>{df.loc[i]['name']}</b><br>• STATION FERMÉE",)
-        else:
-            if not availability:
-                tip = folium.Tooltip(f"<b>{nom}</b><br>Données non disponibles",)
-                icon = folium.Icon(color='gray', icon="question-circle", prefix='fa')
-            else:
-                velos_dispo = int(df.loc[i]['available_bikes'])
-                places_dispo = int(df.loc[i]['available_bike_stands'])
-                if velos_dispo == 0:
-                    icon = folium.Icon(color='red', icon="glyphicon-ban-circle")
-                elif velos_dispo <= seuil_velo:
-                    icon = folium.Icon(color="orange", icon="glyphicon-exclamation-sign")
-                else:
-                    icon = folium.Icon(color='darkblue', icon="bicycle", prefix="fa")
-
-        folium.Marker(
-            location=loc,
-            icon=icon,
-            tooltip=tip,
-            ).add_to(velov_cluster)
-
-    filename = 'data_grand_lyon/map_velov.html'
-    map_velov.save(filename)
-
-    return filename
-
+def get_secret(name):
+    """ Secret Streamlit `name`, ou None (pas de secrets.toml : identifiants lus dans
+        l'environnement par grand_lyon.api, ou serveur de rejeu local sans authentification)"""
 
+    try:
+        return st.secrets[name]
+    except (FileNotFoundError, KeyError):
+        return None
+
+
+USERNAME = get_secret("USERNAME")
+PASSWORD = get_secret("PASSWORD")
+
+
+@instrumente
+def get_velov_proches(df, lat, lon, k=5, min_velos=1):
+    """ Input = DataFrame velov temps réel, position
+        Retourne les k stations ouvertes les plus proches avec au moins min_velos vélos (DataFrame)"""
+
+    index = proximite.get_index('velov', (df['timestamp'].iloc[0], len(df)), df['lat'], df['lng'])
+    velos = pd.to_numeric(df['available_bikes'], errors='coerce').fillna(0).to_numpy()
+    masque = (velos >= min_velos) & (df['status'] != 'CLOSED').to_numpy()
+    positions, distances = index.nearest(lat, lon, k, masque)
+
+    proches = df.iloc[positions][['number', 'name', 'available_bikes', 'available_bike_stands']]
+    proches = proches.rename(columns={'name': 'Station', 'available_bikes': 'Vélos', 'available_bike_stands': 'Places'})
+    proches.insert(1, 'Distance (m)', np.round(distances).astype(int))
+    return proches.reset_index(drop=True)
+
+
+@instrumente
+def get_arrets_proches(passages, lat, lon, rayon=400):
+    """ Input = prochains passages de tram, position
+        Retourne les arrêts TCL à moins de `rayon` mètres (DataFrame : nom, distance, desserte)
+        et les prochains passages de tram à ces arrêts (DataFrame)"""
+
+    table = arrets.get_arrets()
+    index = proximite.get_index('arrets', (len(table), table['last_update'].max()), table['lat'], table['lon'])
+    positions, distances = index.within(lat, lon, rayon)
+
+    proches = table.iloc[positions][['nom', 'desserte']].copy()
+    proches.insert(1, 'distance', np.round(distances).astype(int))
+    trams = passages.merge(proches[['distance']], left_on='id', right_index=True)
+    trams = trams.sort_values(['distance', 'ligne', 'direction'])[['properties.nom', 'distance', 'ligne', 'direction', 'delaipassage']]
+    trams.columns = ['Arrêt', 'Distance (m)', 'Ligne', 'Direction', 'Prochain passage']
+    return proches, trams.reset_index(drop=True)
+
+
+def get_position_choisie(adresse, key):
+    """ Position de référence du mode "près de moi" : la dernière adresse saisie,
+        ou le dernier clic / la dernière géolocalisation sur la carte `key`
+        Retourne (lat, lon, libellé) ou None"""
+
+    clic = carte_live.get_position(key, st.session_state)
+    choix = st.session_state.get(f'{key}.position', {'adresse': '', 'clic': None, 'position': None})
+    if adresse and adresse != choix['adresse']:
+        try:
+            position = api.geocode(adresse)
+        except (requests.RequestException, ValueError, KeyError):
+            # service de géocodage injoignable ou réponse illisible : traité comme une adresse introuvable
+            position = None
+        choix = {'adresse': adresse, 'clic': clic, 'position': position}
+    elif clic and clic != choix['clic']:
+        choix = {'adresse': adresse, 'clic': clic, 'position': (clic[0], clic[1], 'Position choisie sur la carte')}
+    st.session_state[f'{key}.position'] = choix
+    return choix['position']
+
+
+@instrumente
 def get_all_traces_color():
-    """ Récupère les traces de toutes les lignes TCL depuis 3 API du Grand Lyon,
-        construit une carte, exporte un fichier html, et retourne le nom du fichier (str)"""
-
-    # API tracés de tram
-    link_tram = "https://download.data.grandlyon.com/wfs/rdata?SERVICE=WFS&VERSION=2.0.0&request=GetFeature&typename=tcl_sytral.tcllignetram_2_0_0&outputFormat=application/json; subtype=geojson&SRSNAME=EPSG:4171"
-    r_tram = requests.get(link_tram)
-    traces_tram = pd.json_normalize(r_tram.json())
-    traces_tram = traces_tram['features'][0]
-
-    # API tracés de bus
-    link_bus = 'https://download.data.grandlyon.com/wfs/rdata?SERVICE=WFS&VERSION=2.0.0&request=GetFeature&typename=tcl_sytral.tcllignebus_2_0_0&outputFormat=application/json; subtype=geojson&SRSNAME=EPSG:4171'
-    r_bus = requests.get(link_bus)
-    traces_bus = pd.json_normalize(r_bus.json())
-    t_bus = traces_bus['features'][0]
-
-    # API tracés métro & funiculaires
-    link_metro = "https://download.data.grandlyon.com/wfs/rdata?SERVICE=WFS&VERSION=2.0.0&request=GetFeature&typename=tcl_sytral.tcllignemf_2_0_0&outputFormat=application/json; subtype=geojson&SRSNAME=EPSG:4171&startIndex=0"
-    r_metro = requests.get(link_metro)
-    traces_metro = pd.json_normalize(r_metro.json())
-    traces_metro = traces_metro['features'][0]
-    t_fun = [t for t in traces_metro if t['properties']['famille_transport']=='FUN']
-    t_metro = [t for t in traces_metro if t['properties']['famille_transport']=='MET']
-
-    # construction dictionnaire avec les tracés bus, métro, funiculaires, tram
-    lines_dict = {}
-    lines_dict['Bus'] = t_bus
-    lines_dict['Tramway'] = traces_tram
-    lines_dict['Métro'] = t_metro
-    lines_dict['Funiculaire'] = t_fun
-
-    # CARTE
-    # paramétrage :
-    centre = [45.75540611072912, 4.842535168843551]      # Guillotière
-    map = folium.Map(location=centre, zoom_start=13, tiles=None)
-    map.add_child(folium.TileLayer('Cartodb dark_matter'))
-    map.add_child(folium.TileLayer('Cartodb Positron'))
-
-    # 0075bf bleu B
-    # bleu turquoise #00C4B3
-    # tram #8c368c
-    # funiculaire #95c23d
-
-    for transport_type, lines in lines_dict.items():
-        fg = folium.FeatureGroup(name=transport_type)
-
-        # tracés des bus plus fins, et par défaut non affichés :
-        if transport_type == 'Bus':
-            fg = folium.FeatureGroup(name=transport_type, show=False)
-            style_function = lambda x: {'color': '#00C4B3', 'weight': 1}
-        elif transport_type == 'Tramway':
-            style_function = lambda x : {'color' : '#0075bf', 'weight' : 3}
-        elif transport_type == 'Funiculaire':
-            style_function = lambda x: {'color': '#95c23d', 'weight': 3}
-        elif transport_type == 'Métro':
-            style_function = lambda x : {'color' : color_red_st, 'weight' : 3}
-
-        map.add_child(fg)
-        code_lignes = []
-
-        for line in lines:
-            code_ligne = line['properties']['code_ligne']
-            if code_ligne not in code_lignes:
-                code_lignes.append(code_ligne)
-                gjson = folium.features.GeoJson(line['geometry'],
-                                                style_function = style_function)
-                fg.add_child(gjson)
-
-    folium.LayerControl().add_to(map)
-
-    filename = 'data_grand_lyon/map_all_traces.html'
-    map.save(filename)
-
-    return filename
+    """ Retourne le html (str) de la carte des traces de toutes les lignes TCL,
+        reconstruite uniquement quand les données du Grand Lyon changent"""
 
+    return traces.get_map_html()
 
+
+@instrumente
 def get_passages_tram():
     """ Récupère les prochains passages de tramway depuis l'API du Grand Lyon
         Retourne un DataFrame"""
 
-    # API prochains passages en temps réel
-    link_passages = "https://download.data.grandlyon.com/ws/rdata/tcl_sytral.tclpassagearret/all.json?maxfeatures=-1&start=1"
-    r_passages = requests.get(link_passages, auth=HTTPBasicAuth(USERNAME, PASSWORD))
-    passages = pd.json_normalize(r_passages.json(), record_path = 'values')
+    # API prochains passages en temps réel & table des points d'arrêt (= stations), en parallèle
+    # lecture en flux : seuls les passages des lignes de tram sont décodés et gardés
+    chunks = api.get_chunks(api.ws_url('passages_tram'), api.get_auth(USERNAME, PASSWORD))
+    f_passages = api.executor.submit(read_passages, chunks)
+    f_stations = api.executor.submit(arrets.get_arrets)
+    with etape('read_passages') as mesure:
+        passages = f_passages.result()
+        mesure.lignes(sortie=len(passages))
+
+    # nettoyage passages (règles dans grand_lyon.tram) : tram uniquement, prochain passage par arrêt
+    with etape('clean_passages') as mesure:
+        mesure.lignes(entree=len(passages))
+        passages = clean_passages(passages)
+        mesure.lignes(sortie=len(passages))
 
     # insertion timestamp
     request_time = dt.datetime.now(pytz.timezone('Europe/Paris')).replace(microsecond=0)
-    timestamp = [request_time for i in range(passages.shape[0])]
-    s = pd.Series(timestamp, name = 'timestamp')
-    passages.insert(0, 'timestamp', s)
-
-    # correction trams
-    def correct_trams(row):
-        if ('T1' in row['ligne']) and ('Mermoz' in row['direction']):
-            return 'T6'
-        elif ('T1' in row['ligne']) and ('Perrache' in row['direction']):
-            return 'T2'
-        elif ('T1' in row['ligne']) and ('Meyzieu' in row['direction']):
-            return 'T3'
-        elif ('T4' in row['ligne']) and ('Gare Part-Dieu' in row['direction']):
-            return 'T3'
-        elif ('T4' in row['ligne']) and ('Meyzieu' in row['direction']):
-            return 'T3'
-        else:
-            return row['ligne']
+    passages.insert(0, 'timestamp', request_time)
 
-    passages['ligne'] = passages.apply(correct_trams, axis=1)
-
-    # nettoyage passages
-    passages['direction'] = passages['direction'].apply(str.strip)
-    passages['ligne'] = passages['ligne'].apply(lambda x : x.replace('A', ''))
-    passages = passages[~((passages['direction'] == 'Porte des Alpes') & (passages['ligne'] == 'T2'))]
-    passages = passages[~((passages['direction'] == 'Perrache') & (passages['ligne'] == 'T2'))]
-    passages = passages[~((passages['direction'] == 'Grange Blanche') & (passages['ligne'] == 'T2'))]
-
-    # filtrage : tram uniquement
-    lignes_tram = ['T1', 'T2', 'T3', 'T4', 'T5', 'T6', 'T7']
-    passages = passages[passages.ligne.isin(lignes_tram)]
-
-    # filtrage colonnes
-    passages.drop(['coursetheorique', 'gid', 'idtarretdestination', 'last_update_fme', 'type'], axis=1, inplace=True)
-    # transformation en format date
-    passages['heurepassage'] = pd.to_datetime(passages['heurepassage'])
-
-    # index à 0
-    passages.reset_index(inplace=True, drop=True)
-
-    # API points d'arrêt (= stations)
-    link_stations = "https://download.data.grandlyon.com/wfs/rdata?SERVICE=WFS&VERSION=2.0.0&request=GetFeature&typename=tcl_sytral.tclarret&outputFormat=application/json; subtype=geojson&SRSNAME=EPSG:4171&startIndex=0"
-    r_stations = requests.get(link_stations)
-    points_arret = pd.json_normalize(r_stations.json(), record_path = 'features')
-
-    # filtrage & reformatage
-    points_arret['properties.id'] = points_arret['properties.id'].astype('int64')
-    points_arret.drop(['type', 'properties.pmr', 'properties.ascenseur', 'properties.desserte', 'properties.gid', 'properties.escalator', 'properties.last_update', 'properties.last_update_fme', 'geometry.type'], axis=1, inplace=True)
-    points_arret['properties.nom'] = points_arret['properties.nom'].apply(lambda x : x.replace('St', 'Saint'))
-    passages = passages.merge(points_arret, how='left', left_on='id', right_on='properties.id')
-    passages = passages[['timestamp', 'ligne', 'id', 'direction', 'properties.nom', 'delaipassage', 'heurepassage', 'geometry.coordinates']]
-
-    def get_concat(row):
-        concat = f"{row['ligne']} - {row['direction']} - {str(row['id'])}"
-        return concat
-
-    try:
-        tmp = passages.apply(get_concat, axis=1)
-        passages['concat'] = tmp
-    except ValueError:
-        print(tmp.shape)
-
-    passages = passages.sort_values(['concat', 'heurepassage']).drop_duplicates(subset=['concat'])
-    passages['delaipassage'].replace(to_replace='Proche', value='0 min', inplace = True)
-
-    passages.reset_index(inplace=True, drop=True)
+    # points d'arrêt (= stations) : recherche dans la table locale indexée par id
+    with etape('arrets.get_arrets'):
+        table_arrets = f_stations.result()
+    points_arret = table_arrets.reindex(passages['id'])
+    passages['properties.nom'] = points_arret['nom'].to_numpy()
+    passages['geometry.coordinates'] = [[lon, lat] for lon, lat in zip(points_arret['lon'], points_arret['lat'])]
+    passages = passages[['timestamp', 'ligne', 'id', 'direction', 'properties.nom', 'delaipassage', 'heurepassage', 'geometry.coordinates', 'concat']]
 
     return passages
 
 
+@instrumente
 def get_json_tram():
     """ Récupère les tracés des tramways depuis l'API du Grand Lyon
         Retourne des données au format JSON"""
 
-    link_tram = "https://download.data.grandlyon.com/wfs/rdata?SERVICE=WFS&VERSION=2.0.0&request=GetFeature&typename=tcl_sytral.tcllignetram_2_0_0&outputFormat=application/json; subtype=geojson&SRSNAME=EPSG:4171"
-    r_tram = requests.get(link_tram)
-    traces_tram = pd.json_normalize(r_tram.json())['features'][0]
+    # copie des propriétés : les features en cache sont partagées entre sessions
+    traces_tram = [dict(tram, properties=dict(tram['properties'])) for tram in wfs.get_features('tram')]
 
-    # harmonisation orthographe terminus
-    tram_terminus = ['Debourg', 'Hôtel de Région Montrochet', 'IUT Feyssine', 'Saint-Priest Bel Air',
-                     'La Doua-Gaston Berger', 'Hôpital Feyzin Vénissieux', 'Eurexpo', 'Grange Blanche',
-                     'Meyzieu les Panettes', 'Gare Part-Dieu', 'Décines-O.L.Vallée',
-                     'Vaulx-en-Velin La Soie', 'Hôpitaux Est-Pinel']
-
-    dico_correction = {'H.' : 'Hôtel',
-                     'Hôp.' : 'Hôpital',
-                     'G.Berger' : 'Gaston Berger',
-                     'St' : 'Saint',
-                     'Vaulx' : 'Vaulx-en-Velin'}
+    # harmonisation orthographe terminus (index des noms canoniques, résultats mémorisés)
+    index_terminus = noms.terminus_index()
 
     for tram in traces_tram:
-        origine = tram['properties']['nom_origine']
-        destination = tram['properties']['nom_destination']
-
-        for word in origine.split():
-            if word in dico_correction:
-                tram['properties']['nom_origine'] = tram['properties']['nom_origine'].replace(word, dico_correction[word])
+        tram['properties']['nom_origine'] = noms.expand(tram['properties']['nom_origine'])
+        destination = noms.expand(tram['properties']['nom_destination'])
+        tram['properties']['nom_destination'] = index_terminus.resolve(destination) or destination
 
-        for word in destination.split():
-            if word in dico_correction:
-                tram['properties']['nom_destination'] = tram['properties']['nom_destination'].replace(word, dico_correction[word])
+    return traces_tram
 
-        for terminus in tram_terminus:
-            if fuzz.partial_ratio(tram['properties']['nom_destination'], terminus) >= 80:
-                tram['properties']['nom_destination'] = terminus
 
-    return traces_tram
+# 'centre' géographique de chaque ligne de tram
+centre_lignes = {'T1' : [4.842535168843551, 45.75540611072912][::-1],     # Guillotière
+                 'T2' : [4.859213452134834, 45.74009698588613][::-1],     # Jet d'Eau
+                 'T3' : [4.910450819111944, 45.758460196002034][::-1],    # Bel Air les Brosses
+                 'T4' : [4.859213452134834, 45.74009698588613][::-1],     # Jet d'Eau
+                 'T5' : [4.904503423384204, 45.73496753878445][::-1],     # Boutasse C. Rousset
+                 'T6' : [45.727601206367986, 4.862018242655342],          # moyenne du tracé
+                 'T7' : [45.77648840600608, 4.972809071935217]}           # moyenne du tracé
 
 
-def get_map_tram(df, traces_tram, ligne, terminus):
+@instrumente
+def get_passages_ligne(df, ligne, terminus):
+    """ Prochains passages des stations de `ligne` en direction de `terminus`
+        Retourne un DataFrame"""
 
     p = df[df['ligne'] == ligne]
-    p['fuzz_ratio'] = p['properties.nom'].apply(lambda x : fuzz.partial_ratio(x, terminus))
-    p = p[(p['direction'] == terminus) | (p['fuzz_ratio'] >= 77)]
-    p.reset_index(inplace=True)
-
-    request_time = p['timestamp'].unique()[0]
-    tram_terminus = list(df['direction'].unique())
-
-    # 'centre' géographique de chaque ligne
-    centre_lignes = {'T1' : [4.842535168843551, 45.75540611072912][::-1],     # Guillotière
-                     'T2' : [4.859213452134834, 45.74009698588613][::-1],     # Jet d'Eau
-                     'T3' : [4.910450819111944, 45.758460196002034][::-1],    # Bel Air les Brosses
-                     'T4' : [4.859213452134834, 45.74009698588613][::-1],     # Jet d'Eau
-                     'T5' : [4.904503423384204, 45.73496753878445][::-1],     # Boutasse C. Rousset
-                     'T6' : [45.727601206367986, 4.862018242655342],          # moyenne du tracé
-                     'T7' : [45.77648840600608, 4.972809071935217]}           # moyenne du tracé
-
-
-    # AFFICHAGE TRACES + STATIONS
-
-    # centre automatique sur la ligne choisie
-    for tram in centre_lignes:
-        if tram == ligne:
-            centre = centre_lignes[tram]
-
-    map_tram_tr = folium.Map(location=centre, zoom_start=14)
-    map_tram_tr.add_child(folium.TileLayer("cartodbpositron"))
-
-    # ajout traces
-    for line in traces_tram:
-        ligne_segment = line['properties']['ligne']
-        if ligne_segment == ligne:
-            gjson = folium.features.GeoJson(line['geometry'],
-                                            style_function = lambda x: {'color': color_red_st,
-                                                                        'weight': 3})
-            map_tram_tr.add_child(gjson)
-            break
-
-    # ajout des stations sur la carte
-    for i in range(len(p)):
-        loc = p.loc[i]['geometry.coordinates'][::-1]
-        nom = p.loc[i]['properties.nom']
-        delai = p.loc[i]['delaipassage']
-        ts = p.loc[i]['timestamp']
-        text_actu = f"Dernière actualisation à {request_time.strftime('%X')}"
+    fuzz_ratio = p['properties.nom'].map(lambda x : noms.similarity(x, terminus))
+    p = p[(p['direction'] == terminus) | (fuzz_ratio >= 77)]
+    return p.reset_index()
 
-        tip = folium.Tooltip(f"<b>{nom}</b> <br> En direction de {terminus} <br> Prochain passage : {delai}")
 
-        # noms des terminus
-        for term in tram_terminus:
-            if fuzz.partial_ratio(nom, term) >= 80:
-                icon = folium.DivIcon(html=('<svg height="100" width="300">'
-                                        f'<text x="15" y="15" fill="black" font-weight="bold">{nom}</text>'
-                                        '</svg>'))
-                folium.Marker(
-                    location = loc,
-                    icon = icon
-                    ).add_to(map_tram_tr)
+@instrumente
+def get_carte_tram_live(df, traces_tram, ligne, terminus, reperes=None):
+    """ Carte persistante d'une ligne de tram : tracé et stations envoyés une fois,
+        puis seulement les délais qui ont changé"""
 
-        # ronds pour stations
-        icon = folium.plugins.BeautifyIcon(icon_shape='circle-dot',
-                                            border_color= color_red_st,
-                                            border_width=6)
+    p = get_passages_ligne(df, ligne, terminus)
+    index_terminus = noms.get_index(tuple(sorted(df['direction'].unique())))
+    terminus_noms = {nom for nom in p['properties.nom'].unique() if index_terminus.resolve(nom) is not None}
+    geometry = next((line['geometry'] for line in traces_tram if line['properties']['ligne'] == ligne), None)
 
-        folium.Marker(
-            location = loc,
-            tooltip = tip,
-            icon = icon
-            ).add_to(map_tram_tr)
+    static = carte_live.get_static_tram(p, geometry, ligne, terminus, centre_lignes[ligne], terminus_noms)
+    etat = carte_live.get_etat_tram(p)
+    with etape('carte_live'):
+        carte_live.carte_live('carte_tram', static, etat, st.session_state, height=map_height, reperes=reperes)
 
 
-    filename = "data_grand_lyon/map_tram_tr.html"
-    map_tram_tr.save(filename)
+@instrumente
+def get_df_parcs_relais():
+    """ Lit l'historique parcs relais (Parquet, converti depuis le csv si besoin),
+        retourne un DataFrame nettoyé limité aux colonnes des graphiques"""
 
-    return filename
+    return historique.load_parcs_relais()
 
 
-def get_df_parcs_relais():
-    """ Lit le csv parcs relais, retourne un DataFrame nettoyé"""
-
-    df_parc = pd.read_csv('data_grand_lyon/parcs_relais.csv', index_col=[0])
-
-    # filtrage & reformatage
-    df_parc['dateTime'] = df_parc['timestamp'].astype('datetime64[ns]')
-    df_parc['jour'] = df_parc['dateTime'].dt.weekday
-    dayOfWeek={0:'Lundi', 1:'Mardi', 2:'Mercredi', 3:'Jeudi', 4:'Vendredi', 5:'Samedi', 6:'Dimanche'}
-    df_parc['jour'] = df_parc['dateTime'].dt.dayofweek.map(dayOfWeek)
-    df_parc['heure'] = df_parc['dateTime'].dt.hour
-    df_parc['periode'] = df_parc['heure'].apply(lambda x: 'Matin' if x < 12 else 'Apres_midi')
-    df_parc['nom'] = df_parc['nom'].apply(lambda x : x.replace('Parc Relais TCL ', ''))
-    df_parc['nom'] = df_parc['nom'].apply(lambda x : x.replace('Hopital', 'Hôp.'))
-    parcs_nan = ['Feyssine', 'Gare de Vénissieux', 'Grézieu la Varenne', 'Porte des Alpes',
-                'Irigny-Yvours', 'Oullins La Saulaie Nord', 'Porte de Lyon']
-    df_parc = df_parc[~df_parc['nom'].isin(parcs_nan)]
-    df_parc.reset_index(inplace=True)
-    df_parc['taux_remplissage'] = (df_parc['capacite'] - df_parc['nb_tot_place_dispo'])/df_parc['capacite'] * 100
-
-    def parc_fermeture(row):
-        if row['heure'] <= 5 and row['nb_tot_place_dispo'] == 0:
-            return 0
-        elif (row['nom'] == 'Laurent Bonnevay' or row['nom'] == 'Gorge de Loup') and (row['jour'] == 'Dimanche'):
-            return 0
-        elif row['nom'] == 'Meyzieu les Panettes' and (row['jour'] == 'Samedi' or row['jour'] == 'Dimanche'):
-            return 0
-        return row['taux_remplissage']
-
-    df_parc['taux_remplissage'] = df_parc.apply(parc_fermeture, axis=1)
-
-    df_parc.drop(columns=['gid', 'horaires', 'id', 'last_update', 'last_update_fme',
-                          'p_surv', 'place_handi'], inplace=True)
-
-    return df_parc
-
-
-def get_graph_pr_tous(df_parc, jour):
+def set_pads(fig, menu, slider):
+    """ Marges du bouton play et du curseur d'une animation (absents si le découpage est vide)"""
+
+    if fig['layout']['updatemenus']:
+        fig['layout']['updatemenus'][0]['pad'] = menu
+        fig['layout']['sliders'][0]['pad'] = slider
+
+
+def get_source(cube):
+    """ Phrase indiquant l'origine de l'historique affiché (cube de janvier 2022 ou collecte continue)"""
+
+    if isinstance(cube, rollups.Rollups):
+        debut, fin = cube.period()
+        return f"Ces données ont été collectées en continu du {debut.strftime('%d/%m/%Y')} au {fin.strftime('%d/%m/%Y')}."
+    return "Ces données ont été collectées sur une semaine de janvier 2022."
+
+
+@instrumente
+def get_graph_pr_tous(cube_parc, jour):
     """ Génère le graphe : évolution animée du remplissage
-        de tous les parcs relais pour un jour
+        de tous les parcs relais pour un jour, à partir du cube (ou des agrégats) parcs relais
         Retourne fig """
 
-    df_day_parc = df_parc[(df_parc['jour'] == jour)]
-    df_day_parc1 = pd.pivot_table(df_day_parc, index = ['nom', "heure"], aggfunc = "mean")
-    df_day_parc1.reset_index(inplace=True)
+    df_day_parc1 = cube_parc.slice(['nom', 'heure'], jour=jour)
 
     fig = px.bar(df_day_parc1, x="nom", y='taux_remplissage', color = "nom", animation_frame="heure",
                 labels={"taux_remplissage": "",
@@ -498,21 +274,18 @@ def get_graph_pr_tous(df_parc, jour):
                       yaxis = dict(tickfont = dict(size=16)),
                       height = 700,
                       showlegend=False)
-    fig['layout']['updatemenus'][0]['pad']=dict(r= 20, t= 160)
-    fig['layout']['sliders'][0]['pad']=dict(r= 20, t= 150)
+    set_pads(fig, dict(r= 20, t= 160), dict(r= 20, t= 150))
 
     fig.update_yaxes(range=[0, 100])
 
     return fig
 
 
-def get_graph_pr(df_parc, parc, jour):
+@instrumente
+def get_graph_pr(cube_parc, parc, jour):
     """"""
 
-    df_day_parc = df_parc[(df_parc['jour'] == jour)]
-    df_day_parc = df_day_parc[(df_day_parc['nom'] == parc)]
-    df_day_parc1 = pd.pivot_table(df_day_parc, index = "heure", values = "taux_remplissage")
-    df_day_parc1.reset_index(inplace=True)
+    df_day_parc1 = cube_parc.slice(['heure'], jour=jour, nom=parc)
 
     fig = px.line(df_day_parc1, x="heure", y='taux_remplissage',
                 labels={"taux_remplissage": "",
@@ -527,30 +300,18 @@ def get_graph_pr(df_parc, parc, jour):
     return fig
 
 
+@instrumente
 def get_df_velov():
-    """ Lit le csv velov, retourne un DataFrame nettoyé"""
+    """ Lit l'historique velov (Parquet, converti depuis le csv si besoin),
+        retourne un DataFrame nettoyé limité aux colonnes des graphiques"""
 
-    df_velov = pd.read_csv('data_grand_lyon/velov_concat.csv')
+    return historique.load_velov()
 
-    df_velov['taux_remplissage'] = (df_velov['available_bike_stands']/df_velov['bike_stands'])*100
-    df_velov['dateTime'] = df_velov['timestamp'].astype('datetime64[ns]')
-    df_velov['jour'] = df_velov['dateTime'].dt.weekday
-    dayOfWeek={0:'Lundi', 1:'Mardi', 2:'Mercredi', 3:'Jeudi', 4:'Vendredi', 5:'Samedi', 6:'Dimanche'}
-    df_velov['jour'] = df_velov['dateTime'].dt.dayofweek.map(dayOfWeek)
-    df_velov['heure'] = df_velov['dateTime'].dt.hour
 
-    df_velov.drop(columns=['Unnamed: 0',"availabilitycode", "number", "available_bikes", "available_bike_stands",
-                      "bike_stands", "code_insee", "nmarrond", "fill_rate_percent", "gid", "lat", "lng", "lon"], inplace=True)
+@instrumente
+def get_graph_velov_communes(cube_velov, jour):
 
-    return df_velov
-
-
-def get_graph_velov_communes(df_velov, jour):
-
-    df_day = df_velov[(df_velov['jour'] == jour)]
-
-    df_day3 = pd.pivot_table(df_day, index = ['commune', "heure"], aggfunc = "mean")
-    df_day3.reset_index(inplace=True)
+    df_day3 = cube_velov.slice(['commune', 'heure'], jour=jour)
 
     fig = px.bar(df_day3, x="commune", y='taux_remplissage', color = "commune", animation_frame="heure",
                 labels={"taux_remplissage": "",
@@ -560,21 +321,17 @@ def get_graph_velov_communes(df_velov, jour):
                       xaxis = dict(tickfont = dict(size=14)),
                       yaxis = dict(tickfont = dict(size=14)),
                       showlegend=False)
-    fig['layout']['updatemenus'][0]['pad']=dict(r= 20, t= 200)
-    fig['layout']['sliders'][0]['pad']=dict(r= 20, t= 180,)
+    set_pads(fig, dict(r= 20, t= 200), dict(r= 20, t= 180,))
 
     fig.update_yaxes(range=[0, 100])
 
     return fig
 
 
-def get_graph_velov_unecommune(df_velov, jour, commune):
-
-    df_day = df_velov[df_velov['jour'] == jour]
-    df_day = df_velov[df_velov['commune'] == commune]
+@instrumente
+def get_graph_velov_unecommune(cube_velov, jour, commune):
 
-    df_day1 = pd.pivot_table(df_day, index = ['name', "heure"], values='taux_remplissage', aggfunc = "mean")
-    df_day1.reset_index(inplace=True)
+    df_day1 = cube_velov.slice(['name', 'heure'], jour=jour, commune=commune)
 
     fig = px.bar(df_day1, x="name", y='taux_remplissage', animation_frame="heure", color="taux_remplissage",
                 color_continuous_scale = px.colors.sequential.Blues, range_color=[0, 100],
@@ -590,21 +347,17 @@ def get_graph_velov_unecommune(df_velov, jour, commune):
                       height = 700,
                       showlegend=False,
                       coloraxis_showscale=False)
-    fig['layout']['updatemenus'][0]['pad']=dict(r= 20, t= 150)
-    fig['layout']['sliders'][0]['pad']=dict(r= 20, t= 140,)
+    set_pads(fig, dict(r= 20, t= 150), dict(r= 20, t= 140,))
 
     fig.update_yaxes(range=[0, 100])
 
     return fig
 
 
-def get_graph_velov_unestation(df_velov, jour, commune, station):
+@instrumente
+def get_graph_velov_unestation(cube_velov, jour, commune, station):
 
-    df_day = df_velov[(df_velov['jour'] == jour)]
-    df_day = df_day[(df_day['commune'] == commune)]
-    df_day = df_day[(df_day['name'] == station)]
-    df_day2 = pd.pivot_table(df_day, index = ["heure"], aggfunc = "mean")
-    df_day2.reset_index(inplace=True)
+    df_day2 = cube_velov.slice(['heure'], jour=jour, commune=commune, name=station)
 
     fig = px.line(df_day2, x="heure", y='taux_remplissage',
                     labels={"taux_remplissage": "",
@@ -626,8 +379,15 @@ def get_graph_velov_unestation(df_velov, jour, commune, station):
 # FRONT END
 with st.sidebar:
     options = ["Accueil", "Vélo'v : analyse", "Vélo'v en temps réel", "Parcs relais", "Horaires des tramways", "À propos"]
+    icons = ['house', 'graph-up', 'bicycle', 'building', 'watch', 'info-circle']
+    # page de diagnostic cachée : ?diagnostic=1 dans l'URL
+    if st.query_params.get('diagnostic'):
+        options.append("Diagnostic")
+        icons.append('speedometer')
     menu_title = "Les transports du Grand Lyon"
-    choice = option_menu(menu_title=None, options=options, icons=['house', 'graph-up', 'bicycle', 'building', 'watch', 'info-circle'],)
+    choice = option_menu(menu_title=None, options=options, icons=icons,)
+
+debut_page = time.perf_counter()
 
 # Body
 if choice == "Accueil":
@@ -658,8 +418,9 @@ if choice == "Accueil":
     st.markdown("Cliquez sur les carrés en haut à droite de la carte pour sélectionner les moyens de transport affichés.")
 
 
-    file_traces = open(get_all_traces_color(), 'r', encoding='utf-8')
-    components.html(file_traces.read(), height=map_height+10)
+    html_traces = get_all_traces_color()
+    with etape('components.html', choice):
+        components.html(html_traces, height=map_height+10)
 
 
 if choice == "Vélo'v : analyse":
@@ -676,10 +437,10 @@ if choice == "Vélo'v : analyse":
     st.markdown("### Découvrez ci-dessous l'évolution animée du remplissage des stations Vélo’v du 4ème arrondissement de Lyon, tout au long de la semaine.")
 
     st.error("Sélectionnez un jour de la semaine et appuyez sur play sous le graphique.")
-    if 'velov' not in st.session_state:
-        st.session_state['velov'] = get_df_velov()
+    if 'cube_velov' not in st.session_state:
+        st.session_state['cube_velov'] = rollups.get_historique_velov()
 
-    df_velov = st.session_state['velov']
+    cube_velov = st.session_state['cube_velov']
     liste_jours = ['Jours de la semaine', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
     jour = st.selectbox('', options=liste_jours)
     st.text("")
@@ -687,7 +448,9 @@ if choice == "Vélo'v : analyse":
     if jour != liste_jours[0]:
         with st.spinner('Chargement du graphique en cours...'):
             commune_choisie = "Lyon 4 ème"
-            fig_velov_lyon4 = get_graph_velov_unecommune(df_velov, jour, commune_choisie)
+            fig_velov_lyon4 = get_graph_velov_unecommune(cube_velov, jour, commune_choisie)
+            if not fig_velov_lyon4.data:
+                st.info(f"Pas encore de données pour un {jour.lower()}.")
             st.plotly_chart(fig_velov_lyon4, config=dict(displayModeBar=False))
 
         st.text("")
@@ -702,20 +465,20 @@ if choice == "Vélo'v : analyse":
             Il s’agit des heures où les personnes partent travailler.\
             Le nombre de vélos baisse fortement à 13h à l’heure du déjeuner.\
             Puis, la station se remplit progressivement à partir de 17h après la journée de travail.")
-        fig_velov_mairie_m = get_graph_velov_unestation(df_velov, jour='Mardi', commune=commune_choisie, station='Mairie du 4e')
+        fig_velov_mairie_m = get_graph_velov_unestation(cube_velov, jour='Mardi', commune=commune_choisie, station='Mairie du 4e')
         st.plotly_chart(fig_velov_mairie_m, config=dict(displayModeBar=False))
 
         st.markdown("#### Samedi")
         st.markdown("Le samedi, le nombre de vélos baisse fortement entre 8h et 10h en raison du marché ou des personnes partant \
             en centre-ville. La station se remplit ensuite fortement à partir de 15h pour arriver à son plein à 19h \
                 lorsque les personne rentrent chez elles ou se rendent dans un bar/restaurant.")
-        fig_velov_mairie_s = get_graph_velov_unestation(df_velov, jour='Samedi', commune=commune_choisie, station='Mairie du 4e')
+        fig_velov_mairie_s = get_graph_velov_unestation(cube_velov, jour='Samedi', commune=commune_choisie, station='Mairie du 4e')
         st.plotly_chart(fig_velov_mairie_s, config=dict(displayModeBar=False))
 
 
         st.markdown("#### Dimanche")
         st.markdown("Le dimanche, nous pouvons constater que les vélos sont très peu utilisés et cela entre 9h et 18h.")
-        fig_velov_mairie_d = get_graph_velov_unestation(df_velov, jour='Dimanche', commune=commune_choisie, station='Mairie du 4e')
+        fig_velov_mairie_d = get_graph_velov_unestation(cube_velov, jour='Dimanche', commune=commune_choisie, station='Mairie du 4e')
         st.plotly_chart(fig_velov_mairie_d, config=dict(displayModeBar=False))
 
 
@@ -730,8 +493,8 @@ if choice == "Vélo'v en temps réel":
     st.text("")
 
 
-    if 'velov_tr' not in st.session_state:
-        st.session_state['velov_tr'] = get_df_velov_tr()
+    if 'velov_tr' not in st.session_state or st.button('Actualiser les données'):
+        st.session_state['velov_tr'] = fetch_cache.get('velov_tr', get_df_velov_tr)
 
     df_velov_tr = st.session_state['velov_tr']
 
@@ -739,9 +502,30 @@ if choice == "Vélo'v en temps réel":
     actu = f"Dernière actualisation à {request_time.strftime('%X')}"
     st.text(actu)
 
+    # près de moi : adresse saisie, clic sur la carte ou bouton de géolocalisation
+    st.markdown("#### Les stations les plus proches")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        adresse = st.text_input("Près d'une adresse (ou cliquez sur la carte, ou utilisez le bouton ◎ pour vous localiser)")
+    with col2:
+        min_velos = st.number_input('Vélos disponibles au minimum', min_value=1, max_value=20, value=1)
+    reperes = None
+    position = get_position_choisie(adresse, 'carte_velov')
+    if adresse and position is None:
+        st.error("Adresse introuvable")
+    elif position is not None:
+        proches = get_velov_proches(df_velov_tr, position[0], position[1], k=5, min_velos=min_velos)
+        st.text(position[2])
+        st.dataframe(proches.drop(columns='number'), hide_index=True)
+        reperes = {'position': [position[0], position[1]], 'proches': [str(n) for n in proches['number']]}
+
+    # carte persistante : positions des stations envoyées une fois, puis seulement les disponibilités modifiées
     with st.spinner('Chargement de la carte en cours...'):
-        file_velov = open(get_map_velov_tr(df_velov_tr), 'r', encoding='utf-8')
-        components.html(file_velov.read(), height=map_height+10)
+        static = carte_live.get_static_velov(df_velov_tr, centre=[45.7548790164649, 4.84367508189202])
+        etat = carte_live.get_etat_velov(df_velov_tr, prevision.prevoir_velov(df_velov_tr))
+        with etape('carte_live', choice):
+            carte_live.carte_live('carte_velov', static, etat, st.session_state,
+                                  height=map_height, reperes=reperes)
 
 
 if choice == "Parcs relais":
@@ -763,13 +547,27 @@ if choice == "Parcs relais":
     st.markdown('•  Nombre total de places : 7 324', unsafe_allow_html=True)
     st.markdown('•  Nombre total de places PMR : 180', unsafe_allow_html=True)
     st.text("")
+
+    st.markdown(f"### Places disponibles maintenant et dans {prevision.HORIZON} minutes")
+    try:
+        parcs_tr = fetch_cache.get('parcs_relais_tr', get_df_parcs_relais_tr)
+    except requests.RequestException:
+        parcs_tr = None
+        st.warning("Places en temps réel indisponibles : l'API du Grand Lyon ne répond pas.")
+    if parcs_tr is not None:
+        st.text(f"Dernière actualisation à {parcs_tr['timestamp'].iloc[0].strftime('%X')}")
+        places_parcs = prevision.prevoir_parcs_relais(parcs_tr)
+        if places_parcs.shape[1] < 4:
+            st.info("Prévisions indisponibles : le modèle n'a pas encore été entraîné (python -m grand_lyon.prevision).")
+        st.dataframe(places_parcs, hide_index=True)
+    st.text("")
     st.markdown("### Découvrez ci-dessous l'évolution animée de la fréquentation des parcs relais de la Métropole de Lyon tout au long de la semaine :")
     st.error("Sélectionnez un jour de la semaine et appuyez sur play sous le graphique.")
     st.text("Pour plus de confort, nous vous invitons à fermer le volet sur la gauche.")
 
-    if 'parcs_relais' not in st.session_state:
-        st.session_state['parcs_relais'] = get_df_parcs_relais()
-    df_parc = st.session_state['parcs_relais']
+    if 'cube_parcs_relais' not in st.session_state:
+        st.session_state['cube_parcs_relais'] = rollups.get_historique_parcs_relais()
+    cube_parc = st.session_state['cube_parcs_relais']
     liste_jours = ['Jours de la semaine', 'Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
 
     col1, col2 = st.columns(2)
@@ -779,24 +577,25 @@ if choice == "Parcs relais":
         st.text("")
 
         if jour_choisi != liste_jours[0]:
-            fig1 = get_graph_pr_tous(df_parc, jour_choisi)
+            fig1 = get_graph_pr_tous(cube_parc, jour_choisi)
+            if not fig1.data:
+                st.info(f"Pas encore de données pour un {jour_choisi.lower()}.")
             st.plotly_chart(fig1, config=dict(displayModeBar=False))
             st.text("")
             st.text("")
 
             with col2:
-                liste_parcs = sorted(list(df_parc['nom'].unique()))
+                liste_parcs = cube_parc.entities('nom')
                 liste_parcs.insert(0, 'Sélectionnez un parc relais')
                 parc_choisi = st.selectbox("", options=liste_parcs)
                 st.text("")
                 st.text("")
                 if parc_choisi != liste_parcs[0]:
-                    df_parc_choisi = df_parc[df_parc['nom'] == parc_choisi]
-                    taux_unique = df_parc_choisi['taux_remplissage'].unique()
-                    if len(taux_unique) <= 1 and taux_unique[0] <= 0:
+                    taux_parc = cube_parc.slice(['heure'], nom=parc_choisi)['taux_remplissage']
+                    if taux_parc.max() <= 0:
                         st.error("Données non disponibles")
                     else:
-                        fig2 = get_graph_pr(df_parc, parc_choisi, jour_choisi)
+                        fig2 = get_graph_pr(cube_parc, parc_choisi, jour_choisi)
                         st.plotly_chart(fig2, config=dict(displayModeBar=False))
 
     st.markdown("**Les jours de semaine,** ces graphiques montrent une nette augmentation de la fréquentation des parcs\
@@ -814,7 +613,7 @@ if choice == "Parcs relais":
                 en effet, le taux de remplissage moyen atteint tout juste les 6%.\
                 Ce constat s'explique facilement par la fermeture dominicale des commerces.")
     st.text("")
-    st.markdown("Ces données ont été collectées sur une semaine de janvier 2022.\
+    st.markdown(f"{get_source(cube_parc)}\
                 Malheureusement, nous n’avons pas pu récupérer les données pour les parcs relais : Feyssine, Gare de Vénissieux, Grézieu la Varenne,\
                 Irigny-Yvours, Oullins La Saulaie Nord, Porte des Alpes et Porte de Lyon.")
 
@@ -842,7 +641,7 @@ if choice == "Horaires des tramways":
     st.text("Pour plus de confort, nous vous invitons à fermer le volet sur la gauche.")
 
     if 'passages' not in st.session_state:
-        st.session_state['passages'] = get_passages_tram()
+        st.session_state['passages'] = fetch_cache.get('passages_tram', get_passages_tram)
 
     passages = st.session_state['passages']
     request_time = passages['timestamp'].unique()[0]
@@ -873,11 +672,32 @@ if choice == "Horaires des tramways":
             del st.session_state['passages']
         st.text(text_actu)
 
+    # près de moi : arrêts à moins de R mètres et prochains passages de tram
+    st.markdown("#### Les arrêts autour de moi")
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        adresse = st.text_input("Près d'une adresse (ou cliquez sur la carte de la ligne)")
+    with col2:
+        rayon = st.number_input('Rayon (m)', min_value=100, max_value=2000, value=400, step=100)
+    reperes = None
+    position = get_position_choisie(adresse, 'carte_tram')
+    if adresse and position is None:
+        st.error("Adresse introuvable")
+    elif position is not None:
+        arrets_proches, trams_proches = get_arrets_proches(passages, position[0], position[1], rayon)
+        st.text(position[2])
+        if len(trams_proches):
+            st.dataframe(trams_proches, hide_index=True)
+        else:
+            st.text(f"Aucun arrêt de tram à moins de {rayon} m ; arrêts TCL les plus proches :")
+            st.dataframe(arrets_proches.rename(columns={'nom': 'Arrêt', 'distance': 'Distance (m)', 'desserte': 'Lignes'}),
+                         hide_index=True)
+        reperes = {'position': [position[0], position[1]], 'proches': [str(i) for i in arrets_proches.index]}
+
     # affichage de la carte
     with st.spinner('Chargement de la carte en cours...'):
         if (ligne != lignes_tram[0]) and (terminus != tram_terminus[0]):
-            file_map_tram = open(get_map_tram(passages, traces_tram, ligne, terminus), 'r', encoding='utf-8')
-            components.html(file_map_tram.read(), height=map_height+10)
+            get_carte_tram_live(passages, traces_tram, ligne, terminus, reperes)
 
 
 if choice == 'À propos':
@@ -917,3 +737,32 @@ if choice == 'À propos':
     with mouna:
         st.image('images/Mouna.png')
         components.html(f"<p><a style='text-align: center; font-size:large; font-weight: bold; font-family: arial; color: {color_red_st};' href=\"https://www.github.com/mounasb\" target=\"_blank\">Mouna Sebti</a></p>")
+
+
+if choice == "Diagnostic":
+    st.markdown("<h1 style='text-align: center; color: #FF4B4B;'>DIAGNOSTIC</h1>", unsafe_allow_html=True)
+    st.markdown("#### Durée des fonctions et de leurs étapes")
+    st.text(f"Sur les {RESERVOIR} derniers appels de chaque étape, pour toutes les sessions. "
+            f"Export Prometheus : {EXPORT_URL if PUBLIQUE else EXPORT_FILE + ' (sur le serveur)'}")
+    col1, col2 = st.columns(2)
+    with col1:
+        memoire = st.toggle("Mesurer les pics de mémoire (tracemalloc, ralentit les calculs)",
+                            value=tracemalloc.is_tracing())
+        tracer_memoire(memoire)
+    with col2:
+        if st.button('Remettre les mesures à zéro'):
+            metriques.clear()
+    st.dataframe(metriques.table().round(2), hide_index=True)
+
+    st.markdown("#### Caches")
+    st.text("Téléchargements des API (fetch_cache)")
+    st.dataframe(pd.DataFrame(fetch_cache.stats()).T)
+    st.text("Couches quasi statiques sur disque, requêtes conditionnelles (cache_http)")
+    st.dataframe(pd.DataFrame(cache_http.stats()).T)
+    st.text("Cartes rendues (render_cache)")
+    st.dataframe(pd.DataFrame([render_cache.stats()]), hide_index=True)
+
+
+metriques.add('page', choice, time.perf_counter() - debut_page)
+metriques.write_export(fetch_stats=fetch_cache.stats(), render_stats=render_cache.stats(),
+                       http_stats=cache_http.stats())
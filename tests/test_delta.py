@@ -0,0 +1,104 @@
+""" Encodage des relevés (grand_lyon.delta) : l'état relu dans le stockage à chaque
+    relevé est celui du relevé complet, y compris au changement d'heure et de jour.
+
+    python -m pytest tests"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from grand_lyon import delta
+from grand_lyon.stockage import Store
+
+
+STATIONS = 40
+CHAMPS = ['number'] + delta.CHAMPS_VELOV
+
+
+def get_releves(instants, seed=0):
+    """ Relevés complets successifs : quelques stations changent à chaque relevé"""
+
+    rng = np.random.default_rng(seed)
+    etat = pd.DataFrame({'number': np.arange(1000, 1000 + STATIONS),
+                         'status': 'OPEN',
+                         'available_bikes': rng.integers(0, 20, STATIONS),
+                         'available_bike_stands': rng.integers(0, 20, STATIONS)})
+    releves = []
+    for ts in instants:
+        etat = etat.copy()
+        change = rng.random(STATIONS) < 0.15
+        etat.loc[change, 'available_bikes'] = rng.integers(0, 20, change.sum())
+        etat.loc[rng.random(STATIONS) < 0.02, 'status'] = 'CLOSED'
+        releves.append(etat.assign(timestamp=ts))
+    return releves
+
+
+def get_etat(rows):
+    return rows[CHAMPS].sort_values('number').reset_index(drop=True)
+
+
+@pytest.fixture
+def instants():
+    # minuit, puis passage à l'heure d'hiver (3h -> 2h) la même nuit
+    return pd.date_range('2022-10-29 22:00', '2022-10-30 04:00', freq='10min', tz='Europe/Paris')
+
+
+def write(store, releves, encoder=None):
+    encoder = encoder or delta.DeltaEncoder('number')
+    for releve in releves:
+        store.append(encoder.encode(releve))
+    return encoder
+
+
+def test_state_at(tmp_path, instants):
+    store = Store(str(tmp_path))
+    releves = get_releves(instants)
+    encoder = write(store, releves)
+    assert encoder.rows_out < encoder.rows_in
+    assert store.days() == ['2022-10-29', '2022-10-30']
+    for releve in releves:
+        ts = releve['timestamp'].iloc[0]
+        pd.testing.assert_frame_equal(get_etat(delta.state_at(store, ts)), get_etat(releve))
+
+
+def test_reconstruct(tmp_path, instants):
+    store = Store(str(tmp_path))
+    releves = get_releves(instants, seed=1)
+    write(store, releves)
+    rows = store.read()
+    for releve in releves[::5]:
+        ts = releve['timestamp'].iloc[0]
+        pd.testing.assert_frame_equal(get_etat(delta.reconstruct(rows, ts)), get_etat(releve))
+
+
+def test_recover(tmp_path, instants):
+    """ Un collecteur redémarré reprend le même état : il écrit les mêmes lignes"""
+
+    releves = get_releves(instants, seed=2)
+    coupure = len(releves) // 2 + 3
+    continu = delta.DeltaEncoder('number')
+    for releve in releves[:coupure]:
+        continu.encode(releve)
+
+    store = Store(str(tmp_path))
+    write(store, releves[:coupure])
+    reprise = delta.DeltaEncoder('number')
+    reprise.recover(store)
+    for releve in releves[coupure:]:
+        pd.testing.assert_frame_equal(reprise.encode(releve), continu.encode(releve))
+
+
+def test_partitions_sans_keyframe(tmp_path, instants):
+    """ Relevés complets écrits avant l'encodage : relus comme des keyframes"""
+
+    store = Store(str(tmp_path))
+    releves = get_releves(instants, seed=3)
+    for releve in releves[:4]:
+        store.append(releve)
+    ts = releves[2]['timestamp'].iloc[0]
+    pd.testing.assert_frame_equal(get_etat(delta.state_at(store, ts)), get_etat(releves[2]))
+
+    encoder = delta.DeltaEncoder('number')
+    encoder.recover(store)
+    assert encoder.last_keyframe == releves[3]['timestamp'].iloc[0]
+    assert len(encoder.encode(releves[4])) < STATIONS
@@ -0,0 +1,124 @@
+""" Agrégats multi-résolution (grand_lyon.rollups) comparés à un groupby direct sur les
+    lignes brutes : relevés successifs, enregistrements, relecture, relevés en retard
+    et durée de conservation.
+
+    python -m pytest tests"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from grand_lyon import historique, rollups
+
+
+PARCS = ['Cuire', 'Mermoz', 'Vaise']
+
+
+def get_releves(debut='2022-01-17 00:03', jours=9, pas='71min', seed=0):
+    """ Relevés nettoyés (dateTime, nom, taux_remplissage), un DataFrame par relevé"""
+
+    rng = np.random.default_rng(seed)
+    return [pd.DataFrame({'dateTime': ts, 'nom': PARCS, 'taux_remplissage': rng.uniform(0, 100, len(PARCS))})
+            for ts in pd.date_range(debut, periods=int(pd.Timedelta(days=jours) / pd.Timedelta(pas)), freq=pas)]
+
+
+def get_attendu(rows, by, **filters):
+    """ Moyenne, minimum et maximum calculés directement sur les lignes brutes"""
+
+    data = rows.assign(jour=pd.Categorical.from_codes(rows['dateTime'].dt.weekday, categories=historique.JOURS,
+                                                      ordered=True),
+                       heure=rows['dateTime'].dt.hour)
+    for key, value in filters.items():
+        data = data[data[key] == value]
+    data = data.groupby(by, observed=True)['taux_remplissage'].agg(['mean', 'min', 'max'])
+    return data.rename(columns={'mean': 'taux_remplissage'}).reset_index()
+
+
+def compare(r, rows, by, **filters):
+    obtenu = r.slice(by, **filters).sort_values(by, ignore_index=True)
+    attendu = get_attendu(rows, by, **filters).sort_values(by, ignore_index=True)
+    assert len(attendu)
+    pd.testing.assert_frame_equal(obtenu, attendu, check_dtype=False, check_categorical=False)
+
+
+def feed(r, releves, save_every=10):
+    for i, releve in enumerate(releves, 1):
+        r.add(releve)
+        if i % save_every == 0:
+            r.save()
+    r.save()
+
+
+@pytest.fixture(scope='module')
+def collecte(tmp_path_factory):
+    """ Agrégats de neuf jours de relevés, enregistrés ; lignes brutes"""
+
+    root = str(tmp_path_factory.mktemp('rollups'))
+    releves = get_releves()
+    r = rollups.Rollups(root, ['nom'])
+    feed(r, releves)
+    return r, root, pd.concat(releves, ignore_index=True)
+
+
+@pytest.mark.parametrize('by, filters', [(['nom', 'heure'], {'jour': 'Mardi'}),
+                                         (['heure'], {'jour': 'Samedi', 'nom': 'Mermoz'}),
+                                         (['jour'], {}),
+                                         (['nom'], {})])
+def test_slice(collecte, by, filters):
+    r, root, rows = collecte
+    compare(r, rows, by, **filters)
+    # relu depuis le disque
+    compare(rollups.Rollups(root, ['nom']), rows, by, **filters)
+
+
+def test_reprise(tmp_path):
+    """ Agrégats enregistrés, relus par une nouvelle instance qui continue la collecte"""
+
+    releves = get_releves(seed=1)
+    moitie = len(releves) // 2
+    feed(rollups.Rollups(str(tmp_path), ['nom']), releves[:moitie])
+    r = rollups.Rollups(str(tmp_path), ['nom'])
+    feed(r, releves[moitie:], save_every=7)
+    compare(r, pd.concat(releves, ignore_index=True), ['nom', 'heure'], jour='Mercredi')
+    assert r.weekdays() == set(range(7))
+
+
+def test_releves_en_retard(tmp_path):
+    """ Lignes d'intervalles déjà clos (et déjà enregistrés) : fusionnées, moyennes exactes"""
+
+    releves = get_releves(jours=3, seed=2)
+    r = rollups.Rollups(str(tmp_path), ['nom'])
+    feed(r, releves)
+    retard = [pd.DataFrame({'dateTime': pd.Timestamp(ts), 'nom': ['Cuire', 'Vaise'], 'taux_remplissage': [1.0, 99.0]})
+              for ts in ['2022-01-17 08:30', '2022-01-18 14:05', '2022-01-17 08:31']]
+    feed(r, retard)
+    rows = pd.concat(releves + retard, ignore_index=True)
+    compare(r, rows, ['nom', 'heure'], jour='Lundi')
+    compare(rollups.Rollups(str(tmp_path), ['nom']), rows, ['nom', 'heure'], jour='Mardi')
+    # un seul intervalle par (heure, parc) une fois enregistré
+    heures = rollups.Rollups(str(tmp_path), ['nom']).tables['hour']
+    assert not heures.duplicated(['bucket', 'nom']).any()
+
+
+def test_retention(tmp_path):
+    """ Partitions de minutes supprimées au-delà de la conservation, heures et jours intacts"""
+
+    releves = get_releves(seed=3)
+    retention = dict(rollups.RETENTION, minute=pd.Timedelta(days=1))
+    r = rollups.Rollups(str(tmp_path), ['nom'], retention=retention)
+    feed(r, releves)
+    rows = pd.concat(releves, ignore_index=True)
+
+    minutes = rollups.Rollups(str(tmp_path), ['nom'], retention=retention).tables['minute']
+    dernier = rows['dateTime'].max().floor('min')
+    # partitions d'une heure : au plus une heure de plus que la conservation
+    assert rows['dateTime'].min() < dernier - pd.Timedelta(days=2)
+    assert minutes['bucket'].min() >= dernier - pd.Timedelta(days=1, hours=1)
+    assert minutes['bucket'].max() == dernier
+    garde = rows[rows['dateTime'] >= minutes['bucket'].min()]
+    attendu = garde.groupby([garde['dateTime'].dt.floor('min'), 'nom'])['taux_remplissage'].sum()
+    obtenu = minutes.set_index(['bucket', 'nom'])['sum'].sort_index()
+    np.testing.assert_allclose(obtenu.to_numpy(), attendu.sort_index().to_numpy())
+
+    compare(r, rows, ['nom', 'heure'], jour='Lundi')
+    compare(r, rows, ['jour'])
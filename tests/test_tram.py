@@ -0,0 +1,104 @@
+""" Nettoyage des passages de tram (grand_lyon.tram) comparé aux règles ligne par ligne
+    d'origine, sur un échantillon couvrant chaque règle et, s'il a été enregistré
+    (python -m benchmarks.fixtures), sur le flux réel de benchmarks/fixtures.
+
+    python -m pytest tests"""
+
+import gzip
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import fixtures
+from grand_lyon import tram
+
+
+LIGNES = ['T1', 'T1A', 'T2', 'T3', 'T4', 'T4A', 'T5', 'T6', 'T7', 'T8', 'C3', 'JD41', 'TB11', '86']
+DIRECTIONS = ['Mermoz - Pinel', 'Perrache', ' Perrache ', 'Meyzieu ZI', 'Gare Part-Dieu Villette',
+              'Porte des Alpes', 'Grange Blanche ', 'Debourg', 'IUT Feyssine', 'Hôpital Feyzin Vénissieux']
+
+
+def correct_trams(row):
+    """ Corrections d'origine (apply ligne par ligne)"""
+
+    if ('T1' in row['ligne']) and ('Mermoz' in row['direction']):
+        return 'T6'
+    elif ('T1' in row['ligne']) and ('Perrache' in row['direction']):
+        return 'T2'
+    elif ('T1' in row['ligne']) and ('Meyzieu' in row['direction']):
+        return 'T3'
+    elif ('T4' in row['ligne']) and ('Gare Part-Dieu' in row['direction']):
+        return 'T3'
+    elif ('T4' in row['ligne']) and ('Meyzieu' in row['direction']):
+        return 'T3'
+    else:
+        return row['ligne']
+
+
+def clean_reference(passages):
+    """ Nettoyage d'origine de get_passages_tram, sans la jointure avec les arrêts"""
+
+    passages = passages.copy()
+    passages['ligne'] = passages.apply(correct_trams, axis=1)
+    passages['direction'] = passages['direction'].apply(str.strip)
+    passages['ligne'] = passages['ligne'].apply(lambda x : x.replace('A', ''))
+    passages = passages[~((passages['direction'] == 'Porte des Alpes') & (passages['ligne'] == 'T2'))]
+    passages = passages[~((passages['direction'] == 'Perrache') & (passages['ligne'] == 'T2'))]
+    passages = passages[~((passages['direction'] == 'Grange Blanche') & (passages['ligne'] == 'T2'))]
+    passages = passages[passages.ligne.isin(tram.LIGNES_TRAM)]
+    passages = passages.drop(tram.COLONNES_INUTILES, axis=1)
+    passages['heurepassage'] = pd.to_datetime(passages['heurepassage'])
+    passages['concat'] = passages.apply(lambda row: f"{row['ligne']} - {row['direction']} - {str(row['id'])}", axis=1)
+    passages = passages.sort_values(['concat', 'heurepassage']).drop_duplicates(subset=['concat'])
+    passages['delaipassage'] = passages['delaipassage'].replace('Proche', '0 min')
+    return passages.reset_index(drop=True)
+
+
+def get_echantillon(seed=0):
+    """ Passages bruts (colonnes du flux) : chaque ligne avec chaque direction, sur quelques
+        arrêts, plusieurs passages par arrêt dans le désordre"""
+
+    rng = np.random.default_rng(seed)
+    values = []
+    for gid, (ligne, direction, arret, _) in enumerate(itertools.product(LIGNES, DIRECTIONS, [101, 102, 103], range(3))):
+        minutes = int(rng.integers(0, 60))
+        values.append({'coursetheorique': 'x', 'delaipassage': 'Proche' if minutes < 2 else f'{minutes} min',
+                       'direction': direction, 'gid': gid,
+                       'heurepassage': f'2022-01-19 08:{minutes:02d}:00', 'id': arret,
+                       'idtarretdestination': 1, 'ligne': ligne, 'type': 'E', 'last_update_fme': ''})
+    rng.shuffle(values)
+    return pd.DataFrame(values)
+
+
+def get_enregistrement():
+    path = fixtures.get_path('passages_tram')
+    if not os.path.exists(path):
+        pytest.skip("flux des passages non enregistré (python -m benchmarks.fixtures)")
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return pd.json_normalize(json.load(f), record_path='values')
+
+
+def compare(passages):
+    attendu = clean_reference(passages)
+    obtenu = tram.clean_passages(passages.copy())
+    assert len(attendu)
+    pd.testing.assert_frame_equal(obtenu[attendu.columns], attendu)
+
+
+def test_correct_lignes():
+    passages = get_echantillon()
+    attendu = passages.apply(correct_trams, axis=1)
+    obtenu = tram.correct_lignes(passages['ligne'], passages['direction'])
+    pd.testing.assert_series_equal(obtenu, attendu, check_names=False)
+
+
+def test_clean_passages_echantillon():
+    compare(get_echantillon())
+
+
+def test_clean_passages_enregistrement():
+    compare(get_enregistrement())
@@ -0,0 +1,128 @@
+""" Client WFS (grand_lyon.wfs) contre le serveur de rejeu local et contre des serveurs qui
+    ignorent la pagination.
+
+    python -m pytest tests"""
+
+import gzip
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from benchmarks import fixtures
+from grand_lyon import api, rejeu, wfs
+from grand_lyon.cache_http import cache_http
+
+
+# au-delà, le client boucle : le test échoue au lieu de ne jamais finir
+MAX_APPELS = 100
+
+
+def get_couches():
+    """ Couches synthétiques : propriétés utilisées et écartées, lignes de métro et de bus"""
+
+    def feature(gid, props):
+        return {'type': 'Feature', 'id': f'x.{gid}',
+                'geometry': {'type': 'LineString', 'coordinates': [[4.8 + gid / 1e4, 45.7], [4.9, 45.8 + gid / 1e4]]},
+                'properties': dict(props, gid=gid, pmr=True, ascenseur=False, last_update_fme='2022-01-01')}
+
+    return {'wfs.bus': {'type': 'FeatureCollection',
+                        'features': [feature(gid, {'code_ligne': f'C{gid % 40}', 'last_update': '2022-01-01'})
+                                     for gid in range(1, 301)]},
+            'wfs.metro': {'type': 'FeatureCollection',
+                          'features': [feature(gid, {'code_ligne': f'M{gid}', 'famille_transport': famille,
+                                                     'last_update': '2022-01-01'})
+                                       for gid, famille in enumerate(['MET', 'FUN', 'TRA', 'MET', 'BUS'] * 4, 1)]},
+            'wfs.arrets': {'type': 'FeatureCollection',
+                           'features': [feature(gid, {'id': gid, 'nom': f'Arrêt {gid}', 'desserte': 'T1:A',
+                                                      'last_update': f'2022-01-{1 + gid % 28:02d} 00:00:00'})
+                                        for gid in range(1, 121)]}}
+
+
+def get_attendu(data, layer, filtre=None):
+    """ Couche filtrée et projetée localement"""
+
+    filtre = wfs.FILTRES.get(layer) if filtre is None else filtre
+    features = [f for f in data['features'] if wfs.match(filtre, f['properties'])]
+    return trie(wfs.flux_json.project_features(features, wfs.PROPRIETES[layer]))
+
+
+def trie(features):
+    """ Features dans un ordre fixe (les arrêts projetés n'ont pas de gid)"""
+
+    return sorted(features, key=lambda f: json.dumps(f, sort_keys=True))
+
+
+@pytest.fixture(autouse=True)
+def sans_cache_disque(monkeypatch):
+    monkeypatch.setattr(cache_http, 'actif', False)
+
+
+@pytest.fixture
+def serveur(tmp_path, monkeypatch):
+    """ Serveur de rejeu local servant les couches synthétiques"""
+
+    for name, data in get_couches().items():
+        with gzip.open(tmp_path / f'{name}.json.gz', 'wt', encoding='utf-8') as f:
+            json.dump(data, f)
+    server = rejeu.serve(rejeu.Rejeu(str(tmp_path)), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(api, 'BASE_URL', f'http://127.0.0.1:{server.server_address[1]}')
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('layer', ['bus', 'metro', 'arrets'])
+@pytest.mark.parametrize('page', [7, 50, 1000])
+def test_pages_serveur_local(serveur, layer, page):
+    features = wfs.read_features(layer, page=page)
+    assert trie(features) == get_attendu(get_couches()[f'wfs.{layer}'], layer)
+
+
+def test_filtre_last_update(serveur):
+    filtre = ('>', 'last_update', '2022-01-20 00:00:00')
+    features = wfs.read_features('arrets', filtre=filtre, page=10)
+    attendu = get_attendu(get_couches()['wfs.arrets'], 'arrets', filtre)
+    assert 0 < len(features) < 120
+    assert trie(features) == attendu
+
+
+def get_serveur_sans_pages(monkeypatch, data, respecte_count):
+    """ api.get_chunks d'un serveur qui ignore startIndex (et count si `respecte_count` est faux)
+        Retourne la liste des URL demandées"""
+
+    appels = []
+    lock = threading.Lock()
+
+    def get_chunks(url, auth=None):
+        with lock:
+            appels.append(url)
+            assert len(appels) <= MAX_APPELS, "pagination sans fin"
+        query = {k.lower(): v for k, v in parse_qs(urlparse(url).query).items()}
+        features = data['features'][:int(query['count'][0])] if respecte_count and 'count' in query \
+            else data['features']
+        yield json.dumps(dict(data, features=features)).encode()
+
+    monkeypatch.setattr(api, 'get_chunks', get_chunks)
+    return appels
+
+
+@pytest.mark.parametrize('respecte_count', [False, True])
+def test_serveur_sans_pagination(monkeypatch, respecte_count):
+    data = get_couches()['wfs.bus']
+    appels = get_serveur_sans_pages(monkeypatch, data, respecte_count)
+    features = wfs.read_features('bus', page=50)
+    assert trie(features) == get_attendu(data, 'bus')
+    assert len(appels) <= wfs.PARALLELE + 1
+
+
+def test_replay_benchmarks():
+    couches = get_couches()
+    textes = {name: json.dumps(data) for name, data in couches.items()}
+    with fixtures.replay(textes):
+        for layer in ['bus', 'metro', 'arrets']:
+            features = wfs.read_features(layer, page=40)
+            attendu = get_attendu(couches[f'wfs.{layer}'], layer)
+            assert trie(features) == attendu